@@ -1,5 +1,8 @@
 import sys
 import csv
+from collections import deque
+
+from instrumentation import stage
 
 # Load the baseline data from the CSV file
 def load_baseline_data(baseline_csv):
@@ -13,11 +16,38 @@ def load_baseline_data(baseline_csv):
             }
     return baseline_data
 
-# Parse the access lists and check object groups against the baseline data
+# Resolve, for every object group, whether it contains a baseline subnet at any nesting depth
+def resolve_baseline_groups(baseline_data):
+    # Invert the nesting graph once: nested group -> groups that include it
+    parents = {}
+    for obj_group, info in baseline_data.items():
+        for nested_group in info['Nested Object Groups'].split(';'):
+            nested_group = nested_group.strip()
+            if nested_group:
+                parents.setdefault(nested_group, []).append(obj_group)
+
+    # Walk upwards from the groups flagged 'true'; each group is resolved at most once,
+    # so nesting cycles terminate instead of recursing forever
+    resolved = {obj_group: False for obj_group in baseline_data}
+    queue = deque(obj_group for obj_group, info in baseline_data.items() if info['Baseline Subnet'] == 'true')
+    for obj_group in queue:
+        resolved[obj_group] = True
+    while queue:
+        obj_group = queue.popleft()
+        for parent in parents.get(obj_group, ()):
+            if not resolved.get(parent):
+                resolved[parent] = True
+                queue.append(parent)
+    return resolved
+
+# Parse the access lists and check object groups against the baseline data; returns the number of access lists read
 def parse_access_lists_with_baseline(access_lists_file, baseline_data, output_file):
     results = []
+    baseline_groups = resolve_baseline_groups(baseline_data)
+    lines_read = 0
     with open(access_lists_file, 'r') as file:
         for line in file:
+            lines_read += 1
             line = line.strip()
             parts = line.split()
 
@@ -27,19 +57,9 @@ def parse_access_lists_with_baseline(access_lists_file, baseline_data, output_fi
                 if parts[i] == 'object-group' and i + 1 < len(parts):
                     object_groups.append(parts[i + 1])
 
-            # Check if the object groups or their nested groups are baseline
-            for obj_group in object_groups:
-                if obj_group in baseline_data:
-                    baseline_info = baseline_data[obj_group]
-                    if baseline_info['Baseline Subnet'] == 'true':
-                        results.append(line)
-                        break
-                    else:
-                        # Check nested object groups
-                        nested_groups = baseline_info['Nested Object Groups'].split(';')
-                        if any(baseline_data.get(nested_group, {}).get('Baseline Subnet') == 'true' for nested_group in nested_groups):
-                            results.append(line)
-                            break
+            # Check if the object groups (through any nesting depth) are baseline
+            if any(baseline_groups.get(obj_group, False) for obj_group in object_groups):
+                results.append(line)
 
     # Write the results to the output CSV file
     with open(output_file, 'w', newline='') as csvfile:
@@ -47,6 +67,7 @@ def parse_access_lists_with_baseline(access_lists_file, baseline_data, output_fi
         writer.writerow(['Access List Command'])
         for result in results:
             writer.writerow([result])
+    return lines_read
 
 # Main function to run the program with arguments
 def main():
@@ -59,10 +80,13 @@ def main():
     output_file = 'filtered_access_lists.csv'  # Output CSV file
 
     # Load the baseline data from the CSV file
-    baseline_data = load_baseline_data(baseline_csv)
+    with stage('load_baseline_data') as phase:
+        baseline_data = load_baseline_data(baseline_csv)
+        phase.rows = len(baseline_data)
 
     # Parse access lists and check against baseline data
-    parse_access_lists_with_baseline(access_lists_file, baseline_data, output_file)
+    with stage('filter_access_lists') as phase:
+        phase.rows = parse_access_lists_with_baseline(access_lists_file, baseline_data, output_file)
 
     print(f"CSV file '{output_file}' has been created successfully.")
 
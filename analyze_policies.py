@@ -1,6 +1,14 @@
 import os
-import sys
 import csv
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from instrumentation import stage
+
+# Bumped whenever the cached result format changes
+CACHE_VERSION = 3
 
 def read_csv(file_path):
     """
@@ -16,78 +24,194 @@ def read_csv(file_path):
         print(f"Error reading file {file_path}: {e}")
     return data
 
-def analyze_policy_files(npd_changes, zone_data, policy_folder):
+def normalize_zone(zone):
     """
-    Analyze each policy file in the folder and compare it with the NPD changes and Zone data.
+    Normalize a zone name for comparison.
+    """
+    return zone.strip().lower()
+
+def index_npd_changes(npd_changes):
+    """
+    Index the NPD changes by (Tech Sep, Change Number), keeping the first change for each key.
+    """
+    npd_index = {}
+    for change in npd_changes:
+        npd_index.setdefault((change['Tech Sep'], change['Change Number']), change)
+    return npd_index
+
+def build_zone_map(zone_data):
+    """
+    Map each normalized firewall zone to the set of normalized NPD zones it corresponds to.
+    """
+    zone_map = {}
+    for zone in zone_data:
+        zone_map.setdefault(normalize_zone(zone['Firewall Zone']), set()).add(normalize_zone(zone['NPD Zone']))
+    return zone_map
+
+def match_zones(policy_zones, zone_map, npd_zone):
+    """
+    Return "Matched" if any of the policy zones maps to the NPD zone, otherwise "Not Found".
+    """
+    mapped_npd_zones = set()
+    for zone in policy_zones:
+        mapped_npd_zones |= zone_map.get(zone, set())
+    return "Matched" if mapped_npd_zones & {normalize_zone(npd_zone)} else "Not Found"
+
+def analyze_policy_file(policy_folder, policy_file, npd_index, zone_map):
+    """
+    Analyze a single policy file against its NPD change and return its result rows.
     """
     results = []
+    policy_path = os.path.join(policy_folder, policy_file)
+    policy_data = read_csv(policy_path)
+
+    # Extract tech sep and change number from the filename
+    parts = policy_file.split(' ')
+    tech_sep = parts[2]
+    change_number = parts[3].replace('.csv', '')
+
+    # Find corresponding NPD change
+    matching_change = npd_index.get((tech_sep, change_number))
+    if not matching_change:
+        return results
+
+    # Extract NPD change details
+    npd_source_zone = matching_change['Source Zone']
+    npd_dest_zone = matching_change['Destination Zone']
+    npd_service = matching_change['Service']
+    change_history_number = matching_change['Change History#']
+
+    # Analyze each policy entry
+    for policy in policy_data:
+        policy_source_zones = [normalize_zone(zone) for zone in policy['Source Zone'].split(',')]
+        policy_dest_zones = [normalize_zone(zone) for zone in policy['Destination Zone'].split(',')]
+        policy_service = policy['Service'].lower()
+
+        # Check source and destination zone match
+        source_zone_match = match_zones(policy_source_zones, zone_map, npd_source_zone)
+        dest_zone_match = match_zones(policy_dest_zones, zone_map, npd_dest_zone)
+
+        # Check service match
+        service_match = "Matched" if npd_service.lower() in policy_service else "Not Matched"
+
+        results.append({
+            'Policy Name': policy['Name'],
+            'Source Zone Match': source_zone_match,
+            'Destination Zone Match': dest_zone_match,
+            'Service': policy['Service'],
+            'Service Match': service_match,
+            'Change Number': change_number,
+            'Change History#': change_history_number,
+            'Tech Sep': tech_sep
+        })
+
+    return results
+
+def file_digest(file_path):
+    """
+    Return the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def inputs_digest(npd_changes, zone_data):
+    """
+    Return a digest of the NPD changes and zone data; cached results are only valid for the same inputs.
+    """
+    return hashlib.sha256(json.dumps([npd_changes, zone_data], sort_keys=True).encode('utf-8')).hexdigest()
+
+def load_cache(cache_file, digest):
+    """
+    Load the per-file result cache, discarding it if it was built from different NPD/zone inputs.
+    """
+    try:
+        with open(cache_file, 'r') as file:
+            cache = json.load(file)
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION or cache.get('inputs') != digest:
+        return {}
+    return cache.get('files', {})
+
+def save_cache(cache_file, digest, files):
+    """
+    Save the per-file result cache.
+    """
+    with open(cache_file, 'w') as file:
+        json.dump({'version': CACHE_VERSION, 'inputs': digest, 'files': files}, file)
+
+_WORKER_STATE = None
 
-    for policy_file in os.listdir(policy_folder):
-        if policy_file.endswith(".csv"):
+def _init_worker(policy_folder, npd_index, zone_map):
+    global _WORKER_STATE
+    _WORKER_STATE = (policy_folder, npd_index, zone_map)
+
+def _analyze_in_worker(policy_file):
+    policy_folder, npd_index, zone_map = _WORKER_STATE
+    return analyze_policy_file(policy_folder, policy_file, npd_index, zone_map)
+
+def analyze_policy_files(npd_changes, zone_data, policy_folder, workers=1, cache_file=None):
+    """
+    Analyze each policy file in the folder and compare it with the NPD changes and Zone data.
+
+    Files are spread across `workers` processes. When `cache_file` is given, results of
+    policy files whose path, size/mtime or content hash are unchanged since the previous run
+    are reused; the cache is discarded when the NPD changes or zone data change. Files that
+    cannot be read are analyzed but never cached.
+    """
+    workers = workers or os.cpu_count() or 1
+    npd_index = index_npd_changes(npd_changes)
+    zone_map = build_zone_map(zone_data)
+    policy_files = [policy_file for policy_file in os.listdir(policy_folder) if policy_file.endswith(".csv")]
+
+    digest = inputs_digest(npd_changes, zone_data) if cache_file else None
+    cached = load_cache(cache_file, digest) if cache_file else {}
+    entries = {}
+    signatures = {}
+    pending = []
+    for policy_file in policy_files:
+        if cache_file:
             policy_path = os.path.join(policy_folder, policy_file)
-            policy_data = read_csv(policy_path)
-
-            # Extract tech sep and change number from the filename
-            parts = policy_file.split(' ')
-            tech_sep = parts[2]
-            change_number = parts[3].replace('.csv', '')
-
-            # Find corresponding NPD change
-            matching_change = None
-            for change in npd_changes:
-                if change['Tech Sep'] == tech_sep and change['Change Number'] == change_number:
-                    matching_change = change
-                    break
-            
-            if not matching_change:
-                continue
-
-            # Extract NPD change details
-            npd_source_zone = matching_change['Source Zone']
-            npd_dest_zone = matching_change['Destination Zone']
-            npd_service = matching_change['Service']
-            change_history_number = matching_change['Change History#']
-
-            # Analyze each policy entry
-            for policy in policy_data:
-                policy_source_zones = [zone.strip().lower() for zone in policy['Source Zone'].split(',')]
-                policy_dest_zones = [zone.strip().lower() for zone in policy['Destination Zone'].split(',')]
-                policy_service = policy['Service'].lower()
-
-                # Check source zone match
-                source_zone_match = "Not Found"
-                for source_zone in policy_source_zones:
-                    for zone in zone_data:
-                        if source_zone == zone['Firewall Zone'].lower() and zone['NPD Zone'].lower() == npd_source_zone.lower():
-                            source_zone_match = "Matched"
-                            break
-                    if source_zone_match == "Matched":
-                        break
-
-                # Check destination zone match
-                dest_zone_match = "Not Found"
-                for dest_zone in policy_dest_zones:
-                    for zone in zone_data:
-                        if dest_zone == zone['Firewall Zone'].lower() and zone['NPD Zone'].lower() == npd_dest_zone.lower():
-                            dest_zone_match = "Matched"
-                            break
-                    if dest_zone_match == "Matched":
-                        break
-
-                # Check service match
-                service_match = "Matched" if npd_service.lower() in policy_service else "Not Matched"
-
-                results.append({
-                    'Policy Name': policy['Name'],
-                    'Source Zone Match': source_zone_match,
-                    'Destination Zone Match': dest_zone_match,
-                    'Service': policy['Service'],
-                    'Service Match': service_match,
-                    'Change Number': change_number,
-                    'Change History#': change_history_number,
-                    'Tech Sep': tech_sep
-                })
+            entry = cached.get(policy_path)
+            try:
+                stat = os.stat(policy_path)
+                if entry and (entry['size'], entry['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+                    entries[policy_file] = entry
+                    continue
+                # Hash before analyzing, so a file rewritten meanwhile is cached under its old contents
+                content_hash = file_digest(policy_path)
+            except OSError:
+                pass  # Unreadable files are analyzed (read_csv reports them) but not cached
+            else:
+                signatures[policy_file] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': content_hash}
+                if entry and entry['sha256'] == content_hash:
+                    # Touched or copied but unchanged
+                    entries[policy_file] = dict(entry, **signatures[policy_file])
+                    continue
+        pending.append(policy_file)
+
+    # Analyze new or changed files, in parallel when more than one worker is requested
+    if workers == 1 or len(pending) < 2:
+        fresh = [analyze_policy_file(policy_folder, policy_file, npd_index, zone_map) for policy_file in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(policy_folder, npd_index, zone_map)) as executor:
+            fresh = list(executor.map(_analyze_in_worker, pending, chunksize=max(1, len(pending) // (4 * workers))))
+
+    for policy_file, file_results in zip(pending, fresh):
+        entries[policy_file] = dict(signatures.get(policy_file, {}), results=file_results)
 
+    if cache_file:
+        save_cache(cache_file, digest, {os.path.join(policy_folder, policy_file): entries[policy_file]
+                                        for policy_file in policy_files if 'sha256' in entries[policy_file]})
+
+    # Results keep the folder listing order, whether they were cached or freshly computed
+    results = []
+    for policy_file in policy_files:
+        results.extend(entries[policy_file]['results'])
     return results
 
 def save_results(results, output_file):
@@ -105,25 +229,28 @@ def save_results(results, output_file):
             writer.writerow(result)
 
 if __name__ == "__main__":
-    # Check if correct arguments are provided
-    if len(sys.argv) != 4:
-        print("Usage: python analyze_policies.py <NPD_Changes_File> <Zone_File> <Policies_Folder>")
-        sys.exit(1)
-
-    # Read arguments
-    npd_changes_file = sys.argv[1]
-    zone_file = sys.argv[2]
-    policies_folder = sys.argv[3]
+    parser = argparse.ArgumentParser(description="Analyze policy files against NPD changes and zone data.")
+    parser.add_argument('npd_changes_file', help="Path to the NPD changes CSV file.")
+    parser.add_argument('zone_file', help="Path to the zone mapping CSV file.")
+    parser.add_argument('policies_folder', help="Folder containing the policy CSV files.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Worker processes used to analyze policy files (default: CPU count).")
+    parser.add_argument('--cache', help="Per-file result cache (e.g. policy_analysis_cache.json); unchanged policy files are not analyzed again.")
+    args = parser.parse_args()
 
     # Read input files
-    npd_changes = read_csv(npd_changes_file)
-    zone_data = read_csv(zone_file)
+    with stage('read_inputs') as phase:
+        npd_changes = read_csv(args.npd_changes_file)
+        zone_data = read_csv(args.zone_file)
+        phase.rows = len(npd_changes) + len(zone_data)
 
     # Analyze policies
-    results = analyze_policy_files(npd_changes, zone_data, policies_folder)
+    with stage('analyze_policy_files') as phase:
+        results = analyze_policy_files(npd_changes, zone_data, args.policies_folder, args.workers, args.cache)
+        phase.rows = len(results)
 
     # Save results to a CSV file
     output_file = "policy_analysis_results.csv"
-    save_results(results, output_file)
+    with stage('save_results', rows=len(results)):
+        save_results(results, output_file)
 
     print(f"Results saved to {output_file}")
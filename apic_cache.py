@@ -0,0 +1,245 @@
+import argparse
+import hashlib
+import io
+import json
+import marshal
+import os
+import struct
+import tempfile
+import zlib
+
+# Directory of the parsed-export cache; caching is disabled when unset
+CACHE_DIR_ENV = 'FVC_APIC_CACHE_DIR'
+CACHE_VERSION = 2
+MEMO_FILE = 'index.json'
+ENTRY_SUFFIX = '.fvc'
+MAGIC = b'FVCAPIC\0'
+# magic, cache version, sha256 of the source export, length and CRC-32 of the section index
+HEADER = struct.Struct('<8sI32sQI')
+
+
+class CacheMiss(Exception):
+    """ Raised when a cache entry is missing, stale or unreadable; callers parse the export instead. """
+
+
+def file_digest(file_path, chunk_size=1 << 20):
+    """ Return the sha256 hex digest of a file's contents. """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def checksum(data):
+    # Detects truncated or corrupted sections; the header's sha256 identifies the source contents
+    return zlib.crc32(data)
+
+
+class _HashingReader(io.RawIOBase):
+    """ Raw binary reader that hashes exactly the bytes passed through it. """
+
+    def __init__(self, file):
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = self.file.readinto(buffer)
+        self.sha256.update(memoryview(buffer)[:count])
+        return count
+
+
+class HashedSource:
+    """
+    An export opened for parsing, hashed as it is read.
+
+    `text` is the decoded file for the parser; on exit the rest of the file is read
+    and `digest` is the sha256 of every byte that was parsed, so the entry is stored
+    under the contents it was built from even if the file changes meanwhile.
+    """
+
+    def __init__(self, file_path):
+        self.stat = os.stat(file_path)
+        self.raw = _HashingReader(open(file_path, 'rb'))
+        self.text = io.TextIOWrapper(io.BufferedReader(self.raw), encoding='utf-8')
+        self.digest = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        with self.text:
+            if exc_type is None:
+                self.text.buffer.read()  # Trailing bytes after the closing brace
+                self.digest = self.raw.sha256.hexdigest()
+            self.raw.file.close()
+
+
+class CacheEntry:
+    """ An opened cache entry: its verified section index, with sections read and verified on demand. """
+
+    def __init__(self, path, digest, sections, offset):
+        self.path = path
+        self.digest = digest
+        self.sections = sections
+        self.offset = offset
+
+    def section(self, name):
+        """ Return the bytes of a section, raising CacheMiss if it is absent or fails its checksum. """
+        try:
+            start, length, expected = self.sections[name]
+            with open(self.path, 'rb') as file:
+                file.seek(self.offset + start)
+                data = file.read(length)
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            raise CacheMiss(f"{self.path}: section {name!r}: {e}")
+        if len(data) != length or checksum(data) != expected:
+            raise CacheMiss(f"{self.path}: section {name!r} is corrupt")
+        return data
+
+
+class ApicCache:
+    """
+    Content-addressed cache of parsed APIC exports.
+
+    Each export is stored once as `<sha256>.fvc`: a fixed header (magic, version,
+    source digest, index length and checksum), a marshal index of named sections and
+    the sections themselves, each with its own CRC-32. apic_tables stores
+    one normalized class table per section, so a reader only decodes the classes it
+    uses. Entries hold marshal data only, never pickles, and anything that does not
+    verify is treated as a miss and rebuilt. A memo of path -> (size, mtime, digest)
+    avoids re-hashing unchanged files; a changed file gets a new digest and its stale
+    entry is dropped.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.memo_path = os.path.join(cache_dir, MEMO_FILE)
+
+    def _load_memo(self):
+        try:
+            with open(self.memo_path, 'r', encoding='utf-8') as file:
+                memo = json.load(file)
+            return memo if isinstance(memo, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save_memo(self, memo):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as file:
+            json.dump(memo, file)
+        os.replace(tmp_path, self.memo_path)
+
+    def digest(self, file_path):
+        """ Return the remembered content digest of file_path, or None if it is unknown or the file changed. """
+        stat = os.stat(file_path)
+        entry = self._load_memo().get(os.path.abspath(file_path))
+        if isinstance(entry, list) and len(entry) == 3 and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def remember(self, file_path, stat, digest):
+        """ Remember the digest of file_path as read at `stat`, unless the file changed since. """
+        current = os.stat(file_path)
+        if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return
+        key = os.path.abspath(file_path)
+        memo = self._load_memo()
+        entry = memo.get(key)
+        if (isinstance(entry, list) and len(entry) == 3 and entry[2] != digest
+                and all(other[2] != entry[2] for path, other in memo.items() if path != key)):
+            # The old contents are no longer referenced by any known path
+            self.remove(entry[2])
+        memo[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        self._save_memo(memo)
+
+    def cache_path(self, digest):
+        return os.path.join(self.cache_dir, f'{digest}{ENTRY_SUFFIX}')
+
+    def remove(self, digest):
+        try:
+            os.remove(self.cache_path(digest))
+        except (FileNotFoundError, TypeError):
+            pass
+
+    def read(self, digest):
+        """ Return the CacheEntry stored under digest, or None if there is no entry that verifies. """
+        if not digest:
+            return None
+        path = self.cache_path(digest)
+        try:
+            with open(path, 'rb') as file:
+                magic, version, source, length, expected = HEADER.unpack(file.read(HEADER.size))
+                index = file.read(length)
+            if (magic != MAGIC or version != CACHE_VERSION or source != bytes.fromhex(digest)
+                    or len(index) != length or checksum(index) != expected):
+                raise CacheMiss(f"{path}: stale or corrupt header")
+            sections = marshal.loads(index)
+            if not isinstance(sections, dict):
+                raise CacheMiss(f"{path}: corrupt section index")
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Truncated, foreign or older-format files are all misses
+            self.remove(digest)
+            return None
+        return CacheEntry(path, digest, sections, HEADER.size + length)
+
+    def write(self, digest, sections):
+        """ Store the {name: bytes} sections under digest, replacing the entry atomically. """
+        index, offset = {}, 0
+        for name, data in sections.items():
+            index[name] = (offset, len(data), checksum(data))
+            offset += len(data)
+        index = marshal.dumps(index)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(HEADER.pack(MAGIC, CACHE_VERSION, bytes.fromhex(digest), len(index), checksum(index)))
+                file.write(index)
+                for data in sections.values():
+                    file.write(data)
+            os.replace(tmp_path, self.cache_path(digest))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def open_source(self, file_path):
+        """ Open file_path for parsing, hashing the bytes as they are read (see HashedSource). """
+        return HashedSource(file_path)
+
+    def clear(self):
+        """ Delete every cache entry and the memo. """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((ENTRY_SUFFIX, '.tmp')) or name == MEMO_FILE:
+                os.remove(os.path.join(self.cache_dir, name))
+
+
+def cache_from_env():
+    """ Return the ApicCache configured by FVC_APIC_CACHE_DIR, or None when caching is disabled. """
+    cache_dir = os.environ.get(CACHE_DIR_ENV)
+    return ApicCache(cache_dir) if cache_dir else None
+
+
+if __name__ == "__main__":
+    from apic_tables import parse_into_cache
+
+    parser = argparse.ArgumentParser(description="Pre-parse APIC exports into the shared cache, or clear it.")
+    parser.add_argument('files', nargs='*', help="APIC JSON exports to parse into the cache.")
+    parser.add_argument('--cache-dir', default=os.environ.get(CACHE_DIR_ENV), help=f"Cache directory (default: ${CACHE_DIR_ENV}).")
+    parser.add_argument('--clear', action='store_true', help="Delete every cached export first.")
+    args = parser.parse_args()
+
+    if not args.cache_dir:
+        parser.error(f"set {CACHE_DIR_ENV} or pass --cache-dir")
+    cache = ApicCache(args.cache_dir)
+    if args.clear:
+        cache.clear()
+    for file_path in args.files:
+        tables = parse_into_cache(cache, file_path)
+        print(f"Cached {tables.elements} imdata elements ({len(tables.class_names)} classes) from {file_path}")
@@ -0,0 +1,93 @@
+import json
+
+_DECODER = json.JSONDecoder()
+_WHITESPACE = ' \t\n\r'
+
+
+class _JsonStream:
+    """ Minimal incremental JSON tokenizer over a text file, decoding one value at a time. """
+
+    def __init__(self, file, chunk_size):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size):
+        """ Read at least `size` more characters, dropping what has already been consumed. """
+        data = self.file.read(max(size, self.chunk_size))
+        if not data:
+            self.eof = True
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+
+    def next_char(self):
+        """ Skip whitespace and return the next character without consuming it ('' at EOF). """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.fill(self.chunk_size)
+
+    def take(self, expected):
+        """ Consume the next non-whitespace character and return it if it is one of `expected`. """
+        char = self.next_char()
+        if not char or char not in expected:
+            raise ValueError(f"Malformed APIC export: expected one of {expected!r}, found {char!r}")
+        self.pos += 1
+        return char
+
+    def decode(self):
+        """ Decode the next complete JSON value, reading more of the file until it is complete. """
+        self.next_char()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buffer, self.pos)
+                # A value that ends at the buffer edge (e.g. a number) may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Grow geometrically so a large object is re-scanned O(log size) times at most
+            self.fill(len(self.buffer) - self.pos)
+
+
+def iter_imdata(file_path, chunk_size=1 << 20):
+    """
+    Yield the elements of an APIC export's top-level 'imdata' list one at a time.
+
+    Only one element (e.g. an fvAEPg with its children, or a vzBrCP with its
+    subjects) is held in memory at once, so peak memory is bounded by the
+    largest single object rather than the size of the export. Scripts read
+    the parsed-export cache through apic_tables.read_export instead.
+    """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        yield from parse_imdata(file, chunk_size)
+
+
+def parse_imdata(file, chunk_size=1 << 20):
+    """ Yield the imdata elements of an APIC export from an open text file. """
+    stream = _JsonStream(file, chunk_size)
+    stream.take('{')
+    if stream.next_char() == '}':
+        return
+    while True:
+        key = stream.decode()
+        stream.take(':')
+        if key == 'imdata' and stream.next_char() == '[':
+            stream.take('[')
+            if stream.next_char() == ']':
+                stream.take(']')
+            else:
+                while True:
+                    yield stream.decode()
+                    if stream.take(',]') == ']':
+                        break
+        else:
+            stream.decode()  # Other top-level members such as totalCount
+        if stream.take(',}') == '}':
+            return
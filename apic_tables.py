@@ -0,0 +1,416 @@
+import marshal
+import os
+from array import array
+from itertools import groupby
+
+from apic_cache import CacheMiss, cache_from_env, file_digest
+from apic_stream import iter_imdata, parse_imdata
+
+# ClassTable.orders value for an object without an 'attributes' member
+NO_ATTRIBUTES = -1
+# ClassTable.orders value for an object body that is not shaped like an MO; readers stream such exports instead
+RAW_BODY = -2
+TABLES_VERSION = 2
+# Type code of the integer columns (node ids, parents, slots, ...)
+INT_TYPE = 'i'
+
+
+class ClassTable:
+    """
+    The objects of one MO class of an APIC export, stored as columns.
+
+    Row i is an object with node id ids[i] (document order across the whole export),
+    the node id of its parent object in parents[i] (-1 at the top level) and its slot:
+    the position in the parent's children list, or the index of its imdata element.
+    Each attribute is one column (None where a row lacks it); keysets[orders[i]] lists
+    the row's attribute names. children[i] is the length of the object's children list,
+    -1 when it has none. The integer columns are arrays, and `runs` holds the parents
+    and end rows of each run of consecutive rows with the same parent, so siblings are
+    grouped by slicing. Attribute columns missing from `columns` are fetched with
+    load_column(attribute).
+    """
+
+    __slots__ = ('name', 'ids', 'parents', 'slots', 'orders', 'keysets', 'columns', 'children', 'runs', '_load_column')
+
+    def __init__(self, name, ids=(), parents=(), slots=(), orders=(), keysets=(), columns=None, children=(), runs=None,
+                 load_column=None):
+        self.name = name
+        self.ids, self.parents, self.slots, self.orders, self.children = (
+            column if isinstance(column, array) else array(INT_TYPE, column)
+            for column in (ids, parents, slots, orders, children))
+        self.keysets = keysets
+        self.columns = columns or {}
+        if runs is None:
+            run_parents, run_ends, end = array(INT_TYPE), array(INT_TYPE), 0
+            for parent, run in groupby(self.parents):
+                end += sum(1 for _ in run)
+                run_parents.append(parent)
+                run_ends.append(end)
+            runs = (run_parents, run_ends)
+        self.runs = runs
+        self._load_column = load_column
+
+    def __len__(self):
+        return len(self.ids)
+
+    def attribute_names(self):
+        """ Return the names of every attribute of the class, in first-seen order. """
+        return list(dict.fromkeys(name for keys in self.keysets for name in keys))
+
+    def column(self, attribute):
+        """ Return the column of an attribute, or None if no object of the class has it. """
+        column = self.columns.get(attribute)
+        if column is None and self._load_column is not None and any(attribute in keys for keys in self.keysets):
+            column = self.columns[attribute] = self._load_column(attribute)
+        return column
+
+    def get(self, attribute, default=None):
+        """ Return the attribute's value for every row, `default` where the object does not have it. """
+        column = self.column(attribute)
+        if column is None:
+            return [default] * len(self.ids)
+        present = [attribute in keys for keys in self.keysets]
+        if all(present) and min(self.orders, default=0) >= 0:
+            return column
+        return [value if order >= 0 and present[order] else default for value, order in zip(column, self.orders)]
+
+    def has(self, attribute):
+        """ Return, for every row, whether the object has the attribute. """
+        present = [attribute in keys for keys in self.keysets]
+        if all(present) and min(self.orders, default=0) >= 0:
+            return [True] * len(self.ids)
+        return [order >= 0 and present[order] for order in self.orders]
+
+    def attributes_of(self, rows):
+        """ Return the attributes of each row as a dict ({} for an object without attributes). """
+        columns = {name: self.column(name) for name in self.attribute_names()}
+        keysets = self.keysets
+        return [{name: columns[name][row] for name in keysets[order]} if order >= 0 else {}
+                for row, order in zip(rows, map(self.orders.__getitem__, rows))]
+
+    def is_empty(self, row):
+        """ Return True if the object's body was an empty dict (falsy, like `{}` in the export). """
+        return self.orders[row] == NO_ATTRIBUTES and self.children[row] < 0
+
+    def to_bytes(self):
+        """ Encode everything but the attribute columns, which are stored one per section (column_bytes). """
+        integers = [column.tobytes() for column in (self.ids, self.parents, self.slots, self.orders, self.children,
+                                                     *self.runs)]
+        return marshal.dumps((integers, self.keysets))
+
+    def column_bytes(self, attribute):
+        return marshal.dumps(self.column(attribute))
+
+    @classmethod
+    def from_bytes(cls, name, data, load_column):
+        """ Decode a table written by to_bytes, raising CacheMiss if it is not well formed. """
+        try:
+            integers, keysets = marshal.loads(data)
+            ids, parents, slots, orders, children, run_parents, run_ends = (array(INT_TYPE, column) for column in integers)
+            count = len(ids)
+            valid = (all(len(column) == count for column in (parents, slots, orders, children))
+                     and isinstance(keysets, tuple) and all(isinstance(keys, tuple) for keys in keysets)
+                     and max(orders, default=-1) < len(keysets)
+                     and len(run_parents) == len(run_ends) and (run_ends[-1] if run_ends else 0) == count)
+        except Exception as e:
+            raise CacheMiss(f"unreadable table {name}: {e}")
+        if not valid:
+            raise CacheMiss(f"malformed table {name}")
+        return cls(name, ids, parents, slots, orders, keysets, None, children, (run_parents, run_ends), load_column)
+
+    @staticmethod
+    def column_from_bytes(name, attribute, data, count):
+        """ Decode a column written by column_bytes, raising CacheMiss unless it is a tuple of `count` values. """
+        try:
+            column = marshal.loads(data)
+        except Exception as e:
+            raise CacheMiss(f"unreadable column {name}.{attribute}: {e}")
+        if not isinstance(column, tuple) or len(column) != count:
+            raise CacheMiss(f"malformed column {name}.{attribute}")
+        return column
+
+
+class ExportTables:
+    """
+    The class tables of one APIC export.
+
+    `elements` is the number of imdata elements and `non_objects` the number of them
+    that are not JSON objects. Tables are produced on first use by `loader` (from the
+    cache) or come ready-built from a parse. `digest` is the sha256 of the export
+    contents the tables were built from, when known.
+    """
+
+    def __init__(self, elements, non_objects, class_names, tables=None, loader=None, digest=None):
+        self.elements = elements
+        self.non_objects = non_objects
+        self.digest = digest
+        self.class_names = tuple(class_names)
+        self._tables = dict(tables or {})
+        self._loader = loader
+
+    def table(self, name):
+        """ Return the ClassTable of an MO class (empty if the export has no such objects). """
+        table = self._tables.get(name)
+        if table is None:
+            table = self._loader(name) if self._loader and name in self.class_names else ClassTable(name)
+            self._tables[name] = table
+        return table
+
+    def regular(self, classes):
+        """
+        Return True if every imdata element is a JSON object and every object of the
+        classes is shaped like an MO. `classes` maps a class name to None, or to the
+        attributes every object of the class must have (an empty tuple requires only an
+        'attributes' member), as a reader that indexes them directly expects.
+        """
+        if self.non_objects:
+            return False
+        for name, required in classes.items():
+            table = self.table(name)
+            orders = set(table.orders)
+            if RAW_BODY in orders or required is not None and NO_ATTRIBUTES in orders:
+                return False
+            if required and any(attribute not in table.keysets[order] for order in orders for attribute in required):
+                return False
+        return True
+
+    def top_rows(self, name):
+        """ Return the rows of the top-level `name` objects in document order (their slot is the element index). """
+        return [row for row, parent in enumerate(self.table(name).parents) if parent < 0]
+
+    def child_rows(self, name, parents):
+        """ Return {parent node id: [row, ...]} for the `name` objects directly under `parents`, in document order. """
+        return self._group(self.table(name), range(len(self.table(name))), parents)
+
+    def child_values(self, name, attribute, parents, default=None):
+        """ Return {parent node id: [value, ...]} of an attribute of the `name` objects under `parents`, in document order. """
+        table = self.table(name)
+        return self._group(table, table.get(attribute, default), parents)
+
+    @staticmethod
+    def _group(table, values, parents):
+        grouped = {}
+        start = 0
+        # Siblings of one class are consecutive rows, so each run of equal parents is taken as one slice
+        for parent, end in zip(*table.runs):
+            if parent in parents:
+                if parent in grouped:
+                    grouped[parent].extend(values[start:end])
+                else:
+                    grouped[parent] = list(values[start:end])
+            start = end
+        return grouped
+
+    def to_sections(self):
+        """
+        Return the sections stored in the cache: '' holds the export summary, each class
+        name its table and each (class name, attribute) one attribute column.
+        """
+        sections = {'': marshal.dumps((TABLES_VERSION, self.elements, self.non_objects, self.class_names))}
+        for name in self.class_names:
+            table = self.table(name)
+            sections[name] = table.to_bytes()
+            for attribute in table.attribute_names():
+                sections[(name, attribute)] = table.column_bytes(attribute)
+        return sections
+
+
+class _TableRows:
+    """ The rows of one class while an export is being normalized. """
+
+    __slots__ = ('ids', 'parents', 'slots', 'orders', 'children', 'keysets', 'values')
+
+    def __init__(self):
+        self.ids = []
+        self.parents = []
+        self.slots = []
+        self.orders = []
+        self.children = []
+        self.keysets = {}
+        self.values = []  # One tuple of attribute values per row, in the order of its keyset
+
+    def table(self, name):
+        keysets = tuple(self.keysets)
+        columns = {}
+        if len(keysets) == 1 and NO_ATTRIBUTES not in self.orders and RAW_BODY not in self.orders:
+            # Every row has the same attributes in the same order: transpose the rows in one go
+            columns = dict(zip(keysets[0], zip(*self.values)))
+        else:
+            count = len(self.ids)
+            for keys in keysets:
+                for key in keys:
+                    columns.setdefault(key, [None] * count)
+            for row, (order, values) in enumerate(zip(self.orders, self.values)):
+                if order >= 0:
+                    for key, value in zip(keysets[order], values):
+                        columns[key][row] = value
+            columns = {key: tuple(column) for key, column in columns.items()}
+        return ClassTable(name, self.ids, self.parents, self.slots, self.orders, keysets, columns, self.children)
+
+
+class TableBuilder:
+    """ Normalize imdata elements into ClassTables. """
+
+    def __init__(self):
+        self.elements = 0
+        self.non_objects = 0
+        self.nodes = 0
+        self._tables = {}
+
+    def add(self, element):
+        index = self.elements
+        self.elements += 1
+        if not isinstance(element, dict):
+            self.non_objects += 1
+            return
+
+        tables = self._tables
+        # (class name, body, parent node id, slot) of the objects still to visit, in document order
+        stack = [(name, body, -1, index) for name, body in reversed(element.items())]
+        while stack:
+            name, body, parent, slot = stack.pop()
+            node = self.nodes
+            self.nodes += 1
+            attributes = body.get('attributes') if isinstance(body, dict) else None
+            children = body.get('children') if isinstance(body, dict) else None
+            shaped = (isinstance(body, dict) and len(body) == (attributes is not None) + (children is not None)
+                      and (attributes is None or isinstance(attributes, dict))
+                      and (children is None or isinstance(children, list) and all(isinstance(child, dict) for child in children)))
+
+            rows = tables.get(name)
+            if rows is None:
+                rows = tables[name] = _TableRows()
+            rows.ids.append(node)
+            rows.parents.append(parent)
+            rows.slots.append(slot)
+            if not shaped:
+                # Only marked: readers of the class stream the export instead (ExportTables.regular)
+                rows.orders.append(RAW_BODY)
+                rows.children.append(-1)
+                rows.values.append(())
+                continue
+            if attributes is None:
+                rows.orders.append(NO_ATTRIBUTES)
+                rows.values.append(())
+            else:
+                keys = tuple(attributes)
+                order = rows.keysets.get(keys)
+                if order is None:
+                    order = rows.keysets[keys] = len(rows.keysets)
+                rows.orders.append(order)
+                rows.values.append(tuple(attributes.values()))
+            rows.children.append(-1 if children is None else len(children))
+
+            if children:
+                for position in range(len(children) - 1, -1, -1):
+                    stack.extend((child_name, child_body, node, position)
+                                 for child_name, child_body in reversed(children[position].items()))
+
+    def finish(self):
+        """ Return the ExportTables of the elements added so far. """
+        tables = {name: rows.table(name) for name, rows in self._tables.items()}
+        return ExportTables(self.elements, self.non_objects, tables, tables)
+
+
+def build_tables(imdata):
+    """ Normalize an iterable of imdata elements into ExportTables. """
+    builder = TableBuilder()
+    for element in imdata:
+        builder.add(element)
+    return builder.finish()
+
+
+def read_export(file_path, read_imdata, read_tables, classes):
+    """
+    Read an APIC export with read_tables(ExportTables) from the parsed-export cache when
+    FVC_APIC_CACHE_DIR is set, or with read_imdata(iter_imdata(file_path)) otherwise.
+
+    Both readers must return the same result. The export is also streamed when the
+    cached `classes` are not regular (see ExportTables.regular), so read_tables only
+    has to handle well-formed MOs.
+    """
+    tables = cached_export(file_path)
+    if tables is not None and tables.regular(classes):
+        return read_tables(tables)
+    return read_imdata(iter_imdata(file_path))
+
+
+def cached_export(file_path):
+    """
+    Return the ExportTables of an APIC export from the parsed-export cache.
+
+    Returns None when FVC_APIC_CACHE_DIR is unset. A hit only decodes the class tables
+    and columns that are used, and a miss parses the export once and stores every class.
+    """
+    cache = cache_from_env()
+    return cached_tables(cache, file_path) if cache is not None else None
+
+
+def cached_tables(cache, file_path):
+    """ Return the ExportTables of file_path from `cache`, parsing and storing them on a miss. """
+    digest = cache.digest(file_path)
+    if digest is None:
+        # Unknown or changed file: the same contents may already be cached under another path
+        stat = os.stat(file_path)
+        digest = file_digest(file_path)
+        cache.remember(file_path, stat, digest)
+    entry = cache.read(digest)
+    if entry is not None:
+        try:
+            version, elements, non_objects, class_names = marshal.loads(entry.section(''))
+            if version != TABLES_VERSION:
+                raise CacheMiss(f"tables version {version}")
+            return _CachedExportTables(elements, non_objects, class_names, entry, cache, file_path)
+        except Exception:
+            cache.remove(digest)
+    return parse_into_cache(cache, file_path)
+
+
+def parse_into_cache(cache, file_path):
+    """ Parse file_path into ExportTables and store them under the digest of the bytes that were parsed. """
+    with cache.open_source(file_path) as source:
+        tables = build_tables(parse_imdata(source.text))
+    tables.digest = source.digest
+    cache.write(source.digest, tables.to_sections())
+    cache.remember(file_path, source.stat, source.digest)
+    return tables
+
+
+class _CachedExportTables(ExportTables):
+    """
+    ExportTables decoded from a cache entry, one table or column at a time.
+
+    Anything that fails to load falls back to re-parsing the export, which must still
+    have the contents the entry was built from.
+    """
+
+    def __init__(self, elements, non_objects, class_names, entry, cache, file_path):
+        super().__init__(elements, non_objects, class_names, loader=self._load, digest=entry.digest)
+        self._entry = entry
+        self._cache = cache
+        self._file_path = file_path
+        self._parsed = None
+
+    def _load(self, name):
+        if self._parsed is None:
+            try:
+                return ClassTable.from_bytes(name, self._entry.section(name),
+                                             lambda attribute: self._load_column(name, attribute))
+            except CacheMiss:
+                self._reparse()
+        return self._parsed.table(name)
+
+    def _load_column(self, name, attribute):
+        if self._parsed is None:
+            try:
+                return ClassTable.column_from_bytes(name, attribute, self._entry.section((name, attribute)),
+                                                    len(self.table(name)))
+            except CacheMiss:
+                self._reparse()
+        return self._parsed.table(name).column(attribute)
+
+    def _reparse(self):
+        self._cache.remove(self._entry.digest)
+        self._parsed = parse_into_cache(self._cache, self._file_path)
+        if self._parsed.digest != self.digest:
+            raise CacheMiss(f"{self._file_path} changed while it was being read from the cache")
@@ -1,17 +1,20 @@
 import csv
-import json
 import sys
 import ipaddress
 
+from apic_tables import read_export
+from instrumentation import stage
+from subnet_index import SubnetIndex
+
 def load_data(file_path, is_subnet=True):
-    """ Load data from a CSV file and return a dictionary for subnets or a set for contract names. """
-    data = {} if is_subnet else set()
+    """ Load data from a CSV file and return a SubnetIndex for subnets or a set for contract names. """
+    data = SubnetIndex() if is_subnet else set()
     with open(file_path, mode='r', encoding='utf-8') as file:
         reader = csv.DictReader(file)
         if is_subnet:
             for row in reader:
                 try:
-                    data[row['Boundary']] = ipaddress.ip_network(row['Boundary'])
+                    data.add(row['Boundary'])
                 except ValueError as e:
                     print(f"Error processing network: {row['Boundary']} - {e}")
         else:
@@ -19,6 +22,47 @@ def load_data(file_path, is_subnet=True):
                 data.add(row['Contract Name'])
     return data
 
+# Classes read by epg_endpoint_tables, with the attributes iter_epg_endpoints indexes directly
+EPG_CLASSES = {'fvAEPg': ('name',), 'fvCEp': ('ip', 'mac'), 'fvRsCons': (), 'fvRsProv': ()}
+
+def iter_epg_endpoints(imdata):
+    """
+    Yield (EPG name, [(ip, mac), ...], fvRsCons contract, fvRsProv contract) for every fvAEPg (e.g. from iter_imdata).
+
+    The contracts are those of the EPG's last fvRsCons/fvRsProv child.
+    """
+    for item in imdata:
+        if 'fvAEPg' in item:
+            endpoints = []
+            tnVzBrCPName_fvRsCons = None
+            tnVzBrCPName_fvRsProv = None
+            for child in item['fvAEPg'].get('children', []):
+                if 'fvCEp' in child:
+                    attributes = child['fvCEp']['attributes']
+                    endpoints.append((attributes['ip'], attributes['mac']))
+                if 'fvRsCons' in child:
+                    tnVzBrCPName_fvRsCons = child['fvRsCons']['attributes'].get('tnVzBrCPName', None)
+                if 'fvRsProv' in child:
+                    tnVzBrCPName_fvRsProv = child['fvRsProv']['attributes'].get('tnVzBrCPName', None)
+            yield item['fvAEPg']['attributes']['name'], endpoints, tnVzBrCPName_fvRsCons, tnVzBrCPName_fvRsProv
+
+def epg_endpoint_tables(tables):
+    """ Return the EPGs iter_epg_endpoints yields, from the export's cached ExportTables. """
+    epgs = tables.table('fvAEPg')
+    epg_rows = tables.top_rows('fvAEPg')
+    parents = {epgs.ids[row] for row in epg_rows}
+    ips = tables.child_values('fvCEp', 'ip', parents)
+    macs = tables.child_values('fvCEp', 'mac', parents)
+    consumed = tables.child_values('fvRsCons', 'tnVzBrCPName', parents)
+    provided = tables.child_values('fvRsProv', 'tnVzBrCPName', parents)
+    names = epgs.get('name')
+    rows = []
+    for row in epg_rows:
+        node = epgs.ids[row]
+        endpoints = list(zip(ips.get(node, []), macs.get(node, [])))
+        rows.append((names[row], endpoints, consumed.get(node, [None])[-1], provided.get(node, [None])[-1]))
+    return rows
+
 if __name__ == '__main__':
     if len(sys.argv) != 4:
         print("Usage: python script.py <GSU_Baseline.csv> <GSU_contracts_with_filters_and_ports.csv> <input.json>")
@@ -29,40 +73,26 @@ if __name__ == '__main__':
     json_file_path = sys.argv[3]
     output_file_path = 'baseline_contracts.csv'
 
-    subnets = load_data(baseline_file_path, is_subnet=True)
-    contract_names = load_data(contracts_file_path, is_subnet=False)
-
-    with open(json_file_path, 'r', encoding='utf-8') as file:
-        json_data = json.load(file)
+    with stage('load_subnets') as phase:
+        subnets = load_data(baseline_file_path, is_subnet=True)
+        phase.rows = len(subnets)
+    with stage('load_contracts') as phase:
+        contract_names = load_data(contracts_file_path, is_subnet=False)
+        phase.rows = len(contract_names)
 
-    with open(output_file_path, 'w', encoding='utf-8', newline='') as file:
+    # Single streamed pass over the export, matching and writing each EPG's endpoints
+    with stage('write_output') as phase, open(output_file_path, 'w', encoding='utf-8', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['Contract Name', 'Endpoint Name', 'IP', 'MAC', 'Contract Name (fvRsCons)', 'Contract Name (fvRsProv)', 'Subnet', 'Match Contract (fvRsCons)', 'Match Contract (fvRsProv)', 'Baseline'])
-        for item in json_data['imdata']:
-            if 'fvAEPg' in item:
-                endpoint_name = item['fvAEPg']['attributes']['name']
-                for epg in item['fvAEPg'].get('children', []):
-                    if 'fvCEp' in epg:
-                        attributes = epg['fvCEp']['attributes']
-                        ip_addr = attributes['ip']
-                        fvCEp_mac = attributes['mac']
-                        subnet_entry = ""
-                        for subnet_str, subnet in subnets.items():
-                            if ipaddress.ip_address(ip_addr) in subnet:
-                                subnet_entry = subnet_str
-                                break
-                        tnVzBrCPName_fvRsCons = None
-                        tnVzBrCPName_fvRsProv = None
-                        contract_name = None
-                        for rel in item['fvAEPg'].get('children', []):
-                            if 'fvRsCons' in rel:
-                                tnVzBrCPName_fvRsCons = rel['fvRsCons']['attributes'].get('tnVzBrCPName', None)
-                            if 'fvRsProv' in rel:
-                                tnVzBrCPName_fvRsProv = rel['fvRsProv']['attributes'].get('tnVzBrCPName', None)
-                                contract_name = tnVzBrCPName_fvRsProv  # Assuming contract name comes from fvRsProv
-                        match_contract_fvRsCons = "yes" if tnVzBrCPName_fvRsCons in contract_names else "no"
-                        match_contract_fvRsProv = "yes" if tnVzBrCPName_fvRsProv in contract_names else "no"
-                        baseline = "yes" if subnet_entry and match_contract_fvRsCons == "yes" and match_contract_fvRsProv == "yes" else "no"
-                        writer.writerow([contract_name, endpoint_name, ip_addr, fvCEp_mac, tnVzBrCPName_fvRsCons, tnVzBrCPName_fvRsProv, subnet_entry, match_contract_fvRsCons, match_contract_fvRsProv, baseline])
+        phase.rows = 0
+        for endpoint_name, endpoints, tnVzBrCPName_fvRsCons, tnVzBrCPName_fvRsProv in read_export(json_file_path, iter_epg_endpoints, epg_endpoint_tables, EPG_CLASSES):
+            contract_name = tnVzBrCPName_fvRsProv  # Assuming contract name comes from fvRsProv
+            match_contract_fvRsCons = "yes" if tnVzBrCPName_fvRsCons in contract_names else "no"
+            match_contract_fvRsProv = "yes" if tnVzBrCPName_fvRsProv in contract_names else "no"
+            for ip_addr, fvCEp_mac in endpoints:
+                subnet_entry = subnets.lookup_address(ipaddress.ip_address(ip_addr)) or ""
+                baseline = "yes" if subnet_entry and match_contract_fvRsCons == "yes" and match_contract_fvRsProv == "yes" else "no"
+                writer.writerow([contract_name, endpoint_name, ip_addr, fvCEp_mac, tnVzBrCPName_fvRsCons, tnVzBrCPName_fvRsProv, subnet_entry, match_contract_fvRsCons, match_contract_fvRsProv, baseline])
+            phase.rows += len(endpoints)
 
     print(f"File '{output_file_path}' has been generated.")
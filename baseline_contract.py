@@ -1,18 +1,22 @@
+import argparse
 import csv
-import json
-import sys
 import ipaddress
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+
+from apic_tables import read_export
+from compliance_store import store_from_env
+from instrumentation import stage
+from subnet_index import SubnetIndex, first_match_by_key
 
 def load_data(file_path, is_subnet=True):
-    """ Load data from a CSV file and return a dictionary for subnets or a set for contract names. """
-    data = {} if is_subnet else set()
+    """ Load data from a CSV file and return a SubnetIndex for subnets or a set for contract names. """
+    data = SubnetIndex() if is_subnet else set()
     with open(file_path, mode='r', encoding='utf-8') as file:
         reader = csv.DictReader(file)
         if is_subnet:
             for row in reader:
                 try:
-                    data[row['Boundary']] = ipaddress.ip_network(row['Boundary'])
+                    data.add(row['Boundary'])
                 except ValueError as e:
                     print(f"Error processing network: {row['Boundary']} - {e}")
         else:
@@ -32,25 +36,93 @@ def load_ep_data(ep_data_file):
             ep_data[epg_name].append(ip_address)
     return ep_data
 
+def load_ep_data_batch(ep_data_file, subnets):
+    """
+    Load the EP_Data file and classify its whole IP column in one vectorized pass.
+
+    Returns (ep_data, ep_subnets) where ep_subnets maps each EPG name to the
+    baseline subnet of its first EP_Data IP that falls in one.
+    """
+    epg_names = []
+    ip_addresses = []
+    with open(ep_data_file, mode='r', encoding='utf-8') as file:
+        reader = csv.reader(file)
+        next(reader)  # Skip header
+        for row in reader:
+            epg_names.append(row[4])
+            ip_addresses.append(row[2])
+
+    ep_data = defaultdict(list)
+    for epg_name, ip_address in zip(epg_names, ip_addresses):
+        ep_data[epg_name].append(ip_address)
+
+    ep_subnets = first_match_by_key(epg_names, ip_addresses, subnets)
+    return ep_data, ep_subnets
+
 def find_matching_subnet(ip, subnets):
-    """ Find and return the subnet that contains the IP address. """
+    """ Find and return the most specific subnet in the SubnetIndex that contains the IP address. """
     try:
         ip_addr = ipaddress.ip_address(ip)
-        for subnet_str, subnet in subnets.items():
-            if ip_addr in subnet:
-                return subnet_str
     except ValueError:
         return ""  # Return an empty string if the IP address is invalid
-    return ""
+    return subnets.lookup_address(ip_addr) or ""
+
+# Only the EPG fields read by the report: its name, preferred group membership, endpoint IPs and contracts
+EpgRecord = namedtuple('EpgRecord', ['name', 'preferred_group', 'ips', 'consumed', 'provided'])
+# Classes read by index_epg_tables, with the attributes index_epgs indexes directly
+EPG_CLASSES = {'fvAEPg': ('name',), 'fvCEp': (), 'fvRsCons': (), 'fvRsProv': ()}
+
+def index_epgs(imdata):
+    """
+    Build the EPG index in a single pass over the imdata elements.
 
-def search_ip_in_json(endpoint_name, json_data):
-    """ Search the JSON data for the IP address in the parent fvAEPg, child fvCEp, attribute 'ip'. """
-    for item in json_data['imdata']:
+    Returns the EpgRecords in export order and a dict mapping each EPG name to
+    its records (names can repeat across tenants/application profiles).
+    """
+    epgs = []
+    epg_index = defaultdict(list)
+    for item in imdata:
         if 'fvAEPg' in item:
-            if item['fvAEPg']['attributes']['name'] == endpoint_name:
-                for child in item['fvAEPg'].get('children', []):
-                    if 'fvCEp' in child:
-                        return child['fvCEp']['attributes'].get('ip', '')
+            attributes = item['fvAEPg']['attributes']
+            ips = []
+            consumed = []
+            provided = []
+            for child in item['fvAEPg'].get('children', []):
+                if 'fvCEp' in child:
+                    ips.append(child['fvCEp']['attributes'].get('ip', ''))
+                if 'fvRsCons' in child:
+                    consumed.append(child['fvRsCons']['attributes'].get('tnVzBrCPName', ''))
+                if 'fvRsProv' in child:
+                    provided.append(child['fvRsProv']['attributes'].get('tnVzBrCPName', ''))
+            epg = EpgRecord(attributes['name'], attributes.get('prefGrMemb', ''), ips, consumed, provided)
+            epgs.append(epg)
+            epg_index[epg.name].append(epg)
+    return epgs, epg_index
+
+def index_epg_tables(tables):
+    """ Build the same EPG index as index_epgs from an export's cached ExportTables (regular in EPG_CLASSES). """
+    epgs = []
+    epg_index = defaultdict(list)
+    epg_table = tables.table('fvAEPg')
+    epg_rows = tables.top_rows('fvAEPg')
+    parents = {epg_table.ids[row] for row in epg_rows}
+    ips = tables.child_values('fvCEp', 'ip', parents, '')
+    consumed = tables.child_values('fvRsCons', 'tnVzBrCPName', parents, '')
+    provided = tables.child_values('fvRsProv', 'tnVzBrCPName', parents, '')
+    names = epg_table.get('name')
+    preferred_groups = epg_table.get('prefGrMemb', '')
+    for row in epg_rows:
+        node = epg_table.ids[row]
+        epg = EpgRecord(names[row], preferred_groups[row], ips.get(node, []), consumed.get(node, []), provided.get(node, []))
+        epgs.append(epg)
+        epg_index[epg.name].append(epg)
+    return epgs, epg_index
+
+def search_ip_in_json(endpoint_name, epg_index):
+    """ Return the IP address of the first child fvCEp of the fvAEPg named endpoint_name, using the EPG index. """
+    for epg in epg_index.get(endpoint_name, []):
+        if epg.ips:
+            return epg.ips[0]
     return ""
 
 def determine_consumer_to_provider(global_consumers, global_providers, contract, preferred_group):
@@ -59,133 +131,126 @@ def determine_consumer_to_provider(global_consumers, global_providers, contract,
         return "yes"
     return "no"
 
-def recheck_and_update_subnets_in_output_file(output_file_path, subnets):
-    """ Recheck and update the 'Subnet' column if the IP belongs to a different subnet. """
-    updated_rows = []
-    
-    with open(output_file_path, mode='r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            ip_list = row['IP'].split(',')
-            matched_subnet = ""
-            for ip in ip_list:
-                if ip:
-                    matching_subnet = find_matching_subnet(ip, subnets)
-                    if matching_subnet and not matched_subnet:
-                        matched_subnet = matching_subnet
-            row['Subnet'] = matched_subnet
-            updated_rows.append(row)
-    
-    with open(output_file_path, mode='w', encoding='utf-8', newline='') as file:
-        writer = csv.DictWriter(file, fieldnames=reader.fieldnames)
-        writer.writeheader()
-        writer.writerows(updated_rows)
-
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print("Usage: python script.py <GSU_Baseline.csv> <GSU_contracts_with_filters_and_ports.csv> <EP_Data_2024_08_15-14_35.csv> <input.json>")
-        sys.exit(1)
-
-    baseline_file_path = sys.argv[1]
-    contracts_file_path = sys.argv[2]
-    ep_data_file = sys.argv[3]
-    json_file_path = sys.argv[4]
+    parser = argparse.ArgumentParser(description="Mark baseline contracts for every EPG in an APIC export.")
+    parser.add_argument('baseline_file', help="Path to GSU_Baseline.csv.")
+    parser.add_argument('contracts_file', help="Path to GSU_contracts_with_filters_and_ports.csv.")
+    parser.add_argument('ep_data_file', help="Path to EP_Data_2024_08_15-14_35.csv.")
+    parser.add_argument('json_file', help="Path to the APIC fvAEPg export (input.json).")
+    parser.add_argument('--batch', action='store_true', help="Classify the EP_Data IP column in one vectorized pass (uses NumPy when available); with FVC_STORE set, the subnets are still matched in memory and only the output is imported into the store.")
+    args = parser.parse_args()
+
+    baseline_file_path = args.baseline_file
+    contracts_file_path = args.contracts_file
+    ep_data_file = args.ep_data_file
+    json_file_path = args.json_file
     output_file_path = 'baseline_contracts.csv'
 
-    subnets = load_data(baseline_file_path, is_subnet=True)
-    contract_names = load_data(contracts_file_path, is_subnet=False)
-    ep_data = load_ep_data(ep_data_file)  # Load the EP_Data
+    with stage('load_subnets') as phase:
+        subnets = load_data(baseline_file_path, is_subnet=True)
+        phase.rows = len(subnets)
+    with stage('load_contracts') as phase:
+        contract_names = load_data(contracts_file_path, is_subnet=False)
+        phase.rows = len(contract_names)
+    with stage('load_ep_data') as phase:
+        if args.batch:
+            ep_data, ep_subnets = load_ep_data_batch(ep_data_file, subnets)
+        else:
+            ep_data = load_ep_data(ep_data_file)  # Load the EP_Data
+        phase.rows = sum(len(ips) for ips in ep_data.values())
 
-    with open(json_file_path, 'r', encoding='utf-8') as file:
-        json_data = json.load(file)
+    # Single streamed pass over the export to index every EPG, or its tables from the parsed-export cache
+    with stage('index_epgs') as phase:
+        epgs, epg_index = read_export(json_file_path, index_epgs, index_epg_tables, EPG_CLASSES)
+        phase.rows = len(epgs)
 
-    # To track all consumers and providers across all endpoints
-    global_consumers = {}
-    global_providers = {}
+    # With FVC_STORE set, resolve every EP_Data and fallback JSON IP in one indexed join against the stored baseline subnets;
+    # --batch has already classified the EP_Data IPs in memory, so it skips the join and only imports the output below
+    store = store_from_env()
+    ip_subnets = None
+    if store and not args.batch:
+        with stage('match_subnets') as phase:
+            if not store.is_current(baseline_file_path, 'subnets'):
+                store.save_subnets(baseline_file_path, subnets.networks())
+            lookup_ips = {ip for ips in ep_data.values() for ip in ips}
+            lookup_ips.update(epg.ips[0] for epg in epgs if epg.ips)
+            ip_subnets = store.match_subnets(baseline_file_path, lookup_ips)
+            phase.rows = len(lookup_ips)
 
-    # First pass to collect all consumers and providers
-    for item in json_data['imdata']:
-        if 'fvAEPg' in item:
-            endpoint_name = item['fvAEPg']['attributes']['name']
-            preferred_group = item['fvAEPg']['attributes'].get('prefGrMemb', '')
-
-            for child in item['fvAEPg'].get('children', []):
-                if 'fvRsCons' in child:
-                    contract = child['fvRsCons']['attributes'].get('tnVzBrCPName', '')
-                    global_consumers.setdefault(contract, []).append((endpoint_name, preferred_group))
-                if 'fvRsProv' in child:
-                    contract = child['fvRsProv']['attributes'].get('tnVzBrCPName', '')
-                    global_providers.setdefault(contract, []).append((endpoint_name, preferred_group))
+    # Contracts consumed/provided by at least one EPG excluded from the preferred group
+    exclude_consumers = set()
+    exclude_providers = set()
+    for epg in epgs:
+        if epg.preferred_group == "exclude":
+            exclude_consumers.update(epg.consumed)
+            exclude_providers.update(epg.provided)
 
-    # Second pass to determine baseline contract and write results
-    with open(output_file_path, 'w', encoding='utf-8', newline='') as file:
+    # Determine baseline contract and write results from the index
+    with stage('write_output') as phase, open(output_file_path, 'w', encoding='utf-8', newline='') as file:
         writer = csv.writer(file)
         writer.writerow(['Endpoint Name', 'Type of Endpoint', 'Contract associated to Endpoint', 'Preferred Group', 'IP', 'Subnet', 'Consumer to Provider', 'IP in Baseline Subnet', 'Baseline Contract'])
-        
-        for item in json_data['imdata']:
-            if 'fvAEPg' in item:
-                endpoint_name = item['fvAEPg']['attributes']['name']
-                preferred_group = item['fvAEPg']['attributes'].get('prefGrMemb', '')
-
-                consumers = []
-                providers = []
-
-                for child in item['fvAEPg'].get('children', []):
-                    if 'fvRsCons' in child:
-                        contract = child['fvRsCons']['attributes'].get('tnVzBrCPName', '')
-                        consumers.append(contract)
-                    if 'fvRsProv' in child:
-                        contract = child['fvRsProv']['attributes'].get('tnVzBrCPName', '')
-                        providers.append(contract)
-
-                # Determine "Consumer to Provider"
-                consumer_to_provider = "no"
-                for contract in consumers:
-                    if contract in global_providers:
-                        for prov_endpoint, prov_group in global_providers[contract]:
-                            if prov_group == "exclude" and preferred_group == "exclude":
-                                consumer_to_provider = "yes"
-                                break
-
-                for contract in providers:
-                    if contract in global_consumers:
-                        for cons_endpoint, cons_group in global_consumers[contract]:
-                            if cons_group == "exclude" and preferred_group == "exclude":
-                                consumer_to_provider = "yes"
-                                break
-
-                # Combine all IPs associated with the endpoint
-                associated_ips = ep_data.get(endpoint_name, [])
-                combined_ips = ','.join(associated_ips)
-
-                # If no IPs are found, search in the JSON file
-                if not combined_ips:
-                    associated_ip = search_ip_in_json(endpoint_name, json_data)
-                    combined_ips = associated_ip if associated_ip else ""
-
-                # Find matching subnet for the associated IPs
-                matching_subnet = ""
+
+        for epg in epgs:
+            endpoint_name = epg.name
+            preferred_group = epg.preferred_group
+            consumers = epg.consumed
+            providers = epg.provided
+
+            # Determine "Consumer to Provider"
+            consumer_to_provider = "no"
+            if preferred_group == "exclude":
+                if any(contract in exclude_providers for contract in consumers):
+                    consumer_to_provider = "yes"
+                if any(contract in exclude_consumers for contract in providers):
+                    consumer_to_provider = "yes"
+
+            # Combine all IPs associated with the endpoint
+            associated_ips = ep_data.get(endpoint_name, [])
+            combined_ips = ','.join(associated_ips)
+
+            # If no IPs are found, search in the JSON file
+            json_ip = ""
+            if not combined_ips:
+                json_ip = search_ip_in_json(endpoint_name, epg_index)
+                combined_ips = json_ip if json_ip else ""
+
+            # Find matching subnet for the associated IPs
+            matching_subnet = ""
+            if args.batch:
+                matching_subnet = ep_subnets.get(endpoint_name, "")
+            elif ip_subnets is not None:
+                matching_subnet = next((ip_subnets[ip] for ip in associated_ips if ip in ip_subnets), "")
+            else:
                 for ip in associated_ips:
                     subnet = find_matching_subnet(ip, subnets)
                     if subnet and not matching_subnet:
                         matching_subnet = subnet
 
-                # Determine "IP in Baseline Subnet"
-                ip_in_baseline_subnet = "yes" if matching_subnet else "no"
+            # Determine "IP in Baseline Subnet"
+            ip_in_baseline_subnet = "yes" if matching_subnet else "no"
 
-                # Set "Baseline Contract" based on "IP in Baseline Subnet"
-                baseline_contract = ip_in_baseline_subnet
+            # Set "Baseline Contract" based on "IP in Baseline Subnet"
+            baseline_contract = ip_in_baseline_subnet
 
-                # Write Consumers
-                for contract in consumers:
-                    writer.writerow([endpoint_name, 'Consumer', contract, preferred_group, combined_ips, matching_subnet, consumer_to_provider, ip_in_baseline_subnet, baseline_contract])
-                
-                # Write Providers
-                for contract in providers:
-                    writer.writerow([endpoint_name, 'Provider', contract, preferred_group, combined_ips, matching_subnet, consumer_to_provider, ip_in_baseline_subnet, baseline_contract])
+            # The "Subnet" column also resolves an IP that came from the JSON fallback
+            if json_ip:
+                matching_subnet = ip_subnets.get(json_ip, "") if ip_subnets is not None else find_matching_subnet(json_ip, subnets)
 
-    print(f"File '{output_file_path}' has been generated.")
+            # Write Consumers
+            for contract in consumers:
+                writer.writerow([endpoint_name, 'Consumer', contract, preferred_group, combined_ips, matching_subnet, consumer_to_provider, ip_in_baseline_subnet, baseline_contract])
+            
+            # Write Providers
+            for contract in providers:
+                writer.writerow([endpoint_name, 'Provider', contract, preferred_group, combined_ips, matching_subnet, consumer_to_provider, ip_in_baseline_subnet, baseline_contract])
+
+        output_rows = sum(len(epg.consumed) + len(epg.provided) for epg in epgs)
+        phase.rows = output_rows
 
-    # Recheck and update the subnets for all IPs in the output file
-    recheck_and_update_subnets_in_output_file(output_file_path, subnets)
-    print("Recheck and update of subnets completed.")
+    # Import the finished CSV into the compliance store when FVC_STORE is set
+    if store:
+        with stage('save_store', rows=output_rows):
+            store.import_epg_contracts_csv(output_file_path, subnets.networks(), ep_data)
+            store.close()
+
+    print(f"File '{output_file_path}' has been generated.")
@@ -0,0 +1,287 @@
+import argparse
+import csv
+import ipaddress
+import json
+import os
+import random
+
+# Every synthetic address lives in 10.0.0.0/8 or 172.16.0.0/12; the baseline covers part of 10.0.0.0/8
+ZONES = ['trust', 'untrust', 'dmz', 'core', 'mgmt', 'External', 'Internal']
+SERVICES = ['tcp-443', 'tcp-80', 'udp-53', 'tcp-22', 'tcp-8080', 'application-default']
+APPLICATIONS = ['ssl', 'web-browsing', 'dns', 'ssh', 'any']
+NAMED_PORTS = ['http', 'https', 'ssh', 'dns', 'smtp', 'unspecified']
+
+
+def random_ip(rng):
+    """ Return a random IPv4 address, mostly inside 10.0.0.0/8. """
+    if rng.random() < 0.8:
+        return str(ipaddress.IPv4Address(0x0A000000 + rng.randrange(1 << 24)))
+    return str(ipaddress.IPv4Address(0xAC100000 + rng.randrange(1 << 20)))
+
+
+def random_cidr(rng):
+    prefixlen = rng.choice([16, 20, 24, 24, 28, 32])
+    return str(ipaddress.ip_network(f'{random_ip(rng)}/{prefixlen}', strict=False))
+
+
+def generate_baseline(path, count, rng):
+    """ Write a *_Baseline.csv with `count` nested /16, /20 and /24 boundaries inside 10.0.0.0/8. """
+    boundaries = {}
+    while len(boundaries) < count:
+        prefixlen = rng.choice([16, 20, 24, 24, 24])
+        network = ipaddress.ip_network(f'10.{rng.randrange(64)}.{rng.randrange(256)}.0/{prefixlen}', strict=False)
+        boundaries.setdefault(str(network), f'baseline-{len(boundaries)}')
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Boundary', 'Name'])
+        writer.writerows(boundaries.items())
+
+
+def generate_apic_epgs(path, epg_count, endpoints_per_epg, contract_count, rng):
+    """ Write an APIC fvAEPg export with fvCEp, fvRsCons and fvRsProv children. """
+    imdata = []
+    for i in range(epg_count):
+        children = [{'fvCEp': {'attributes': {'ip': random_ip(rng), 'mac': f'00:50:56:{i % 256:02x}:{j % 256:02x}:01',
+                                              'name': f'ep-{i}-{j}'}}}
+                    for j in range(endpoints_per_epg)]
+        children += [{'fvRsCons': {'attributes': {'tnVzBrCPName': f'contract-{rng.randrange(contract_count)}'}}}
+                     for _ in range(rng.randint(1, 3))]
+        children += [{'fvRsProv': {'attributes': {'tnVzBrCPName': f'contract-{rng.randrange(contract_count)}'}}}
+                     for _ in range(rng.randint(0, 2))]
+        imdata.append({'fvAEPg': {'attributes': {'name': f'epg-{i}', 'dn': f'uni/tn-prod/ap-app/epg-epg-{i}',
+                                                 'prefGrMemb': rng.choice(['exclude', 'include'])},
+                                  'children': children}})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'totalCount': str(len(imdata)), 'imdata': imdata}, f)
+
+
+def generate_apic_contracts(path, contract_count, filter_count, rng):
+    """ Write an APIC vzBrCP export whose subjects reference vzFilters by name. """
+    imdata = []
+    for i in range(contract_count):
+        filters = [{'vzRsSubjFiltAtt': {'attributes': {'tnVzFilterName': f'filter-{rng.randrange(filter_count)}'}}}
+                   for _ in range(rng.randint(1, 3))]
+        imdata.append({'vzBrCP': {'attributes': {'name': f'contract-{i}', 'descr': f'synthetic contract {i}'},
+                                  'children': [{'vzSubj': {'attributes': {'name': f'subject-{i}'}, 'children': filters}}]}})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'totalCount': str(len(imdata)), 'imdata': imdata}, f)
+
+
+def generate_apic_filters(path, filter_count, rng):
+    """ Write an APIC vzFilter export with numeric, named and unspecified vzEntry ports. """
+    imdata = []
+    for i in range(filter_count):
+        entries = []
+        for j in range(rng.randint(1, 3)):
+            if rng.random() < 0.5:
+                start = end = rng.choice(NAMED_PORTS)
+            else:
+                start = rng.randrange(1, 60000)
+                end = str(start + rng.choice([0, 0, 10, 1000]))
+                start = str(start)
+            entries.append({'vzEntry': {'attributes': {'name': f'entry-{j}', 'etherT': rng.choice(['ip', 'unspecified']),
+                                                       'prot': rng.choice(['tcp', 'udp', 'unspecified']),
+                                                       'dFromPort': start, 'dToPort': end}}})
+        imdata.append({'vzFilter': {'attributes': {'name': f'filter-{i}'}, 'children': entries}})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'totalCount': str(len(imdata)), 'imdata': imdata}, f)
+
+
+def generate_ep_data(path, rows, epg_count, rng):
+    """ Write an EP_Data CSV (Tenant, AP, IP, MAC, EPG). """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Tenant', 'AP', 'IP', 'MAC', 'EPG'])
+        for i in range(rows):
+            writer.writerow(['prod', 'app', random_ip(rng), f'00:50:56:00:{i // 256 % 256:02x}:{i % 256:02x}',
+                             f'epg-{rng.randrange(epg_count)}'])
+
+
+def generate_contract_names(path, contract_count, rng):
+    """ Write a contracts CSV with a 'Contract Name' column listing part of the contracts. """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Contract Name'])
+        for i in range(contract_count):
+            if rng.random() < 0.5:
+                writer.writerow([f'contract-{i}'])
+
+
+def generate_pa_addresses(path, count, rng):
+    """ Write a Palo Alto address objects export (BOM-prefixed quoted header, as exported). """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write('\ufeff"Name","Location","Address","Type"\r\n')
+        writer = csv.writer(f)
+        for i in range(count):
+            address = random_ip(rng) if rng.random() < 0.7 else random_cidr(rng)
+            if rng.random() < 0.05:
+                address = f'host-{i}.example.com'
+            writer.writerow([f'obj-{i}', 'shared', address, 'ip-netmask'])
+
+
+def generate_pa_address_groups(path, count, address_count, rng):
+    """ Write a Palo Alto address groups export whose members are address objects. """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write('\ufeff"Name","Location","Members","Addresses"\r\n')
+        writer = csv.writer(f)
+        for i in range(count):
+            members = [f'obj-{rng.randrange(address_count)}' for _ in range(rng.randint(1, 8))]
+            writer.writerow([f'grp-{i}', 'shared', len(members), ';'.join(members)])
+
+
+def generate_pa_extraction(path, count, address_count, group_count, rng):
+    """ Write a Palo Alto rule extraction CSV referencing address objects and groups. """
+    def addresses():
+        picks = []
+        for _ in range(rng.randint(1, 4)):
+            roll = rng.random()
+            if roll < 0.1:
+                picks.append('any')
+            elif roll < 0.4:
+                picks.append(f'grp-{rng.randrange(group_count)}')
+            else:
+                picks.append(f'obj-{rng.randrange(address_count)}')
+        return ';'.join(picks)
+
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write('\ufeffName,Source Zone,Source Address,Destination Zone,Destination Address,Application,Service,Action\r\n')
+        writer = csv.writer(f)
+        for i in range(count):
+            writer.writerow([f'rule-{i}', rng.choice(ZONES), addresses(), rng.choice(ZONES), addresses(),
+                             rng.choice(APPLICATIONS), rng.choice(SERVICES), rng.choice(['allow', 'allow', 'deny'])])
+
+
+def generate_pa_rows(path, count, rng):
+    """ Write a [Data Centre]_rows.csv listing about 5% of the extraction rows as discarded. """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write('\ufeffrow\r\n')
+        for row in sorted(rng.sample(range(2, count + 2), count // 20)):
+            f.write(f'{row}\r\n')
+
+
+def generate_policy_export(path, count, rng, names=None):
+    """ Write a policy export CSV with the columns matches.py and compare_csv.py compare. """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Name', 'Source Address', 'Destination Address', 'Service', 'Application',
+                         'Source Zone', 'Destination Zone', 'Action'])
+        for i in range(count):
+            name = names[i] if names else f'rule-{i}'
+            writer.writerow([name, f'obj-{rng.randrange(count)}', f'obj-{rng.randrange(count)}', rng.choice(SERVICES),
+                             rng.choice(APPLICATIONS), rng.choice(ZONES), rng.choice(ZONES), 'allow'])
+
+
+def generate_asa_config(object_groups_path, access_lists_path, baseline_path, group_count, acl_count, rng):
+    """
+    Write ASA object-group lines, access-list lines and an object group baseline CSV
+    (with nested groups) for searchaccesslist.py and access-list-filters.py.
+    """
+    with open(object_groups_path, 'w', encoding='utf-8') as f:
+        f.write('# object-group network-object <group> <ip>\n')
+        for i in range(group_count):
+            for _ in range(rng.randint(1, 4)):
+                ip = f'172.31.{rng.randrange(38, 44)}.{rng.randrange(256)}' if rng.random() < 0.5 else random_ip(rng)
+                f.write(f'network-object OG{i} {ip}\n')
+            if rng.random() < 0.05:
+                f.write(f'network-object OG{i}\n')
+    with open(access_lists_path, 'w', encoding='utf-8') as f:
+        for i in range(acl_count):
+            if rng.random() < 0.02:
+                f.write(f'access-list ACL{i % 20} remark synthetic\n')
+            f.write(f'access-list ACL{i % 20} extended permit ip object-group OG{rng.randrange(group_count)} '
+                    f'object-group OG{rng.randrange(group_count)}\n')
+    with open(baseline_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Object Group', 'Nested Object Groups', 'Baseline Subnet'])
+        for i in range(group_count):
+            nested = ';'.join(f'OG{rng.randrange(group_count)}' for _ in range(rng.choice([0, 0, 1, 2])))
+            writer.writerow([f'OG{i}', nested, 'true' if rng.random() < 0.05 else 'false'])
+
+
+def generate_meraki_rules(path, count, rng):
+    """ Write a Meraki L3 firewall rules JSON export. """
+    def cidrs():
+        if rng.random() < 0.1:
+            return 'Any'
+        return ','.join(random_cidr(rng) for _ in range(rng.randint(1, 3)))
+
+    rules = [{'comment': f'rule {i}', 'policy': rng.choice(['allow', 'deny']), 'protocol': rng.choice(['tcp', 'udp', 'any']),
+              'srcPort': 'Any', 'srcCidr': cidrs(), 'destPort': rng.choice(['443', '80,8080', 'Any']),
+              'destCidr': cidrs(), 'syslogEnabled': False}
+             for i in range(count)]
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'rules': rules}, f)
+
+
+def generate_meraki_csv(path, count, rng):
+    """ Write a Meraki dashboard rules CSV (Policy, Source, Destination, ...) for meraki-baseline.py. """
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Policy', 'Source', 'Destination', 'Port'])
+        for i in range(count):
+            source = 'any' if rng.random() < 0.05 else '; '.join(random_cidr(rng) for _ in range(rng.randint(1, 3)))
+            destination = '; '.join(random_cidr(rng) for _ in range(rng.randint(1, 3)))
+            writer.writerow([f'policy-{i}', source, destination, rng.choice(['443', 'any'])])
+
+
+def generate_npd(npd_path, zones_path, policy_folder, change_count, policies_per_change, rng):
+    """ Write NPD changes, the firewall/NPD zone map and one policy export per change. """
+    os.makedirs(policy_folder, exist_ok=True)
+    with open(zones_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Firewall Zone', 'NPD Zone'])
+        for zone in ZONES:
+            for npd_zone in rng.sample(ZONES, 2):
+                writer.writerow([zone, npd_zone])
+    with open(npd_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Tech Sep', 'Change Number', 'Source Zone', 'Destination Zone', 'Service', 'Change History#'])
+        for i in range(change_count):
+            tech_sep, change = f'TS{i % 10}', f'CHG{i}'
+            writer.writerow([tech_sep, change, rng.choice(ZONES), rng.choice(ZONES), rng.choice(SERVICES), f'H{i}'])
+            with open(os.path.join(policy_folder, f'Policy Export {tech_sep} {change}.csv'), 'w', newline='', encoding='utf-8') as p:
+                policy_writer = csv.writer(p)
+                policy_writer.writerow(['Name', 'Source Zone', 'Destination Zone', 'Service'])
+                for j in range(policies_per_change):
+                    policy_writer.writerow([f'policy-{i}-{j}', ', '.join(rng.sample(ZONES, 2)), rng.choice(ZONES),
+                                            ', '.join(rng.sample(SERVICES, 2))])
+
+
+def generate_all(output_dir, scale, seed=0):
+    """ Write the full synthetic input set for `scale` rules/endpoints into output_dir. """
+    rng = random.Random(seed)
+    os.makedirs(output_dir, exist_ok=True)
+    path = lambda name: os.path.join(output_dir, name)
+    contracts = max(scale // 20, 10)
+    filters = max(scale // 40, 10)
+    addresses = max(scale // 2, 10)
+    groups = max(scale // 10, 10)
+
+    generate_baseline(path('GSU_Baseline.csv'), max(scale // 100, 10), rng)
+    generate_apic_epgs(path('input.json'), max(scale // 20, 1), 20, contracts, rng)
+    generate_apic_contracts(path('contracts.json'), contracts, filters, rng)
+    generate_apic_filters(path('filters.json'), filters, rng)
+    generate_ep_data(path('EP_Data.csv'), scale, max(scale // 20, 1), rng)
+    generate_contract_names(path('GSU_contracts_with_filters_and_ports.csv'), contracts, rng)
+    generate_pa_addresses(path('GSU_export_objects_addresses.csv'), addresses, rng)
+    generate_pa_address_groups(path('GSU_address_groups.csv'), groups, addresses, rng)
+    generate_pa_extraction(path('GSU_Extraction.csv'), scale, addresses, groups, rng)
+    generate_pa_rows(path('GSU_rows.csv'), scale, rng)
+    generate_policy_export(path('policies_1.csv'), scale, rng)
+    generate_policy_export(path('policies_2.csv'), scale, rng)
+    generate_asa_config(path('object_groups.txt'), path('access_lists.txt'), path('object_groups_with_baseline.csv'),
+                        groups, scale, rng)
+    generate_meraki_rules(path('meraki_rules.json'), scale, rng)
+    generate_meraki_csv(path('meraki_rules.csv'), scale, rng)
+    generate_npd(path('npd_changes.csv'), path('zones.csv'), path('policies'), max(scale // 100, 1), 100, rng)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic APIC, Palo Alto, ASA, Meraki and NPD inputs.")
+    parser.add_argument('output_dir', help="Directory to write the synthetic inputs to.")
+    parser.add_argument('--scale', type=int, default=10_000, help="Number of rules/endpoints to generate (default: 10000).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0).")
+    args = parser.parse_args()
+
+    generate_all(args.output_dir, args.scale, args.seed)
+    print(f"Synthetic inputs for scale {args.scale} written to {args.output_dir}")
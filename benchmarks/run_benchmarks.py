@@ -0,0 +1,387 @@
+import argparse
+import contextlib
+import importlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCHMARK_DIR)
+
+import generate_data  # noqa: E402
+
+DEFAULT_SCALES = [1_000, 10_000]
+RESULTS_VERSION = 1
+
+# name -> (setup function, largest scale it runs at or None, description)
+BENCHMARKS = {}
+
+
+def benchmark(name, max_scale=None):
+    """
+    Register a benchmark. The decorated setup(work_dir, scale, rng) builds its inputs
+    (not timed) and returns (run, rows): run() is the timed call, rows its input size.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, max_scale, (setup.__doc__ or '').strip())
+        return setup
+    return register
+
+
+def load_script(module_name, file_name):
+    """ Import a repo script, including hyphenated ones such as meraki-baseline.py. """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(REPO_DIR, file_name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+@benchmark('find_matching_subnet')
+def bench_find_matching_subnet(work_dir, scale, rng):
+    """ baseline_contract.find_matching_subnet for `scale` IPs against a scale/100 boundary baseline. """
+    baseline_contract = importlib.import_module('baseline_contract')
+    baseline = os.path.join(work_dir, 'Baseline.csv')
+    generate_data.generate_baseline(baseline, max(scale // 100, 10), rng)
+    subnets = baseline_contract.load_data(baseline, is_subnet=True)
+    ips = [generate_data.random_ip(rng) for _ in range(scale)]
+    return lambda: [baseline_contract.find_matching_subnet(ip, subnets) for ip in ips], scale
+
+
+@benchmark('classify_ips')
+def bench_classify_ips(work_dir, scale, rng):
+    """ subnet_index.classify_ips batch classification (NumPy when installed) of `scale` IPs. """
+    subnet_index = importlib.import_module('subnet_index')
+    baseline = os.path.join(work_dir, 'Baseline.csv')
+    generate_data.generate_baseline(baseline, max(scale // 100, 10), rng)
+    subnets = subnet_index.load_subnet_index(baseline)
+    ips = [generate_data.random_ip(rng) for _ in range(scale)]
+    return lambda: subnet_index.classify_ips(ips, subnets), scale
+
+
+@benchmark('index_epgs')
+def bench_index_epgs(work_dir, scale, rng):
+    """ baseline_contract.index_epgs over a streamed APIC export with `scale` endpoints. """
+    baseline_contract = importlib.import_module('baseline_contract')
+    apic_stream = importlib.import_module('apic_stream')
+    export = os.path.join(work_dir, 'input.json')
+    generate_data.generate_apic_epgs(export, max(scale // 20, 1), 20, max(scale // 20, 10), rng)
+    return lambda: baseline_contract.index_epgs(apic_stream.iter_imdata(export)), scale
+
+
+@benchmark('index_epg_tables')
+def bench_index_epg_tables(work_dir, scale, rng):
+    """ baseline_contract.index_epg_tables over an export already in the parsed-export cache (`scale` endpoints). """
+    baseline_contract = importlib.import_module('baseline_contract')
+    apic_cache = importlib.import_module('apic_cache')
+    apic_tables = importlib.import_module('apic_tables')
+    export = os.path.join(work_dir, 'input.json')
+    generate_data.generate_apic_epgs(export, max(scale // 20, 1), 20, max(scale // 20, 10), rng)
+    cache = apic_cache.ApicCache(os.path.join(work_dir, 'apic_cache'))
+    apic_tables.cached_tables(cache, export)  # Cold run, not timed
+    return lambda: baseline_contract.index_epg_tables(apic_tables.cached_tables(cache, export)), scale
+
+
+@benchmark('contract_subject_tables')
+def bench_contract_subject_tables(work_dir, scale, rng):
+    """ contracts_filters.contract_subject_tables over `scale` contracts already in the parsed-export cache. """
+    contracts_filters = importlib.import_module('contracts_filters')
+    apic_cache = importlib.import_module('apic_cache')
+    apic_tables = importlib.import_module('apic_tables')
+    export = os.path.join(work_dir, 'contracts.json')
+    generate_data.generate_apic_contracts(export, scale, max(scale // 2, 10), rng)
+    cache = apic_cache.ApicCache(os.path.join(work_dir, 'apic_cache'))
+    apic_tables.cached_tables(cache, export)  # Cold run, not timed
+    return lambda: contracts_filters.contract_subject_tables(apic_tables.cached_tables(cache, export)), scale
+
+
+@benchmark('contracts_filters')
+def bench_contracts_filters(work_dir, scale, rng):
+    """ contracts_filters.main over `scale` contracts and scale/2 filters. """
+    contracts_filters = importlib.import_module('contracts_filters')
+    contracts = os.path.join(work_dir, 'contracts.json')
+    filters = os.path.join(work_dir, 'filters.json')
+    generate_data.generate_apic_contracts(contracts, scale, max(scale // 2, 10), rng)
+    generate_data.generate_apic_filters(filters, max(scale // 2, 10), rng)
+    return lambda: contracts_filters.main(contracts, filters), scale
+
+
+@benchmark('process_csv_files')
+def bench_process_csv_files(work_dir, scale, rng):
+    """ matches.process_csv_files hash join of two `scale` row policy exports. """
+    matches = importlib.import_module('matches')
+    file1 = os.path.join(work_dir, 'policies_1.csv')
+    file2 = os.path.join(work_dir, 'policies_2.csv')
+    generate_data.generate_policy_export(file1, scale, rng)
+    generate_data.generate_policy_export(file2, scale, rng)
+    return lambda: matches.process_csv_files(file1, file2, os.path.join(work_dir, 'matches.csv')), 2 * scale
+
+
+@benchmark('compare_csv_excel', max_scale=10_000)
+def bench_compare_csv_excel(work_dir, scale, rng):
+    """ compare_csv.compare_csv_excel similarity scan of two scale/10 row exports (all-pairs, so capped). """
+    compare_csv = importlib.import_module('compare_csv')
+    rows = max(scale // 10, 10)
+    names = [f'rule-{i}' for i in range(rows)]
+    file1 = os.path.join(work_dir, 'compare_1.csv')
+    file2 = os.path.join(work_dir, 'compare_2.csv')
+    generate_data.generate_policy_export(file1, rows, rng, names)
+    generate_data.generate_policy_export(file2, rows, rng, names)
+    output = os.path.join(work_dir, 'comparison.csv')
+    return lambda: compare_csv.compare_csv_excel(file1, file2, output, workers=1), 2 * rows
+
+
+@benchmark('generate_extraction_output_filtered')
+def bench_generate_extraction_output_filtered(work_dir, scale, rng):
+    """ separate_baseline_rules.generate_extraction_output_filtered over `scale` Palo Alto rules. """
+    separate_baseline_rules = importlib.import_module('separate_baseline_rules')
+    path = lambda name: os.path.join(work_dir, name)
+    addresses, groups = max(scale // 2, 10), max(scale // 10, 10)
+    generate_data.generate_baseline(path('Baseline.csv'), max(scale // 100, 10), rng)
+    generate_data.generate_pa_addresses(path('addresses.csv'), addresses, rng)
+    generate_data.generate_pa_address_groups(path('groups.csv'), groups, addresses, rng)
+    generate_data.generate_pa_extraction(path('Extraction.csv'), scale, addresses, groups, rng)
+    generate_data.generate_pa_rows(path('rows.csv'), scale, rng)
+
+    subnets = separate_baseline_rules.load_subnets(path('Baseline.csv'))
+    ip_to_subnet = separate_baseline_rules.resolve_ip_subnets(separate_baseline_rules.load_ips(path('addresses.csv')), subnets)
+    group_subnets = separate_baseline_rules.resolve_group_subnets(
+        separate_baseline_rules.load_address_groups(path('groups.csv')), ip_to_subnet)
+    rules = separate_baseline_rules.load_extraction_rules(path('Extraction.csv'))
+    return lambda: separate_baseline_rules.generate_extraction_output_filtered(
+        rules, group_subnets, ip_to_subnet, path('rows.csv'), path('baseline_rules_filtered.csv')), scale
+
+
+@benchmark('separate_baseline_rules')
+def bench_separate_baseline_rules(work_dir, scale, rng):
+    """ separate_baseline_rules.main end to end (load, resolve and all three outputs) over `scale` rules. """
+    separate_baseline_rules = importlib.import_module('separate_baseline_rules')
+    path = lambda name: os.path.join(work_dir, name)
+    addresses, groups = max(scale // 2, 10), max(scale // 10, 10)
+    generate_data.generate_baseline(path('Baseline.csv'), max(scale // 100, 10), rng)
+    generate_data.generate_pa_addresses(path('addresses.csv'), addresses, rng)
+    generate_data.generate_pa_address_groups(path('groups.csv'), groups, addresses, rng)
+    generate_data.generate_pa_extraction(path('Extraction.csv'), scale, addresses, groups, rng)
+    generate_data.generate_pa_rows(path('rows.csv'), scale, rng)
+    return lambda: separate_baseline_rules.main(path('rows.csv'), path('Extraction.csv'), path('groups.csv'),
+                                                path('addresses.csv'), path('Baseline.csv'), path('')), scale
+
+
+@benchmark('analyze_policy_files')
+def bench_analyze_policy_files(work_dir, scale, rng):
+    """ analyze_policies.analyze_policy_files over scale/100 policy exports of 100 rules (one worker, no cache). """
+    analyze_policies = importlib.import_module('analyze_policies')
+    path = lambda name: os.path.join(work_dir, name)
+    generate_data.generate_npd(path('npd.csv'), path('zones.csv'), path('policies'), max(scale // 100, 1), 100, rng)
+    npd_changes = analyze_policies.read_csv(path('npd.csv'))
+    zone_data = analyze_policies.read_csv(path('zones.csv'))
+    return lambda: analyze_policies.analyze_policy_files(npd_changes, zone_data, path('policies'), workers=1), scale
+
+
+@benchmark('searchaccesslist')
+def bench_searchaccesslist(work_dir, scale, rng):
+    """ searchaccesslist object-group resolution and access-list scan for 4 targets over `scale` ACL lines. """
+    searchaccesslist = importlib.import_module('searchaccesslist')
+    path = lambda name: os.path.join(work_dir, name)
+    generate_data.generate_asa_config(path('og.txt'), path('acl.txt'), path('og_base.csv'), max(scale // 10, 10), scale, rng)
+    group_lines = searchaccesslist.load_file(path('og.txt'))
+    access_lists = searchaccesslist.parse_access_lists(searchaccesslist.load_file(path('acl.txt')))
+    targets = ['172.31.40.16/28', '172.31.41.0/24', '172.31.42.0/25', '10.0.0.0/8']
+
+    def run():
+        target_index, target_spellings = searchaccesslist.build_target_index(targets)
+        group_targets = searchaccesslist.parse_object_groups_multi(group_lines, targets, target_index, target_spellings)
+        return searchaccesslist.process_data_multi(group_targets, access_lists, targets)
+    return run, scale
+
+
+@benchmark('access_list_filters')
+def bench_access_list_filters(work_dir, scale, rng):
+    """ access-list-filters.parse_access_lists_with_baseline over `scale` ACL lines with nested groups. """
+    access_list_filters = load_script('access_list_filters', 'access-list-filters.py')
+    path = lambda name: os.path.join(work_dir, name)
+    generate_data.generate_asa_config(path('og.txt'), path('acl.txt'), path('og_base.csv'), max(scale // 10, 10), scale, rng)
+    baseline_data = access_list_filters.load_baseline_data(path('og_base.csv'))
+    return lambda: access_list_filters.parse_access_lists_with_baseline(path('acl.txt'), baseline_data, path('out.csv')), scale
+
+
+@benchmark('meraki_baseline')
+def bench_meraki_baseline(work_dir, scale, rng):
+    """ meraki-baseline.classify_rows over `scale` Meraki dashboard rules. """
+    meraki_baseline = load_script('meraki_baseline', 'meraki-baseline.py')
+    rules = os.path.join(work_dir, 'meraki.csv')
+    generate_data.generate_meraki_csv(rules, scale, rng)
+    target_intervals = meraki_baseline.build_target_intervals([meraki_baseline.DEFAULT_TARGET])
+
+    def run():
+        meraki_baseline.parse_cidr.cache_clear()
+        meraki_baseline.classify_rows(rules, os.path.join(work_dir, 'meraki_baseline.csv'), target_intervals)
+    return run, scale
+
+
+@benchmark('meraki_baseline_chunked')
+def bench_meraki_baseline_chunked(work_dir, scale, rng):
+    """ meraki-baseline.classify_chunked (NumPy) over `scale` Meraki dashboard rules. """
+    importlib.import_module('numpy')
+    meraki_baseline = load_script('meraki_baseline', 'meraki-baseline.py')
+    rules = os.path.join(work_dir, 'meraki.csv')
+    generate_data.generate_meraki_csv(rules, scale, rng)
+    target_intervals = meraki_baseline.build_target_intervals([meraki_baseline.DEFAULT_TARGET])
+
+    def run():
+        meraki_baseline.parse_cidr.cache_clear()
+        meraki_baseline.classify_chunked(rules, os.path.join(work_dir, 'meraki_baseline.csv'), target_intervals)
+    return run, scale
+
+
+@benchmark('json_to_csv')
+def bench_json_to_csv(work_dir, scale, rng):
+    """ json_to_csv.convert_file on a Meraki rules JSON export with `scale` rules. """
+    json_to_csv = importlib.import_module('json_to_csv')
+    rules = os.path.join(work_dir, 'meraki_rules.json')
+    generate_data.generate_meraki_rules(rules, scale, rng)
+    return lambda: json_to_csv.convert_file(rules), scale
+
+
+@benchmark('filter_patterns')
+def bench_filter_patterns(work_dir, scale, rng):
+    """ filter.main counting scale/100 patterns over a `scale` line access-list file. """
+    filter_module = importlib.import_module('filter')
+    path = lambda name: os.path.join(work_dir, name)
+    generate_data.generate_asa_config(path('og.txt'), path('acl.txt'), path('og_base.csv'), max(scale // 10, 10), scale, rng)
+    with open(path('patterns.txt'), 'w') as f:
+        f.writelines(f'OG{rng.randrange(max(scale // 10, 10))}\n' for _ in range(max(scale // 100, 10)))
+    return lambda: filter_module.main(path('patterns.txt'), path('acl.txt')), scale
+
+
+@benchmark('compare_policy_sets')
+def bench_compare_policy_sets(work_dir, scale, rng):
+    """ compare_policies.compare_policy_sets over three `scale` row exports. """
+    compare_policies = importlib.import_module('compare_policies')
+    exports = [os.path.join(work_dir, f'export_{i}.csv') for i in range(3)]
+    for export in exports:
+        generate_data.generate_policy_export(export, scale, rng, [f'rule-{rng.randrange(scale)}' for _ in range(scale)])
+    return lambda: compare_policies.compare_policy_sets(exports, [0, 0, 0], os.path.join(work_dir, 'policy_sets.csv')), 3 * scale
+
+
+@benchmark('port_index_lookup')
+def bench_port_index_lookup(work_dir, scale, rng):
+    """ port_index.PortIndex built from scale/10 contracts, then `scale` tcp point lookups. """
+    port_index = importlib.import_module('port_index')
+    index = port_index.PortIndex()
+    for i in range(max(scale // 10, 10)):
+        for _ in range(rng.randint(1, 3)):
+            start = rng.randrange(65536)
+            index.add(f'contract-{i}', 'filter', port_index.PortRange(rng.choice(['tcp', 'udp', None]), start,
+                                                                      min(start + rng.choice([0, 10, 1000]), 65535)))
+    ports = [rng.randrange(65536) for _ in range(scale)]
+
+    def run():
+        index._segments.clear()  # Include building the segments in the measurement
+        return [index.lookup('tcp', port) for port in ports]
+    return run, scale
+
+
+def run_benchmark(name, scale, repeat, seed, ignore_limits=False):
+    """ Set up and time one benchmark at one scale; returns its result record. """
+    setup, max_scale, _ = BENCHMARKS[name]
+    result = {'benchmark': name, 'scale': scale}
+    if max_scale and scale > max_scale and not ignore_limits:
+        result['status'] = f'skipped: above max scale {max_scale}'
+        return result
+
+    work_dir = tempfile.mkdtemp(prefix=f'fvc_bench_{name}_')
+    cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)  # Scripts that write fixed output names write them here
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                run, rows = setup(work_dir, scale, random.Random(seed))
+            except ImportError as e:
+                result['status'] = f'skipped: {e}'
+                return result
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - start)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+    seconds = min(timings)
+    result.update({'status': 'ok', 'rows': rows, 'seconds': round(seconds, 6),
+                   'rows_per_second': round(rows / seconds, 1) if seconds else None})
+    return result
+
+
+def find_regressions(results, previous_file, tolerance):
+    """ Return (benchmark, scale, previous seconds, seconds) for results slower than previous_file by over tolerance. """
+    with open(previous_file, 'r', encoding='utf-8') as f:
+        previous = {(item['benchmark'], item['scale']): item for item in json.load(f)['results']
+                    if item.get('status') == 'ok'}
+    regressions = []
+    for result in results:
+        before = previous.get((result['benchmark'], result['scale']))
+        if result.get('status') == 'ok' and before and result['seconds'] > before['seconds'] * (1 + tolerance):
+            regressions.append((result['benchmark'], result['scale'], before['seconds'], result['seconds']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the pipeline scripts' core functions on synthetic inputs.")
+    parser.add_argument('--scales', default=','.join(map(str, DEFAULT_SCALES)),
+                        help="Comma-separated input sizes, e.g. 1000,10000,100000,1000000 (default: 1000,10000).")
+    parser.add_argument('--only', help="Comma-separated benchmark names to run (default: all).")
+    parser.add_argument('--repeat', type=int, default=1, help="Runs per benchmark; the fastest is kept (default: 1).")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed of the synthetic inputs (default: 0).")
+    parser.add_argument('--ignore-limits', action='store_true', help="Also run benchmarks above their max scale.")
+    parser.add_argument('--output', default='benchmark_results.json', help="Results JSON file (default: benchmark_results.json).")
+    parser.add_argument('--compare', help="Previous results JSON to check for regressions.")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown versus --compare (default: 0.25).")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit.")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, max_scale, description) in BENCHMARKS.items():
+            print(f"{name}: {description}" + (f" (max scale {max_scale})" if max_scale else ""))
+        sys.exit(0)
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    scales = [int(scale) for scale in args.scales.split(',')]
+
+    results = []
+    for scale in scales:
+        for name in names:
+            result = run_benchmark(name, scale, args.repeat, args.seed, args.ignore_limits)
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"{name:40} {scale:>9} {result['seconds']:>10.3f}s {result['rows_per_second']:>14,.0f} rows/s")
+            else:
+                print(f"{name:40} {scale:>9} {result['status']}")
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({'version': RESULTS_VERSION, 'python': platform.python_version(), 'platform': platform.platform(),
+                   'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare:
+        regressions = find_regressions(results, args.compare, args.tolerance)
+        for name, scale, before, after in regressions:
+            print(f"REGRESSION {name} at {scale}: {before:.3f}s -> {after:.3f}s")
+        if regressions:
+            sys.exit(1)
@@ -1,71 +1,286 @@
 import warnings
 warnings.filterwarnings("ignore", message=".*does not match any known type.*")
 
+import numpy as np
 import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
 from difflib import SequenceMatcher
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font
 import argparse
+import csv
+import json
+import os
+
+from instrumentation import stage
+
+# Characters are folded into this many buckets for the character-count bound
+CHAR_BUCKETS = 64
+# Rows of file1 scored per worker task
+CHUNK_SIZE = 256
+# Rows of file2 bounded at once, so the temporary arrays stay BLOCK_SIZE x columns (x CHAR_BUCKETS)
+BLOCK_SIZE = 1024
+# Default cap on scoring processes; each worker holds its own copy of file2's tables
+MAX_DEFAULT_WORKERS = 4
+# Slack for float rounding between the bounds and the exact average
+EPSILON = 1e-9
 
 # Function to calculate similarity between two strings
 def similar(a, b):
     return SequenceMatcher(None, a, b).ratio()
 
-# Function to apply color to cells
-def apply_color(ws, cell, font_color, text):
-    ws[cell].value = text
-    ws[cell].font = Font(color=font_color)
+# Function to build the string, length and folded character-count tables of a DataFrame
+def build_row_tables(df):
+    rows = [(index, [row[col] for col in df.columns]) for index, row in df.iterrows()]
+    texts = [[str(value) for value in values] for _, values in rows]
+    lengths = np.array([[len(text) for text in row_texts] for row_texts in texts], dtype=np.int64).reshape(len(texts), len(df.columns))
+    histograms = np.zeros((len(texts), len(df.columns), CHAR_BUCKETS), dtype=np.int32)
+    for i, row_texts in enumerate(texts):
+        for j, text in enumerate(row_texts):
+            if text:
+                histograms[i, j] = np.bincount(np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32) % CHAR_BUCKETS, minlength=CHAR_BUCKETS)
+    return rows, texts, lengths, histograms
+
+# Function to compute the mean of 2*common/total per column, counting empty-vs-empty as 1.0
+def mean_ratio_bound(common, total):
+    bound = np.where(total > 0, 2.0 * common / np.maximum(total, 1), 1.0)
+    return bound.mean(axis=-1)
+
+# Inverted index of file2's character counts, used to block each file1 row to its possible matches:
+# for each (column, bucket) cell, the file2 rows holding the bucket sorted by decreasing count, so the
+# rows holding it at least k times are the first frequencies[cell, k] of them
+class BucketIndex:
+    def __init__(self, histograms):
+        rows, cells = np.nonzero(histograms.reshape(len(histograms), -1))
+        counts = histograms.reshape(len(histograms), -1)[rows, cells]
+        order = np.lexsort((-counts, cells))
+        self.rows = rows[order]
+        self.starts = np.searchsorted(cells[order], np.arange(histograms.shape[1] * CHAR_BUCKETS))
+        # frequencies[cell, k]: number of file2 rows holding the cell's bucket at least k times
+        frequencies = np.zeros((histograms.shape[1] * CHAR_BUCKETS, int(counts.max(initial=0)) + 2), dtype=np.int64)
+        np.add.at(frequencies, (cells, counts), 1)
+        self.frequencies = np.cumsum(frequencies[:, ::-1], axis=1)[:, ::-1]
+        self.row_count = len(histograms)
+
+    # Function to return the file2 rows that can reach the threshold with a file1 row, or None for all rows.
+    # A column sharing only s of its len1 character counts has a ratio of at most 2*s/(len1+s), so once the
+    # rarest counts (the prefix) are set aside and the others cannot reach the threshold, a matching row
+    # must share one of the prefix counts: the candidates are the union of their rows, and no pair that
+    # reaches the threshold is dropped.
+    def candidates(self, row_lengths, row_histograms, similarity_threshold):
+        columns = len(row_lengths)
+        target = (similarity_threshold - EPSILON) * columns
+        # Empty cells share no characters but still score 1.0 against empty cells
+        if np.count_nonzero(row_lengths == 0) >= target:
+            return None
+        # Token k of a cell means "holds the cell's bucket at least k times"
+        cells = np.flatnonzero(row_histograms)
+        counts = row_histograms.reshape(-1)[cells]
+        token_cells = np.repeat(cells, counts)
+        ks = np.arange(len(token_cells)) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+        frequencies = self.frequencies[token_cells, np.minimum(ks, self.frequencies.shape[1] - 1)]
+        # Rarest first, weighted by how little a token of a long cell lowers its column's bound (1/(2*len1-1))
+        order = np.argsort(frequencies * (2 * row_lengths[token_cells // CHAR_BUCKETS] - 1), kind='stable')
+        token_cells, ks = token_cells[order], ks[order]
+
+        # Bound left after moving the first t rarest tokens into the prefix
+        lengths = row_lengths.astype(np.float64)
+        moved = np.zeros((len(token_cells) + 1, columns))
+        moved[np.arange(1, len(token_cells) + 1), token_cells // CHAR_BUCKETS] = 1
+        remaining = lengths - np.cumsum(moved, axis=0)
+        bounds = np.where(lengths > 0, 2.0 * remaining / np.maximum(lengths + remaining, 1), 1.0).sum(axis=1)
+        prefix_length = int(np.argmax(bounds < target))  # 0 when even identical rows cannot reach the threshold
+
+        # The rows holding a bucket k times include those holding it more often: the smallest k covers the rest
+        smallest = {}
+        for cell, k in zip(token_cells[:prefix_length].tolist(), ks[:prefix_length].tolist()):
+            smallest[cell] = min(k, smallest.get(cell, k))
+        selected = np.zeros(self.row_count, dtype=bool)
+        for cell, k in smallest.items():
+            start = self.starts[cell]
+            selected[self.rows[start:start + self.frequencies[cell, min(k, self.frequencies.shape[1] - 1)]]] = True
+        return np.flatnonzero(selected)
+
+_FILE2 = None
+
+def _init_worker(texts2, lengths2, histograms2, similarity_threshold):
+    global _FILE2
+    _FILE2 = (texts2, lengths2, histograms2, BucketIndex(histograms2), similarity_threshold)
+
+# Function to score a chunk of file1 rows against file2, pruning pairs that cannot reach the threshold
+def score_chunk(chunk):
+    texts2, lengths2, histograms2, index, similarity_threshold = _FILE2
+    positions, texts1, lengths1, histograms1 = chunk
+    matches = []
+    for position, row_texts, row_lengths, row_histograms in zip(positions, texts1, lengths1, histograms1):
+        # Blocking: only file2 rows sharing one of the row's rarest character counts can match
+        rows = index.candidates(row_lengths, row_histograms, similarity_threshold)
+        if rows is None:
+            rows = np.arange(len(texts2))
+        for start in range(0, len(rows), BLOCK_SIZE):
+            block = rows[start:start + BLOCK_SIZE]
+            # Length bound: ratio <= 2*min(len)/(len1+len2) per column (SequenceMatcher.real_quick_ratio)
+            block_lengths = lengths2[block]
+            totals = block_lengths + row_lengths
+            candidates = np.flatnonzero(mean_ratio_bound(np.minimum(block_lengths, row_lengths), totals) >= similarity_threshold - EPSILON)
+            if not len(candidates):
+                continue
+            # Character-count bound, gathered only for the length survivors:
+            # ratio <= 2*|common characters|/(len1+len2) (SequenceMatcher.quick_ratio)
+            common = np.minimum(histograms2[block[candidates]], row_histograms).sum(axis=-1)
+            candidates = candidates[mean_ratio_bound(common, totals[candidates]) >= similarity_threshold - EPSILON]
+            # Exact scoring only for the surviving pairs
+            for candidate in candidates:
+                position2 = int(block[candidate])
+                row_similarity = [similar(a, b) for a, b in zip(row_texts, texts2[position2])]
+                avg_similarity = sum(row_similarity) / len(row_similarity)
+                if avg_similarity >= similarity_threshold:
+                    matches.append((position, position2, avg_similarity))
+    return matches
+
+# Function to return the default number of scoring processes
+def default_workers():
+    return min(MAX_DEFAULT_WORKERS, os.cpu_count() or 1)
+
+# Function to yield (file1 position, file2 position, similarity) for every pair reaching the threshold, in file order
+def find_similar_rows(tables1, tables2, similarity_threshold, workers=None):
+    _, texts1, lengths1, histograms1 = tables1
+    _, texts2, lengths2, histograms2 = tables2
+    chunks = [(list(range(start, min(start + CHUNK_SIZE, len(texts1)))),
+               texts1[start:start + CHUNK_SIZE], lengths1[start:start + CHUNK_SIZE], histograms1[start:start + CHUNK_SIZE])
+              for start in range(0, len(texts1), CHUNK_SIZE)]
+    initargs = (texts2, lengths2, histograms2, similarity_threshold)
+    workers = workers or default_workers()
+    if workers == 1 or len(chunks) <= 1:
+        _init_worker(*initargs)
+        for chunk in chunks:
+            yield from score_chunk(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+        for matches in executor.map(score_chunk, chunks):
+            yield from matches
+
+# Shared fonts for differing cells, created once instead of per cell
+FILE1_FONT = Font(color='8B0000')  # Dark Red for file1 value
+FILE2_FONT = Font(color='006400')  # Dark Green for file2 value
+
+# Report writers are context managers, so the report file is closed even if scoring fails
+class ReportWriter:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+# Streaming Excel report: a write-only workbook flushes each row to disk as it is appended
+class ExcelReportWriter(ReportWriter):
+    def __init__(self, output_file, columns):
+        self.output_file = output_file
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet("Comparison Results")
+        self.ws.append(['File1 Row', 'File2 Row', 'Similarity'] + columns + [col + " (File2)" for col in columns])
+
+    def write_pair(self, index1, index2, avg_similarity, values1, values2):
+        cells1 = []
+        cells2 = []
+        for value1, value2 in zip(values1, values2):
+            if value1 != value2:  # Only apply color to differences
+                cell1 = WriteOnlyCell(self.ws, value=str(value1))
+                cell1.font = FILE1_FONT
+                cell2 = WriteOnlyCell(self.ws, value=str(value2))
+                cell2.font = FILE2_FONT
+            else:
+                cell1, cell2 = value1, value2  # No color for matching values
+            cells1.append(cell1)
+            cells2.append(cell2)
+        self.ws.append([index1, index2, avg_similarity] + cells1 + cells2)
+
+    def close(self):
+        self.wb.save(self.output_file)
+
+# Streaming CSV report with the same columns as the Excel report (no colors)
+class CsvReportWriter(ReportWriter):
+    def __init__(self, output_file, columns):
+        self.file = open(output_file, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['File1 Row', 'File2 Row', 'Similarity'] + columns + [col + " (File2)" for col in columns])
+
+    def write_pair(self, index1, index2, avg_similarity, values1, values2):
+        self.writer.writerow([index1, index2, avg_similarity] + list(values1) + list(values2))
+
+    def close(self):
+        self.file.close()
+
+# Streaming NDJSON report: one JSON object per matched pair, listing the differing columns
+class NdjsonReportWriter(ReportWriter):
+    def __init__(self, output_file, columns):
+        self.file = open(output_file, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def write_pair(self, index1, index2, avg_similarity, values1, values2):
+        record = {
+            'file1_row': json_value(index1),
+            'file2_row': json_value(index2),
+            'similarity': avg_similarity,
+            'file1': {col: json_value(value) for col, value in zip(self.columns, values1)},
+            'file2': {col: json_value(value) for col, value in zip(self.columns, values2)},
+            'differences': [col for col, value1, value2 in zip(self.columns, values1, values2) if value1 != value2],
+        }
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
+
+REPORT_WRITERS = {'xlsx': ExcelReportWriter, 'csv': CsvReportWriter, 'ndjson': NdjsonReportWriter}
+
+# Function to convert pandas/NumPy scalars (and NaN) into JSON values
+def json_value(value):
+    if pd.isna(value):
+        return None
+    return value.item() if hasattr(value, 'item') else value
+
+# Function to pick the report format from the output file extension
+def report_format(output_file):
+    extension = os.path.splitext(output_file)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.ndjson', '.jsonl'):
+        return 'ndjson'
+    return 'xlsx'
 
 # Function to compare two CSV files and generate an Excel file with colored differences
-def compare_csv_excel(file1, file2, output_file, similarity_threshold=0.7):
+# (or a CSV/NDJSON report), streaming each matched pair to disk as it is found
+def compare_csv_excel(file1, file2, output_file, similarity_threshold=0.7, workers=None, output_format=None):
     # Load both CSV files into DataFrames
-    df1 = pd.read_csv(file1)
-    df2 = pd.read_csv(file2)
+    with stage('read_csv') as phase:
+        df1 = pd.read_csv(file1)
+        df2 = pd.read_csv(file2)
+        phase.rows = len(df1) + len(df2)
 
     # Ensure both CSVs have the same columns
     if df1.columns.tolist() != df2.columns.tolist():
         raise ValueError("The two CSV files have different columns")
 
-    # Create a new Excel workbook and worksheet
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Comparison Results"
-
-    # Write the header row
-    header = ['File1 Row', 'File2 Row', 'Similarity'] + df1.columns.tolist() + [col + " (File2)" for col in df1.columns]
-    ws.append(header)
-
-    # Iterate over rows of both DataFrames and compare each row
-    for index1, row1 in df1.iterrows():
-        for index2, row2 in df2.iterrows():
-            # Compare rows based on similarity of all columns
-            row_similarity = [similar(str(row1[col]), str(row2[col])) for col in df1.columns]
-            avg_similarity = sum(row_similarity) / len(row_similarity)
-
-            # If rows are sufficiently similar, check for differences
-            if avg_similarity >= similarity_threshold:
-                differences = []
-                for col in df1.columns:
-                    differences.append((row1[col], row2[col]))
-
-                # Append the row information to the worksheet
-                ws.append([index1, index2, avg_similarity])
-
-                # Apply color highlighting for differences and leave matches uncolored
-                for col_index, diff in enumerate(differences, start=4):
-                    cell1_address = ws.cell(row=ws.max_row, column=col_index).coordinate
-                    cell2_address = ws.cell(row=ws.max_row, column=col_index + len(df1.columns)).coordinate
-
-                    if diff[0] != diff[1]:  # Only apply color to differences
-                        apply_color(ws, cell1_address, '8B0000', str(diff[0]))  # Dark Red for file1 value
-                        apply_color(ws, cell2_address, '006400', str(diff[1]))  # Dark Green for file2 value
-                    else:
-                        ws[cell1_address].value = diff[0]  # No color for matching values
-                        ws[cell2_address].value = diff[1]
-
-    # Save the Excel file
-    wb.save(output_file)
-    print(f"Comparison results with colored differences saved to {output_file}")
+    # Open the streaming report writer (header row is written immediately)
+    output_format = output_format or report_format(output_file)
+    with REPORT_WRITERS[output_format](output_file, df1.columns.tolist()) as report:
+        with stage('build_row_tables', rows=len(df1) + len(df2)):
+            tables1 = build_row_tables(df1)
+            tables2 = build_row_tables(df2)
+        # Score only the row pairs that can reach the threshold, across a process pool
+        with stage('write_similar_rows') as phase:
+            phase.rows = 0
+            for position1, position2, avg_similarity in find_similar_rows(tables1, tables2, similarity_threshold, workers):
+                index1, values1 = tables1[0][position1]
+                index2, values2 = tables2[0][position2]
+                report.write_pair(index1, index2, avg_similarity, values1, values2)
+                phase.rows += 1
+
+    if output_format == 'xlsx':
+        print(f"Comparison results with colored differences saved to {output_file}")
+    else:
+        print(f"Comparison results saved to {output_file}")
 
 # Main function to handle command-line arguments
 def main():
@@ -73,11 +288,13 @@ def main():
     parser.add_argument('file1', help="Path to the first CSV file.")
     parser.add_argument('file2', help="Path to the second CSV file.")
     parser.add_argument('-o', '--output', default='comparison_results.xlsx', help="Path to the output Excel file.")
+    parser.add_argument('-f', '--format', choices=sorted(REPORT_WRITERS), help="Report format (default: from the output extension, else xlsx).")
     parser.add_argument('-t', '--threshold', type=float, default=0.7, help="Similarity threshold (default: 0.7).")
+    parser.add_argument('-w', '--workers', type=int, default=default_workers(), help=f"Worker processes used for scoring (default: CPU count, at most {MAX_DEFAULT_WORKERS}; 1 disables the pool).")
 
     args = parser.parse_args()
 
-    compare_csv_excel(args.file1, args.file2, args.output, args.threshold)
+    compare_csv_excel(args.file1, args.file2, args.output, args.threshold, args.workers, args.format)
 
 if __name__ == "__main__":
     main()
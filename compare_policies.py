@@ -1,19 +1,33 @@
+import argparse
 import csv
+import heapq
+import itertools
+import os
 import sys
+import tempfile
+from collections import defaultdict
+
+from instrumentation import stage
+
+# Rows held in memory before the multi-export comparison spills sorted runs to disk
+MAX_ROWS_IN_MEMORY = 1_000_000
 
 def compare_policies(file1_path, file2_path, output_file_path):
     # Read the first CSV and store policy names from the first column
-    with open(file1_path, 'r', newline='') as file1:
+    with stage('load_policies') as phase, open(file1_path, 'r', newline='') as file1:
         reader1 = csv.reader(file1)
-        policies_file1 = [row[0] for row in reader1 if row]  # Extract policy names from first column
+        policies_file1 = {row[0] for row in reader1 if row}  # Extract policy names from first column (hash set)
+        phase.rows = reader1.line_num
 
     # Open second CSV and find matches
-    with open(file2_path, 'r', newline='') as file2, open(output_file_path, 'w', newline='') as output_file:
+    with stage('match_policies') as phase, open(file2_path, 'r', newline='') as file2, open(output_file_path, 'w', newline='') as output_file:
         reader2 = csv.reader(file2)
         writer = csv.writer(output_file)
         writer.writerow(['Index', 'Policy Name'])  # Write headers for output file
 
+        phase.rows = 0
         for index, row in enumerate(reader2):
+            phase.rows += 1
             if len(row) < 2:
                 continue  # Skip rows that don't have at least 2 columns
 
@@ -24,15 +38,143 @@ def compare_policies(file1_path, file2_path, output_file_path):
 
     print(f"Output saved to {output_file_path}")
 
+# Function to yield (policy name, export number, row index) for every row of every export
+def iter_policy_rows(export_paths, columns):
+    for export_number, (path, column) in enumerate(zip(export_paths, columns)):
+        with open(path, 'r', newline='') as file:
+            for index, row in enumerate(csv.reader(file)):
+                if len(row) > column:
+                    yield row[column], export_number, index
+
+# Function to classify a policy from the row indices it has in each export
+def policy_status(rows_per_export):
+    if not rows_per_export[0]:
+        return 'added'  # Missing from the first export
+    if all(rows_per_export):
+        return 'matched'  # Present in every export
+    return 'removed'  # In the first export but missing from a later one
+
+# Function to spill a sorted run of (name, export number, row index) to a temporary file
+def write_run(rows, run_dir):
+    rows.sort()
+    run = tempfile.NamedTemporaryFile('w', newline='', dir=run_dir, suffix='.csv', delete=False)
+    with run:
+        csv.writer(run).writerows(rows)
+    return run.name
+
+# Function to read a spilled run back as (name, export number, row index) tuples
+def read_run(path):
+    with open(path, 'r', newline='') as file:
+        for name, export_number, index in csv.reader(file):
+            yield name, int(export_number), int(index)
+
+# Function to group sorted (name, export number, row index) tuples into per-export row lists
+def group_sorted_rows(sorted_rows, export_count):
+    for name, group in itertools.groupby(sorted_rows, key=lambda item: item[0]):
+        rows_per_export = [[] for _ in range(export_count)]
+        for _, export_number, index in group:
+            rows_per_export[export_number].append(index)
+        yield name, rows_per_export
+
+# Function to label each export's column: its file name, or its path below the exports' common parent
+# directory when two exports share a file name; an export listed more than once (e.g. for two of its
+# columns) also gets its position in the argument list
+def export_labels(export_paths):
+    labels = [os.path.basename(path) for path in export_paths]
+    if len(set(labels)) < len(labels):
+        full_paths = [os.path.abspath(path) for path in export_paths]
+        parent = os.path.commonpath([os.path.dirname(path) for path in full_paths])
+        labels = [os.path.relpath(path, parent) for path in full_paths]
+    repeated = {label for label in labels if labels.count(label) > 1}
+    return [f"{label} ({position})" if label in repeated else label for position, label in enumerate(labels, 1)]
+
+def compare_policy_sets(export_paths, columns, output_file_path, max_rows_in_memory=MAX_ROWS_IN_MEMORY):
+    """
+    Compare the policy names of N exports (e.g. one per datacentre or snapshot).
+
+    Writes one row per policy name with its status relative to the first export
+    (matched/added/removed) and its original row indices in every export, one column per
+    export labelled by file name (or by path, when file names repeat). Names are
+    grouped in a hash map while the data fits in `max_rows_in_memory` rows; beyond that,
+    sorted runs are spilled to disk and combined with an external merge join.
+    """
+    export_count = len(export_paths)
+    labels = export_labels(export_paths)
+    policies = defaultdict(lambda: [[] for _ in range(export_count)])
+    buffered = 0
+    runs = []
+    run_dir = None
+
+    try:
+        # Group the rows of every export by policy name, spilling sorted runs to disk beyond max_rows_in_memory
+        with stage('group_policies') as phase:
+            phase.rows = 0
+            for name, export_number, index in iter_policy_rows(export_paths, columns):
+                if runs or buffered >= max_rows_in_memory:
+                    # Out-of-core mode: flush the hash map (or the current buffer) as a sorted run
+                    if not runs:
+                        run_dir = tempfile.mkdtemp(prefix='compare_policies_')
+                        buffer = [(key, number, row) for key, rows_per_export in policies.items()
+                                  for number, rows in enumerate(rows_per_export) for row in rows]
+                        policies.clear()
+                        runs.append(write_run(buffer, run_dir))
+                        buffer = []
+                    buffer.append((name, export_number, index))
+                    if len(buffer) >= max_rows_in_memory:
+                        runs.append(write_run(buffer, run_dir))
+                        buffer = []
+                else:
+                    policies[name][export_number].append(index)
+                    buffered += 1
+                phase.rows += 1
+
+        if runs:
+            if buffer:
+                runs.append(write_run(buffer, run_dir))
+            grouped = group_sorted_rows(heapq.merge(*(read_run(run) for run in runs)), export_count)
+        else:
+            grouped = ((name, policies[name]) for name in sorted(policies))
+
+        with stage('write_output') as phase, open(output_file_path, 'w', newline='') as output_file:
+            writer = csv.writer(output_file)
+            writer.writerow(['Policy Name', 'Status'] + [f"{label} Rows" for label in labels])
+            phase.rows = 0
+            for name, rows_per_export in grouped:
+                writer.writerow([name, policy_status(rows_per_export)] + [';'.join(map(str, rows)) for rows in rows_per_export])
+                phase.rows += 1
+    finally:
+        for run in runs:
+            os.remove(run)
+        if run_dir:
+            os.rmdir(run_dir)
+
+    print(f"Output saved to {output_file_path}")
+
 # Main function to handle arguments
 if __name__ == "__main__":
-    if len(sys.argv) != 4:
-        print("Usage: python compare_policies.py <file1.csv> <file2.csv> <output.csv>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Compare policy names between exports.",
+        usage="python compare_policies.py <file1.csv> <file2.csv> <output.csv>\n"
+              "       python compare_policies.py --multi <output.csv> <export1.csv> <export2.csv> [...] [--columns 0,1,...]")
+    parser.add_argument('paths', nargs='+', help=argparse.SUPPRESS)
+    parser.add_argument('--multi', action='store_true', help="Compare N exports and report matched/added/removed policies.")
+    parser.add_argument('--columns', help="Comma-separated policy name column per export in --multi mode (default: 0 for all).")
+    parser.add_argument('--max-rows-in-memory', type=int, default=MAX_ROWS_IN_MEMORY, help="Rows held in memory before spilling to disk in --multi mode.")
+    args = parser.parse_args()
+
+    if not args.multi:
+        if len(args.paths) != 3:
+            print("Usage: python compare_policies.py <file1.csv> <file2.csv> <output.csv>")
+            sys.exit(1)
+
+        file1, file2, output_file = args.paths
 
-    file1 = sys.argv[1]
-    file2 = sys.argv[2]
-    output_file = sys.argv[3]
+        # Call the function with file paths provided as arguments
+        compare_policies(file1, file2, output_file)
+    else:
+        output_file, export_paths = args.paths[0], args.paths[1:]
+        columns = [int(column) for column in args.columns.split(',')] if args.columns else [0] * len(export_paths)
+        if len(export_paths) < 2 or len(columns) != len(export_paths):
+            parser.error("--multi needs an output file, at least two exports and one column per export")
 
-    # Call the function with file paths provided as arguments
-    compare_policies(file1, file2, output_file)
+        compare_policy_sets(export_paths, columns, output_file, args.max_rows_in_memory)
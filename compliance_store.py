@@ -0,0 +1,407 @@
+import argparse
+import csv
+import ipaddress
+import json
+import os
+import sqlite3
+import sys
+from collections import defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+# Path of the SQLite compliance store; the scripts only write to it when this is set
+STORE_ENV = 'FVC_STORE'
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    dataset TEXT PRIMARY KEY, kind TEXT, size INTEGER, mtime_ns INTEGER, fieldnames TEXT);
+CREATE TABLE IF NOT EXISTS subnets (
+    dataset TEXT, boundary TEXT, version INTEGER, start_key TEXT, end_key TEXT, prefixlen INTEGER);
+CREATE INDEX IF NOT EXISTS subnets_dataset ON subnets (dataset, version, prefixlen, start_key);
+CREATE INDEX IF NOT EXISTS subnets_bounds ON subnets (version, start_key, end_key);
+CREATE TABLE IF NOT EXISTS endpoints (
+    dataset TEXT, epg_name TEXT, ip TEXT, version INTEGER, ip_key TEXT);
+CREATE INDEX IF NOT EXISTS endpoints_dataset ON endpoints (dataset);
+CREATE INDEX IF NOT EXISTS endpoints_dataset_epg ON endpoints (dataset, epg_name);
+CREATE INDEX IF NOT EXISTS endpoints_ip ON endpoints (version, ip_key);
+CREATE TABLE IF NOT EXISTS epg_contracts (
+    dataset TEXT, epg_name TEXT, role TEXT, contract_name TEXT, preferred_group TEXT, ips TEXT,
+    subnet TEXT, consumer_to_provider TEXT, ip_in_baseline TEXT, baseline_contract TEXT);
+CREATE INDEX IF NOT EXISTS epg_contracts_dataset ON epg_contracts (dataset);
+CREATE INDEX IF NOT EXISTS epg_contracts_dataset_epg ON epg_contracts (dataset, epg_name);
+CREATE INDEX IF NOT EXISTS epg_contracts_contract ON epg_contracts (contract_name);
+CREATE TABLE IF NOT EXISTS contracts (
+    dataset TEXT, contract_name TEXT, description TEXT, subject TEXT, filter_names TEXT, dtoport_values TEXT);
+CREATE INDEX IF NOT EXISTS contracts_dataset ON contracts (dataset);
+CREATE INDEX IF NOT EXISTS contracts_name ON contracts (contract_name);
+CREATE TABLE IF NOT EXISTS contract_ports (
+    dataset TEXT, contract_name TEXT, filter_name TEXT, protocol TEXT, from_port INTEGER, to_port INTEGER);
+CREATE INDEX IF NOT EXISTS contract_ports_dataset ON contract_ports (dataset);
+CREATE INDEX IF NOT EXISTS contract_ports_name ON contract_ports (contract_name);
+CREATE INDEX IF NOT EXISTS contract_ports_range ON contract_ports (protocol, from_port, to_port);
+CREATE TABLE IF NOT EXISTS rules (
+    dataset TEXT, position INTEGER, rule_name TEXT, subnet TEXT, address_or_group TEXT);
+CREATE INDEX IF NOT EXISTS rules_dataset ON rules (dataset, position);
+CREATE INDEX IF NOT EXISTS rules_name ON rules (rule_name);
+CREATE TABLE IF NOT EXISTS rule_cells (
+    dataset TEXT, position INTEGER, column_index INTEGER, value TEXT,
+    PRIMARY KEY (dataset, position, column_index)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rule_zones (
+    dataset TEXT, position INTEGER, direction TEXT, zone_key TEXT);
+CREATE INDEX IF NOT EXISTS rule_zones_zone ON rule_zones (dataset, zone_key);
+"""
+DATASET_TABLES = ['subnets', 'endpoints', 'epg_contracts', 'contracts', 'contract_ports', 'rules', 'rule_cells',
+                  'rule_zones']
+# Rule columns whose comma-separated zones are indexed in rule_zones, by direction
+ZONE_COLUMNS = {'source': 'Source Zone', 'destination': 'Destination Zone'}
+
+
+def ip_key(value):
+    """
+    Return (version, start key, end key) for an IP address or network string, or None if invalid.
+
+    Keys are the integer bounds as zero-padded hex, so TEXT order equals numeric order
+    within an IP version (IPv6 integers do not fit in an SQLite INTEGER).
+    """
+    try:
+        network = ipaddress.ip_network(value.strip(), strict=False)
+    except (ValueError, AttributeError):
+        return None
+    width = network.max_prefixlen // 4
+    return (network.version, f'{int(network.network_address):0{width}x}',
+            f'{int(network.broadcast_address):0{width}x}')
+
+
+def _dataset(file_path):
+    return os.path.abspath(file_path)
+
+
+def _zone_key(zone):
+    # Every spelling of 'any' shares one key, so a zone lookup is a single index probe
+    return 'any' if zone.lower() == 'any' else zone
+
+
+class ComplianceStore:
+    """
+    Optional SQLite store shared by the verification scripts.
+
+    Every table is filled per dataset (the absolute path of the CSV or input file
+    the rows came from) and replaced whenever that dataset is written again, so
+    re-running a stage never duplicates rows. Rows are streamed from the finished
+    output CSVs with executemany, one transaction per dataset. Indexes on EPG name,
+    contract name, rule name, endpoint IP and subnet bounds let later stages join
+    contract <-> EPG <-> subnet within a dataset instead of rescanning CSVs: they read
+    rules back cell by cell with read_rules, find the rules in given zones with
+    rule_zone_matches and resolve IPs to baseline subnets with match_subnets.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version not in (0, SCHEMA_VERSION):
+            raise ValueError(f"Unsupported compliance store schema version in {path}: {version}")
+        self.conn.executescript(SCHEMA)
+        self.conn.execute(f'PRAGMA user_version={SCHEMA_VERSION}')
+
+    def close(self):
+        self.conn.close()
+
+    def _replace_dataset(self, dataset, kind, fieldnames=None):
+        """ Delete every row of a dataset and register it again (call inside a transaction). """
+        for table in DATASET_TABLES:
+            self.conn.execute(f'DELETE FROM {table} WHERE dataset = ?', (dataset,))
+        size = mtime_ns = None
+        if os.path.exists(dataset):
+            stat = os.stat(dataset)
+            size, mtime_ns = stat.st_size, stat.st_mtime_ns
+        self.conn.execute('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?, ?)',
+                          (dataset, kind, size, mtime_ns, json.dumps(fieldnames) if fieldnames else None))
+
+    # Writers
+
+    def _subnet_rows(self, dataset, networks):
+        for boundary, network in networks.items():
+            width = network.max_prefixlen // 4
+            yield (dataset, boundary, network.version, f'{int(network.network_address):0{width}x}',
+                   f'{int(network.broadcast_address):0{width}x}', network.prefixlen)
+
+    def _endpoint_rows(self, dataset, ep_data):
+        for epg_name, ips in ep_data.items():
+            for ip in ips:
+                key = ip_key(ip)
+                yield (dataset, epg_name, ip, key[0] if key else None, key[1] if key else None)
+
+    def _csv_rows(self, dataset, file_path):
+        """ Yield (dataset, *cells) for every data row of a CSV written by one of the scripts. """
+        with open(file_path, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if row:
+                    yield (dataset, *row)
+
+    def save_subnets(self, file_path, networks):
+        """ Store the boundary -> ip_network mapping of a *_Baseline.csv file (e.g. SubnetIndex.networks()). """
+        dataset = _dataset(file_path)
+        with self.conn:
+            self._replace_dataset(dataset, 'subnets')
+            self.conn.executemany('INSERT INTO subnets VALUES (?, ?, ?, ?, ?, ?)', self._subnet_rows(dataset, networks))
+
+    def import_epg_contracts_csv(self, file_path, networks, ep_data):
+        """
+        Store a baseline_contracts.csv written by baseline_contract.py, with the baseline
+        subnets and EP_Data endpoints it was built from.
+
+        All three share the dataset of the CSV, so the joins in contract_endpoints and
+        ip_contracts never mix the EPGs of one datacentre with another's endpoints.
+        """
+        dataset = _dataset(file_path)
+        with self.conn:
+            self._replace_dataset(dataset, 'epg_contracts')
+            self.conn.executemany('INSERT INTO subnets VALUES (?, ?, ?, ?, ?, ?)', self._subnet_rows(dataset, networks))
+            self.conn.executemany('INSERT INTO endpoints VALUES (?, ?, ?, ?, ?)', self._endpoint_rows(dataset, ep_data))
+            self.conn.executemany('INSERT INTO epg_contracts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                  self._csv_rows(dataset, file_path))
+
+    def import_contracts_csv(self, file_path, port_index):
+        """ Store a contracts_with_filters_and_ports.csv and the PortIndex built with it. """
+        dataset = _dataset(file_path)
+        port_rows = ((dataset, contract, filter_name, port_range.protocol, port_range.start, port_range.end)
+                     for contract, ranges in port_index.contracts().items()
+                     for filter_name, port_range in ranges)
+        with self.conn:
+            self._replace_dataset(dataset, 'contracts')
+            self.conn.executemany('INSERT INTO contracts VALUES (?, ?, ?, ?, ?, ?)', self._csv_rows(dataset, file_path))
+            self.conn.executemany('INSERT INTO contract_ports VALUES (?, ?, ?, ?, ?, ?)', port_rows)
+
+    def _import_rules(self, dataset, reader, fieldnames):
+        """ Insert every rule of a CSV reader into rules, rule_cells and rule_zones, keeping file order. """
+        name_column = next((column for column in fieldnames if column.strip('\ufeff"') == 'Name'),
+                           fieldnames[0] if fieldnames else None)
+        zone_columns = [(direction, fieldnames.index(column)) for direction, column in ZONE_COLUMNS.items()
+                        if column in fieldnames]
+        position = 0
+        rules, cells, zones = [], [], []
+        for row in reader:
+            if not row:
+                continue  # csv.DictReader skips blank lines too
+            values = dict(zip(fieldnames, row))
+            rules.append((dataset, position, values.get(name_column), values.get('Subnet'), values.get('Address or Group')))
+            cells.extend((dataset, position, column_index, value) for column_index, value in enumerate(row))
+            # Zones are split as update_baseline_rules splits them
+            for direction, column_index in zone_columns:
+                if column_index < len(row) and row[column_index]:
+                    zones.extend((dataset, position, direction, _zone_key(zone.strip()))
+                                 for zone in row[column_index].split(','))
+            position += 1
+            if len(cells) >= 100000:
+                self._insert_rules(rules, cells, zones)
+                rules, cells, zones = [], [], []
+        self._insert_rules(rules, cells, zones)
+
+    def _insert_rules(self, rules, cells, zones):
+        self.conn.executemany('INSERT INTO rules VALUES (?, ?, ?, ?, ?)', rules)
+        self.conn.executemany('INSERT INTO rule_cells VALUES (?, ?, ?, ?)', cells)
+        self.conn.executemany('INSERT INTO rule_zones VALUES (?, ?, ?, ?)', zones)
+
+    def import_rules_csv(self, file_path):
+        """ Store the rows of a baseline_rules_filtered.csv style file, keeping their column order. """
+        dataset = _dataset(file_path)
+        with open(file_path, 'r', encoding='utf-8', newline='') as f, self.conn:
+            reader = csv.reader(f)
+            fieldnames = next(reader, [])
+            self._replace_dataset(dataset, 'rules', fieldnames)
+            self._import_rules(dataset, reader, fieldnames)
+
+    # Readers
+
+    def is_current(self, file_path, kind):
+        """ Return True if the store holds `kind` rows of file_path imported since the file last changed. """
+        row = self.conn.execute('SELECT kind, size, mtime_ns FROM datasets WHERE dataset = ?',
+                                (_dataset(file_path),)).fetchone()
+        if row is None or row[0] != kind:
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return (row[1], row[2]) == (stat.st_size, stat.st_mtime_ns)
+
+    def read_rules(self, file_path):
+        """
+        Return (fieldnames, rows) of a rules CSV imported with import_rules_csv, or None if
+        the store has no up-to-date copy of it.
+
+        rows yields one dict per rule in file order, built as csv.DictReader builds it:
+        missing cells are None and extra cells are listed under the None key.
+        """
+        if not self.is_current(file_path, 'rules'):
+            return None
+        dataset = _dataset(file_path)
+        (fieldnames,) = self.conn.execute('SELECT fieldnames FROM datasets WHERE dataset = ?', (dataset,)).fetchone()
+        fieldnames = json.loads(fieldnames) if fieldnames else []
+
+        def rows():
+            # One range scan of the rule_cells primary key, in file order
+            cells = self.conn.execute('SELECT position, value FROM rule_cells WHERE dataset = ? '
+                                      'ORDER BY position, column_index', (dataset,))
+            for _, group in groupby(cells, key=itemgetter(0)):
+                values = [value for _, value in group]
+                row = dict(zip(fieldnames, values))
+                if len(values) > len(fieldnames):
+                    row[None] = values[len(fieldnames):]
+                for column in fieldnames[len(values):]:
+                    row[column] = None
+                yield row
+        return fieldnames, rows()
+
+    def rule_zone_matches(self, file_path, zones):
+        """
+        Return the (position, direction) pairs of the rules of file_path with a source or
+        destination zone in `zones` or equal to 'any' in any case; direction is 'source'
+        or 'destination' and positions count rules in file order, as read_rules yields them.
+
+        The zones are joined against the rule_zones index in one query.
+        """
+        dataset = _dataset(file_path)
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_zones (zone_key TEXT PRIMARY KEY)')
+            self.conn.execute('DELETE FROM lookup_zones')
+            self.conn.executemany('INSERT OR IGNORE INTO lookup_zones VALUES (?)',
+                                  ((_zone_key(zone),) for zone in {*zones, 'any'}))
+            matches = set(self.conn.execute(
+                'SELECT z.position, z.direction FROM lookup_zones l '
+                'JOIN rule_zones z ON z.dataset = ? AND z.zone_key = l.zone_key', (dataset,)))
+            self.conn.execute('DELETE FROM lookup_zones')
+        return matches
+
+    def match_subnets(self, file_path, ips):
+        """
+        Return {ip: most specific boundary} for the IP addresses in `ips` that fall in a
+        subnet saved for file_path; invalid addresses and addresses outside every subnet
+        are left out.
+
+        Each address is masked to every prefix length saved for the dataset and the masked
+        keys are joined against the subnets index in one query, so a lookup costs one index
+        probe per prefix length, as in SubnetIndex.
+        """
+        dataset = _dataset(file_path)
+        lengths = defaultdict(list)
+        for version, prefixlen in self.conn.execute(
+                'SELECT DISTINCT version, prefixlen FROM subnets WHERE dataset = ?', (dataset,)):
+            lengths[version].append(prefixlen)
+
+        def lookup_rows():
+            for ip in set(ips):
+                try:
+                    address = ipaddress.ip_address(ip)
+                except ValueError:
+                    continue
+                bits = address.max_prefixlen
+                for prefixlen in lengths[address.version]:
+                    start = int(address) >> (bits - prefixlen) << (bits - prefixlen)
+                    yield ip, address.version, prefixlen, f'{start:0{bits // 4}x}'
+
+        with self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS lookup_ips '
+                              '(ip TEXT, version INTEGER, prefixlen INTEGER, start_key TEXT)')
+            self.conn.execute('DELETE FROM lookup_ips')
+            self.conn.executemany('INSERT INTO lookup_ips VALUES (?, ?, ?, ?)', lookup_rows())
+            matches = {}
+            for ip, boundary in self.conn.execute(
+                    'SELECT l.ip, s.boundary FROM lookup_ips l JOIN subnets s ON s.dataset = ? '
+                    'AND s.version = l.version AND s.prefixlen = l.prefixlen AND s.start_key = l.start_key '
+                    'ORDER BY s.prefixlen DESC, s.rowid', (dataset,)):
+                matches.setdefault(ip, boundary)
+            self.conn.execute('DELETE FROM lookup_ips')
+        return matches
+
+    # Queries
+
+    def subnets_containing(self, ip):
+        """ Return the baseline boundaries containing an IP address or network, most specific first. """
+        key = ip_key(ip)
+        if key is None:
+            return []
+        return [boundary for (boundary,) in self.conn.execute(
+            'SELECT DISTINCT boundary FROM subnets WHERE version = ? AND start_key <= ? AND end_key >= ? '
+            'ORDER BY prefixlen DESC', key)]
+
+    def contract_endpoints(self, contract_name):
+        """ Return (dataset, EPG, role, IP, baseline boundary) for every endpoint of the EPGs using a contract. """
+        return self.conn.execute(
+            'SELECT DISTINCT ec.dataset, ec.epg_name, ec.role, e.ip, s.boundary FROM epg_contracts ec '
+            'LEFT JOIN endpoints e ON e.dataset = ec.dataset AND e.epg_name = ec.epg_name '
+            'LEFT JOIN subnets s ON s.dataset = e.dataset AND s.version = e.version '
+            'AND s.start_key <= e.ip_key AND s.end_key >= e.ip_key '
+            'WHERE ec.contract_name = ? ORDER BY ec.dataset, ec.epg_name, ec.role, e.ip', (contract_name,)).fetchall()
+
+    def ip_contracts(self, ip):
+        """ Return (dataset, EPG, role, contract) for the EPGs that have an endpoint with this IP. """
+        key = ip_key(ip)
+        if key is None:
+            return []
+        return self.conn.execute(
+            'SELECT DISTINCT ec.dataset, ec.epg_name, ec.role, ec.contract_name FROM endpoints e '
+            'JOIN epg_contracts ec ON ec.dataset = e.dataset AND ec.epg_name = e.epg_name '
+            'WHERE e.version = ? AND e.ip_key = ? ORDER BY ec.dataset, ec.epg_name, ec.role, ec.contract_name',
+            key[:2]).fetchall()
+
+    def contracts_allowing(self, protocol, start, end=None):
+        """ Return the contracts allowing `protocol` traffic to any destination port in [start, end]. """
+        end = start if end is None else end
+        return [contract for (contract,) in self.conn.execute(
+            'SELECT DISTINCT contract_name FROM contract_ports WHERE (protocol = ? OR protocol IS NULL) '
+            'AND from_port <= ? AND to_port >= ? ORDER BY contract_name', (protocol.lower(), end, start))]
+
+    def rules_named(self, rule_name):
+        """ Return (dataset, Subnet, Address or Group) of every stored rule with this name. """
+        return self.conn.execute(
+            'SELECT dataset, subnet, address_or_group FROM rules WHERE rule_name = ? ORDER BY dataset, position',
+            (rule_name,)).fetchall()
+
+
+def store_from_env():
+    """ Return the ComplianceStore configured by FVC_STORE, or None when the store is disabled. """
+    path = os.environ.get(STORE_ENV)
+    return ComplianceStore(path) if path else None
+
+
+if __name__ == "__main__":
+    from port_index import parse_port_query
+
+    parser = argparse.ArgumentParser(description="Query the compliance store written by the verification scripts.")
+    parser.add_argument('--store', default=os.environ.get(STORE_ENV), help=f"Path of the SQLite store (default: ${STORE_ENV}).")
+    subparsers = parser.add_subparsers(dest='query', required=True)
+    subparsers.add_parser('contract', help="EPGs, endpoints and baseline subnets of a contract.").add_argument('name')
+    subparsers.add_parser('ip', help="Baseline subnets and contracts of an IP address.").add_argument('address')
+    port_parser = subparsers.add_parser('port', help="Contracts allowing a protocol/port, e.g. tcp 443 or udp 1000-2000.")
+    port_parser.add_argument('protocol')
+    port_parser.add_argument('ports')
+    subparsers.add_parser('rule', help="Baseline subnets of a firewall rule in every stored rules file.").add_argument('name')
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error(f"set {STORE_ENV} or pass --store")
+    store = ComplianceStore(args.store)
+    writer = csv.writer(sys.stdout)
+    if args.query == 'contract':
+        writer.writerow(['Baseline Contracts File', 'EPG', 'Type of Endpoint', 'IP', 'Subnet'])
+        writer.writerows(store.contract_endpoints(args.name))
+    elif args.query == 'ip':
+        writer.writerow(['Subnet'])
+        writer.writerows([boundary] for boundary in store.subnets_containing(args.address))
+        writer.writerow(['Baseline Contracts File', 'EPG', 'Type of Endpoint', 'Contract'])
+        writer.writerows(store.ip_contracts(args.address))
+    elif args.query == 'port':
+        start, end = parse_port_query(args.ports)
+        writer.writerow(['Contract Name'])
+        writer.writerows([contract] for contract in store.contracts_allowing(args.protocol, start, end))
+    else:
+        writer.writerow(['Rules File', 'Subnet', 'Address or Group'])
+        writer.writerows(store.rules_named(args.name))
+    store.close()
@@ -1,49 +1,55 @@
-import json
 import csv
 import sys
 
-def main(contracts_file, filters_file):
-    # Load the JSON data
-    with open(contracts_file) as f1:
-        contracts_data = json.load(f1)
+from apic_tables import read_export
+from compliance_store import store_from_env
+from instrumentation import stage
+from port_index import ANY_PORT_RANGE, PortIndex, entry_port_ranges
 
-    # Load the filter data
-    with open(filters_file) as f2:
-        filters_data = json.load(f2)
+# Classes read by filter_tables and contract_subject_tables
+FILTER_CLASSES = {'vzFilter': None, 'vzEntry': None}
+CONTRACT_CLASSES = {'vzBrCP': None, 'vzSubj': None, 'vzRsSubjFiltAtt': None}
 
-    # Extract filter names and their dToPort values
-    filter_dToPort_map = {}
+def iter_filters(imdata):
+    """
+    Yield (vzFilter name, entries) per imdata element of the filters export (e.g. iter_imdata).
 
-    for filter_item in filters_data.get("imdata", []):
+    entries has the vzEntry attributes of every child of the filter, {} for a child that is not a vzEntry.
+    """
+    for filter_item in imdata:
         vz_filter = filter_item.get("vzFilter", {})
-        filter_name = vz_filter.get("attributes", {}).get("name", "")
-        entries = vz_filter.get("children", [])
-
-        # Collect dToPort values for this filter
-        dToPorts = []
-        for entry in entries:
-            vz_entry = entry.get("vzEntry", {})
-            dToPort = vz_entry.get("attributes", {}).get("dToPort", "")
-            if dToPort == "unspecified":
-                dToPort = filter_name  # Replace "unspecified" with filter name
-            dToPorts.append(dToPort)
-
-        if filter_name:
-            filter_dToPort_map[filter_name] = ";".join(dToPorts)
-
-    # Prepare CSV data
-    csv_data = []
-    for contract_item in contracts_data.get("imdata", []):
+        entries = [entry.get("vzEntry", {}).get("attributes", {}) for entry in vz_filter.get("children", [])]
+        yield vz_filter.get("attributes", {}).get("name", ""), entries
+
+def filter_tables(tables):
+    """ Return the rows iter_filters yields, from the export's cached ExportTables. """
+    filters = tables.table('vzFilter')
+    filter_rows = tables.top_rows('vzFilter')
+    names = filters.get('name', "")
+    entries = tables.table('vzEntry')
+    entry_rows = tables.child_rows('vzEntry', {filters.ids[row] for row in filter_rows})
+    by_element = {}
+    for row in filter_rows:
+        children = [{} for _ in range(max(filters.children[row], 0))]
+        child_rows = entry_rows.get(filters.ids[row], [])
+        for child_row, attributes in zip(child_rows, entries.attributes_of(child_rows)):
+            children[entries.slots[child_row]] = attributes
+        by_element[filters.slots[row]] = (names[row], children)
+    return [by_element.get(index, ("", [])) for index in range(tables.elements)]
+
+def iter_contract_subjects(imdata):
+    """
+    Yield (contract name, description, last vzSubj name, filter names) per imdata element (e.g. from iter_imdata).
+
+    The filter names are the tnVzFilterName of every vzRsSubjFiltAtt of the contract's subjects.
+    """
+    for contract_item in imdata:
         # Extract attributes from vzBrCP
         contract_attr = contract_item.get("vzBrCP", {}).get("attributes", {})
-        contract_name = contract_attr.get("name")
-        contract_descr = contract_attr.get("descr", "")
 
         # Extract vzSubj name and filter names
         vz_subj_name = ""
         filter_names = []
-        dToPort_values = []
-
         for child in contract_item.get("vzBrCP", {}).get("children", []):
             vz_subj = child.get("vzSubj", {})
             if vz_subj:
@@ -58,23 +64,88 @@ def main(contracts_file, filters_file):
                         tn_vz_filter_name = filt_attr.get("tnVzFilterName", "")
                         if tn_vz_filter_name:
                             filter_names.append(tn_vz_filter_name)
-                            dToPort_values.append(filter_dToPort_map.get(tn_vz_filter_name, "permit-any"))
-
-        # Join filter names and dToPort values with semicolons
-        filter_names_str = ";".join(filter_names) if filter_names else "permit-any"
-        dToPort_values_str = ";".join(dToPort_values) if dToPort_values else "permit-any"
-
-        # Append the contract details to CSV data
-        csv_data.append([contract_name, contract_descr, vz_subj_name, filter_names_str, dToPort_values_str])
+        yield contract_attr.get("name"), contract_attr.get("descr", ""), vz_subj_name, filter_names
+
+def contract_subject_tables(tables):
+    """ Return the rows iter_contract_subjects yields, from the export's cached ExportTables. """
+    contracts = tables.table('vzBrCP')
+    contract_rows = tables.top_rows('vzBrCP')
+    subjects = tables.table('vzSubj')
+    subject_rows = tables.child_rows('vzSubj', {contracts.ids[row] for row in contract_rows})
+    subject_names = subjects.get('name', "")
+    filter_names = tables.child_values('vzRsSubjFiltAtt', 'tnVzFilterName',
+                                       {subjects.ids[row] for rows in subject_rows.values() for row in rows}, "")
+    names = contracts.get('name')
+    descriptions = contracts.get('descr', "")
+    by_element = {}
+    for row in contract_rows:
+        vz_subj_name = ""
+        contract_filters = []
+        # Empty vzSubj objects are skipped, as in the stream
+        for subject_row in subject_rows.get(contracts.ids[row], []):
+            if not subjects.is_empty(subject_row):
+                vz_subj_name = subject_names[subject_row]
+                contract_filters.extend(name for name in filter_names.get(subjects.ids[subject_row], []) if name)
+        by_element[contracts.slots[row]] = (names[row], descriptions[row], vz_subj_name, contract_filters)
+    return [by_element.get(index, (None, "", "", [])) for index in range(tables.elements)]
 
-    # Write to CSV
+def main(contracts_file, filters_file):
+    # Extract filter names and their dToPort values, streaming the filter data
+    filter_dToPort_map = {}
+    filter_ranges_map = {}
+
+    with stage('load_filters') as phase:
+        for filter_name, entries in read_export(filters_file, iter_filters, filter_tables, FILTER_CLASSES):
+            # Collect dToPort values for this filter
+            dToPorts = []
+            for entry in entries:
+                dToPort = entry.get("dToPort", "")
+                if dToPort == "unspecified":
+                    dToPort = filter_name  # Replace "unspecified" with filter name
+                dToPorts.append(dToPort)
+
+            if filter_name:
+                filter_dToPort_map[filter_name] = ";".join(dToPorts)
+                filter_ranges_map[filter_name] = entry_port_ranges(filter_name, entries)
+        phase.rows = len(filter_dToPort_map)
+
+    # Stream the contracts straight into the CSV
     output_file = 'contracts_with_filters_and_ports.csv'
-    with open(output_file, 'w', newline='') as csvfile:
+    index_file = 'contracts_port_index.json'
+    port_index = PortIndex()
+    with stage('write_contracts') as phase, open(output_file, 'w', encoding='utf-8', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['Contract Name', 'Description', 'vzSubj Name', 'Filter Names', 'dToPort Values'])
-        writer.writerows(csv_data)
+
+        for contract_name, contract_descr, vz_subj_name, filter_names in read_export(
+                contracts_file, iter_contract_subjects, contract_subject_tables, CONTRACT_CLASSES):
+            dToPort_values = [filter_dToPort_map.get(tn_vz_filter_name, "permit-any") for tn_vz_filter_name in filter_names]
+
+            # Index the protocol/port ranges of the contract; missing filters permit any traffic
+            port_index.add_contract(contract_name)
+            for tn_vz_filter_name in filter_names or ["permit-any"]:
+                for port_range in filter_ranges_map.get(tn_vz_filter_name, [ANY_PORT_RANGE]):
+                    port_index.add(contract_name, tn_vz_filter_name, port_range)
+
+            # Join filter names and dToPort values with semicolons
+            filter_names_str = ";".join(filter_names) if filter_names else "permit-any"
+            dToPort_values_str = ";".join(dToPort_values) if dToPort_values else "permit-any"
+
+            # Write the contract details to CSV
+            writer.writerow([contract_name, contract_descr, vz_subj_name, filter_names_str, dToPort_values_str])
+
+        phase.rows = len(port_index)
+
+    port_index.save(index_file)
+
+    # Import the finished CSV into the compliance store when FVC_STORE is set
+    store = store_from_env()
+    if store:
+        store.import_contracts_csv(output_file, port_index)
+        store.close()
 
     print(f"CSV file '{output_file}' created successfully.")
+    print(f"Port index '{index_file}' created successfully.")
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
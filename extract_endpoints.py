@@ -1,11 +1,13 @@
 import csv
-import json
 import sys
+from collections import defaultdict
 
-def load_json_data(file_path):
-    """ Load JSON data from a file. """
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
+from apic_tables import read_export
+from instrumentation import stage
+
+RELATIONS = ['fvRsCons', 'fvRsProv']
+# Classes read by epg_relation_tables, with the attributes iter_epg_relations indexes directly
+EPG_CLASSES = {'fvAEPg': ('name',), 'fvRsCons': (), 'fvRsProv': ()}
 
 def load_contract_names(file_path):
     """ Load contract names from the provided CSV file. """
@@ -16,6 +18,38 @@ def load_contract_names(file_path):
             contracts.add(row['Contract Name'])  # Adjusting for the correct column name
     return contracts
 
+def iter_epg_relations(imdata):
+    """
+    Yield (EPG name, [(relation class, tnVzBrCPName), ...]) for every fvAEPg in the export (e.g. iter_imdata).
+
+    The relations are fvRsCons/fvRsProv children in child order.
+    """
+    for item in imdata:
+        if 'fvAEPg' in item:
+            relations = []
+            for child in item['fvAEPg'].get('children', []):
+                for relation in RELATIONS:
+                    if relation in child:
+                        relations.append((relation, child[relation]['attributes'].get('tnVzBrCPName', None)))
+            yield item['fvAEPg']['attributes']['name'], relations
+
+def epg_relation_tables(tables):
+    """ Return the EPGs iter_epg_relations yields, from the export's cached ExportTables. """
+    epgs = tables.table('fvAEPg')
+    epg_rows = tables.top_rows('fvAEPg')
+    parents = {epgs.ids[row] for row in epg_rows}
+    # (child position, RELATIONS position, relation class, tnVzBrCPName) of every relation under each EPG
+    relations = defaultdict(list)
+    for position, relation in enumerate(RELATIONS):
+        table = tables.table(relation)
+        contracts = table.get('tnVzBrCPName')
+        for parent, rows in tables.child_rows(relation, parents).items():
+            relations[parent].extend((table.slots[row], position, relation, contracts[row]) for row in rows)
+    names = epgs.get('name')
+    return [(names[row], [(relation, contract) for _, _, relation, contract in
+                          sorted(relations.get(epgs.ids[row], []), key=lambda item: item[:2])])
+            for row in epg_rows]
+
 if __name__ == '__main__':
     if len(sys.argv) != 3:
         print("Usage: python extract_endpoints.py <input.json> <contracts.csv>")
@@ -24,32 +58,33 @@ if __name__ == '__main__':
     json_file_path = sys.argv[1]
     contracts_csv_path = sys.argv[2]
 
-    json_data = load_json_data(json_file_path)
-    contract_names = load_contract_names(contracts_csv_path)
+    with stage('load_contract_names') as phase:
+        contract_names = load_contract_names(contracts_csv_path)
+        phase.rows = len(contract_names)
 
     endpoints = []
-    # Iterate through the data to extract endpoints and check contracts
-    for item in json_data['imdata']:
-        if 'fvAEPg' in item:
-            endpoint_name = item['fvAEPg']['attributes']['name']
+    # Stream through the data to extract endpoints and check contracts
+    with stage('match_endpoints') as phase:
+        for endpoint_name, relations in read_export(json_file_path, iter_epg_relations, epg_relation_tables, EPG_CLASSES):
             matched_contracts = []
             tnVzBrCPName_fvRsCons = None
             tnVzBrCPName_fvRsProv = None
-            for child in item['fvAEPg'].get('children', []):
-                if 'fvRsCons' in child:
-                    tnVzBrCPName_fvRsCons = child['fvRsCons']['attributes'].get('tnVzBrCPName', None)
+            for relation, contract in relations:
+                if relation == 'fvRsCons':
+                    tnVzBrCPName_fvRsCons = contract
                     if tnVzBrCPName_fvRsCons and tnVzBrCPName_fvRsCons in contract_names:
                         matched_contracts.append(tnVzBrCPName_fvRsCons)
-                if 'fvRsProv' in child:
-                    tnVzBrCPName_fvRsProv = child['fvRsProv']['attributes'].get('tnVzBrCPName', None)
+                else:
+                    tnVzBrCPName_fvRsProv = contract
                     if tnVzBrCPName_fvRsProv and tnVzBrCPName_fvRsProv in contract_names:
                         matched_contracts.append(tnVzBrCPName_fvRsProv)
             if matched_contracts:
                 endpoints.append((endpoint_name, ', '.join(set(matched_contracts)), tnVzBrCPName_fvRsCons, tnVzBrCPName_fvRsProv))
+        phase.rows = len(endpoints)
 
     # Write results to a CSV file
     output_file_path = 'matched_endpoints.csv'
-    with open(output_file_path, 'w', newline='', encoding='utf-8') as file:
+    with stage('write_output', rows=len(endpoints)), open(output_file_path, 'w', newline='', encoding='utf-8') as file:
         writer = csv.writer(file)
         writer.writerow(['Endpoint Name', 'Matched Contracts', 'tnVzBrCPName (fvRsCons)', 'tnVzBrCPName (fvRsProv)'])
         for endpoint, contracts, tnVzBrCPName_fvRsCons, tnVzBrCPName_fvRsProv in endpoints:
@@ -1,15 +1,15 @@
-import json
 import sys
 
-def load_json_data(file_path):
-    """ Load JSON data from a file. """
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return json.load(file)
+from apic_tables import read_export
+from instrumentation import stage
 
-def find_ip_addresses(json_data):
-    """ Extract and print IP addresses from the JSON data. """
+# Classes read by ip_address_tables, with the attributes find_ip_addresses indexes directly
+EPG_CLASSES = {'fvAEPg': None, 'fvCEp': ()}
+
+def find_ip_addresses(imdata):
+    """ Extract IP addresses from an iterable of imdata elements (e.g. iter_imdata). """
     ip_addresses = []
-    for item in json_data['imdata']:
+    for item in imdata:
         if 'fvAEPg' in item:
             for child in item['fvAEPg'].get('children', []):
                 if 'fvCEp' in child and 'ip' in child['fvCEp']['attributes']:
@@ -17,14 +17,25 @@ def find_ip_addresses(json_data):
                     ip_addresses.append(ip_address)
     return ip_addresses
 
+def ip_address_tables(tables):
+    """ Return the IP addresses find_ip_addresses finds, from the export's cached ExportTables. """
+    epgs = tables.table('fvAEPg')
+    parents = {epgs.ids[row] for row in tables.top_rows('fvAEPg')}
+    endpoints = tables.table('fvCEp')
+    has_ip = endpoints.has('ip')
+    ips = endpoints.column('ip')
+    # Rows are in document order, as find_ip_addresses visits them
+    return [ips[row] for row, parent in enumerate(endpoints.parents) if has_ip[row] and parent in parents]
+
 if __name__ == '__main__':
     if len(sys.argv) != 2:
         print("Usage: python extract_ips.py <input.json>")
         sys.exit(1)
 
     json_file_path = sys.argv[1]
-    json_data = load_json_data(json_file_path)
-    ip_addresses = find_ip_addresses(json_data)
+    with stage('find_ip_addresses') as phase:
+        ip_addresses = read_export(json_file_path, find_ip_addresses, ip_address_tables, EPG_CLASSES)
+        phase.rows = len(ip_addresses)
 
     if ip_addresses:
         print("Found IP addresses:")
@@ -1,32 +1,103 @@
 import re
 import sys
-from collections import defaultdict
+from collections import defaultdict, deque
+
+from instrumentation import stage
+
+# Cleaned patterns only contain word characters, so every match lies inside one \w+ run of a line
+WORD_RUN = re.compile(r'\w+')
+# Upper bound on memoized word runs before the memo is reset
+MAX_CACHED_RUNS = 1_000_000
 
 def clean_pattern(pattern):
     # Remove special characters and spaces from the pattern
     return re.sub(r'[^\w]', '', pattern)
 
+def build_automaton(patterns):
+    """Compile patterns into an Aho-Corasick automaton: (goto, fail, output) tables indexed by state."""
+    goto = [{}]
+    fail = [0]
+    output = [()]
+    for pattern_id, pattern in enumerate(patterns):
+        state = 0
+        for char in pattern:
+            next_state = goto[state].get(char)
+            if next_state is None:
+                next_state = len(goto)
+                goto.append({})
+                fail.append(0)
+                output.append(())
+                goto[state][char] = next_state
+            state = next_state
+        output[state] += (pattern_id,)
+
+    # Breadth-first pass to set failure links and merge outputs reachable through them
+    queue = deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for char, next_state in goto[state].items():
+            queue.append(next_state)
+            fallback = fail[state]
+            while fallback and char not in goto[fallback]:
+                fallback = fail[fallback]
+            fail[next_state] = goto[fallback].get(char, 0)
+            output[next_state] += output[fail[next_state]]
+    return goto, fail, output
+
+def find_patterns(text, automaton):
+    """Return the ids of every pattern occurring in text."""
+    goto, fail, output = automaton
+    found = set()
+    state = 0
+    for char in text:
+        while state and char not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(char, 0)
+        if output[state]:
+            found.update(output[state])
+    return found
+
 def main(patterns_file, target_file):
     try:
         # Open and read patterns from patterns_file
-        with open(patterns_file, 'r') as pf:
+        with stage('load_patterns') as phase, open(patterns_file, 'r') as pf:
             patterns = pf.readlines()
+            phase.rows = len(patterns)
 
-        # Open and read target_file
-        with open(target_file, 'r') as tf:
-            target_lines = tf.readlines()
-
-        # Dictionary to keep count of each pattern
+        # Distinct cleaned patterns (in first-seen order) and how many times each was listed
         pattern_counts = defaultdict(int)
-
-        # Process each pattern
+        multiplicity = defaultdict(int)
         for pattern in patterns:
             cleaned_pattern = clean_pattern(pattern.strip())
-
             if cleaned_pattern:
-                # Count occurrences of the cleaned pattern in the target lines
-                count = sum(cleaned_pattern in line for line in target_lines)
-                pattern_counts[cleaned_pattern] += count
+                pattern_counts[cleaned_pattern] += 0
+                multiplicity[cleaned_pattern] += 1
+
+        unique_patterns = list(pattern_counts)
+        with stage('build_automaton', rows=len(unique_patterns)):
+            automaton = build_automaton(unique_patterns)
+
+        # Stream target_file once, counting the lines each pattern occurs in
+        line_counts = [0] * len(unique_patterns)
+        run_cache = {}
+        with stage('scan_target') as phase, open(target_file, 'r') as tf:
+            phase.rows = 0
+            for line in tf:
+                phase.rows += 1
+                found = set()
+                for run in set(WORD_RUN.findall(line)):
+                    matches = run_cache.get(run)
+                    if matches is None:
+                        if len(run_cache) >= MAX_CACHED_RUNS:
+                            run_cache.clear()
+                        matches = run_cache[run] = find_patterns(run, automaton)
+                    found.update(matches)
+                for pattern_id in found:
+                    line_counts[pattern_id] += 1
+
+        # A pattern listed several times is counted once per listing
+        for pattern_id, pattern in enumerate(unique_patterns):
+            pattern_counts[pattern] = line_counts[pattern_id] * multiplicity[pattern]
 
         # Print the counts
         for pattern, count in pattern_counts.items():
@@ -1,28 +1,38 @@
-import json
 import csv
 import sys
 
-def main(contracts_file):
-    # Load the JSON data
-    with open(contracts_file) as f1:
-        contracts_data = json.load(f1)
+from apic_tables import read_export
+from instrumentation import stage
+
+# Classes read by contract_tables
+CONTRACT_CLASSES = {'vzBrCP': None}
 
-    # Prepare CSV data
-    csv_data = []
-    for contract_item in contracts_data.get("imdata", []):
+def iter_contracts(imdata):
+    """ Yield (name, description) for every imdata element of the contracts export (e.g. iter_imdata). """
+    for contract_item in imdata:
         contract_attr = contract_item.get("vzBrCP", {}).get("attributes", {})
-        contract_name = contract_attr.get("name")
-        contract_descr = contract_attr.get("descr", "")
+        yield contract_attr.get("name"), contract_attr.get("descr", "")
 
-        # Append the contract details to CSV data
-        csv_data.append([contract_name, contract_descr])
+def contract_tables(tables):
+    """ Return the rows iter_contracts yields, from the export's cached ExportTables. """
+    contracts = tables.table('vzBrCP')
+    names = contracts.get('name')
+    descriptions = contracts.get('descr', "")
+    by_element = {contracts.slots[row]: (names[row], descriptions[row]) for row in tables.top_rows('vzBrCP')}
+    return [by_element.get(index, (None, "")) for index in range(tables.elements)]
 
-    # Write to CSV
+def main(contracts_file):
+    # Stream the JSON data straight into the CSV
     output_file = 'contracts_only.csv'
-    with open(output_file, 'w', newline='') as csvfile:
+    with stage('write_contracts') as phase, open(output_file, 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['Contract Name', 'Description'])
-        writer.writerows(csv_data)
+
+        phase.rows = 0
+        for contract_name, contract_descr in read_export(contracts_file, iter_contracts, contract_tables, CONTRACT_CLASSES):
+            # Write the contract details to CSV
+            writer.writerow([contract_name, contract_descr])
+            phase.rows += 1
 
     print(f"CSV file '{output_file}' created successfully.")
 
@@ -0,0 +1,117 @@
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then reported as null
+    resource = None
+
+# JSON-lines file the stage metrics are appended to ('-' for stderr); instrumentation is off when unset
+METRICS_ENV = 'FVC_METRICS'
+# Set to 1 to also trace Python allocations (peak tracemalloc memory per stage; slows the run down)
+TRACEMALLOC_ENV = 'FVC_TRACEMALLOC'
+# Comma-separated stage names to run under cProfile, dumped as <script>.<stage>.prof
+PROFILE_ENV = 'FVC_PROFILE'
+PROFILE_DIR_ENV = 'FVC_PROFILE_DIR'
+
+
+class Stage:
+    """ A measured phase of a script; set `rows` to the number of rows it processed. """
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.child_peak = 0  # Largest tracemalloc peak of the nested stages
+
+
+_stack = []
+
+
+def _script_name():
+    return os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+
+
+def _peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB elsewhere
+
+
+def _emit(record):
+    line = json.dumps(record) + '\n'
+    target = os.environ[METRICS_ENV]
+    if target == '-':
+        sys.stderr.write(line)
+    else:
+        with open(target, 'a', encoding='utf-8') as file:
+            file.write(line)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Measure a phase of a script when FVC_METRICS is set.
+
+    Records wall time, rows/s (from `rows` or the yielded Stage's rows), peak RSS and,
+    with FVC_TRACEMALLOC=1, the peak traced Python memory of the phase as one JSON line.
+    Stages named in FVC_PROFILE are also run under cProfile. When FVC_METRICS is unset
+    the phase runs unmeasured.
+    """
+    current = Stage(name, rows)
+    if not os.environ.get(METRICS_ENV):
+        yield current
+        return
+
+    if os.environ.get(TRACEMALLOC_ENV) == '1' and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        if _stack:
+            # Keep the enclosing stage's peak so far before resetting it for this one
+            _stack[-1].child_peak = max(_stack[-1].child_peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    profiled = name in os.environ.get(PROFILE_ENV, '').split(',') and not any(
+        getattr(outer, 'profiler', None) for outer in _stack)
+    if profiled:
+        current.profiler = cProfile.Profile()
+        current.profiler.enable()
+
+    _stack.append(current)
+    started = time.time()
+    start = time.perf_counter()
+    try:
+        yield current
+    finally:
+        seconds = time.perf_counter() - start
+        _stack.pop()
+        if profiled:
+            current.profiler.disable()
+            profile_file = os.path.join(os.environ.get(PROFILE_DIR_ENV, '.'), f'{_script_name()}.{name}.prof')
+            current.profiler.dump_stats(profile_file)
+
+        record = {
+            'script': _script_name(),
+            'stage': '/'.join([outer.name for outer in _stack] + [name]),
+            'pid': os.getpid(),
+            'started': round(started, 3),
+            'seconds': round(seconds, 6),
+            'rows': current.rows,
+            'rows_per_second': round(current.rows / seconds, 1) if current.rows is not None and seconds else None,
+            'peak_rss_kb': _peak_rss_kb(),
+        }
+        if tracing:
+            peak = max(tracemalloc.get_traced_memory()[1], current.child_peak)
+            record['tracemalloc_peak_kb'] = peak // 1024
+            if _stack:
+                _stack[-1].child_peak = max(_stack[-1].child_peak, peak)
+            tracemalloc.reset_peak()
+        if profiled:
+            record['profile'] = profile_file
+        _emit(record)
@@ -1,34 +1,115 @@
-import json
+import argparse
 import csv
-import sys
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-def json_to_csv(json_file):
+from instrumentation import stage
+
+# CSV headers of a Meraki L3 firewall rules export
+FIELDNAMES = ['comment', 'policy', 'protocol', 'srcPort', 'srcCidr', 'destPort', 'destCidr', 'syslogEnabled']
+# Extra leading columns of the combined CSV
+COMBINED_FIELDNAMES = ['network', 'source_file'] + FIELDNAMES
+
+# Function to build the CSV rows of a rules export without modifying the loaded rules
+def rule_rows(data):
+    rows = []
+    for rule in data.get('rules', []):
+        row = dict(rule)
+        # Ensure 'destPort' values are treated as text in Excel
+        if 'destPort' in row:
+            row['destPort'] = f'"{row["destPort"]}"'
+        rows.append(row)
+    return rows
+
+# Function to convert one JSON rules export to a CSV next to it and return its rows
+def convert_file(json_file):
     # Load JSON data
     with open(json_file, 'r') as file:
         data = json.load(file)
-    
+    rows = rule_rows(data)
+
     # Open CSV file for writing
     output_file = json_file.replace('.json', '.csv')
     with open(output_file, 'w', newline='') as csvfile:
-        # Define CSV headers
-        fieldnames = ['comment', 'policy', 'protocol', 'srcPort', 'srcCidr', 'destPort', 'destCidr', 'syslogEnabled']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.DictWriter(csvfile, fieldnames=FIELDNAMES)
 
-        # Write header
+        # Write header and rules
         writer.writeheader()
+        writer.writerows(rows)
+    return output_file, rows
 
-        # Write rules to CSV
-        for rule in data.get('rules', []):
-            # Ensure 'destPort' values are treated as text in Excel
-            if 'destPort' in rule:
-                rule['destPort'] = f'"{rule["destPort"]}"'
-            writer.writerow(rule)
-    
+def json_to_csv(json_file):
+    with stage('convert_file') as phase:
+        output_file, rows = convert_file(json_file)
+        phase.rows = len(rows)
     print(f"CSV file '{output_file}' created successfully.")
 
+# Function to expand a directory or glob pattern into the JSON files to convert
+def find_json_files(path):
+    if os.path.isdir(path):
+        path = os.path.join(path, '*.json')
+    return sorted(glob.glob(path))
+
+def convert_batch(json_files, combined_file=None, workers=None):
+    """
+    Convert many per-network rules exports, spread across `workers` processes.
+
+    When `combined_file` is given, every rule is also written to that CSV with the
+    network (file name without extension) and source file in front, as soon as the
+    file's conversion finishes.
+    """
+    workers = workers or os.cpu_count() or 1
+    combined = open(combined_file, 'w', newline='') if combined_file else None
+    try:
+        if combined:
+            writer = csv.DictWriter(combined, fieldnames=COMBINED_FIELDNAMES)
+            writer.writeheader()
+
+        if workers == 1 or len(json_files) < 2:
+            results = map(convert_file, json_files)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            results = executor.map(convert_file, json_files, chunksize=max(1, len(json_files) // (4 * workers)))
+
+        rule_count = 0
+        try:
+            # Results arrive in input order, so the combined file is deterministic
+            with stage('convert_files') as phase:
+                for json_file, (_, rows) in zip(json_files, results):
+                    rule_count += len(rows)
+                    if combined:
+                        network = os.path.splitext(os.path.basename(json_file))[0]
+                        for row in rows:
+                            writer.writerow({'network': network, 'source_file': json_file, **row})
+                phase.rows = rule_count
+        finally:
+            if executor:
+                executor.shutdown()
+    finally:
+        if combined:
+            combined.close()
+
+    print(f"Converted {len(json_files)} JSON files ({rule_count} rules).")
+    if combined_file:
+        print(f"Combined CSV file '{combined_file}' created successfully.")
+
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python script.py <json_file>")
+    parser = argparse.ArgumentParser(
+        description="Convert Meraki L3 firewall rules JSON exports to CSV.",
+        usage="python json_to_csv.py <json_file>\n"
+              "       python json_to_csv.py <directory|'glob*.json'> [--combined rules.csv] [--workers N]")
+    parser.add_argument('path', help="A JSON rules file, or a directory / glob pattern of them for batch mode.")
+    parser.add_argument('--combined', help="Batch mode: also write every rule to this CSV with network and source_file columns.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Batch mode: worker processes (default: CPU count).")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.path) or glob.has_magic(args.path):
+        json_files = find_json_files(args.path)
+        if not json_files:
+            parser.error(f"no JSON files found for {args.path}")
+        convert_batch(json_files, args.combined, args.workers)
     else:
-        json_file = sys.argv[1]
-        json_to_csv(json_file)
+        json_to_csv(args.path)
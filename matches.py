@@ -1,19 +1,27 @@
 import csv
 import sys
+from collections import defaultdict
+
+from instrumentation import stage
 
 def normalize(text):
     """Helper function to clean and normalize text for matching."""
     return text.strip().lower()
 
+def match_key(row, columns):
+    """Return the normalized tuple of `columns` used to join rows."""
+    return tuple(normalize(row[col]) for col in columns)
+
 def process_csv_files(file1_path, file2_path, output_file_path):
     # Read the two CSV files into lists of dictionaries
-    with open(file1_path, 'r') as file1, open(file2_path, 'r') as file2:
+    with stage('read_csv') as phase, open(file1_path, 'r') as file1, open(file2_path, 'r') as file2:
         reader1 = csv.DictReader(file1)
         reader2 = csv.DictReader(file2)
 
         # Convert readers to lists for easier matching
         rows1 = list(reader1)
         rows2 = list(reader2)
+        phase.rows = len(rows1) + len(rows2)
 
     # Columns to match
     columns_to_match = ['Source Address', 'Destination Address', 'Service', 'Application', 'Source Zone', 'Destination Zone']
@@ -22,11 +30,16 @@ def process_csv_files(file1_path, file2_path, output_file_path):
     # Prepare to store the paired rows
     paired_rows = []
 
-    # Perform the matching manually
-    for i, row1 in enumerate(rows1):
+    with stage('match_rows', rows=len(rows1) + len(rows2)):
+        # Index file2 rows by their normalized key (computed once per row)
+        rows2_by_key = defaultdict(list)
         for j, row2 in enumerate(rows2):
-            # Check if the relevant columns match between the two rows
-            if all(normalize(row1[col]) == normalize(row2[col]) for col in columns_to_match):
+            rows2_by_key[match_key(row2, columns_to_match)].append(j)
+
+        # Hash join: every file1 row pairs with all file2 rows sharing its key, in file order
+        for i, row1 in enumerate(rows1):
+            for j in rows2_by_key.get(match_key(row1, columns_to_match), ()):
+                row2 = rows2[j]
                 # Store the row from file1 followed by the matching row from file2
                 row_file1 = [row1[col] for col in columns_to_match_with_name] + [i + 1]
                 row_file2 = [row2[col] for col in columns_to_match_with_name] + [j + 1]
@@ -38,7 +51,7 @@ def process_csv_files(file1_path, file2_path, output_file_path):
         row.append('Extraction' if idx % 2 == 0 else 'NPD')
 
     # Write the paired rows to the output CSV
-    with open(output_file_path, 'w', newline='') as output_file:
+    with stage('write_output', rows=len(paired_rows)), open(output_file_path, 'w', newline='') as output_file:
         writer = csv.writer(output_file)
         # Write header
         writer.writerow(columns_to_match_with_name + ['Row', 'Document'])
@@ -1,53 +1,208 @@
+import argparse
+import bisect
 import csv
 import ipaddress
-import sys
+import itertools
+import re
+from functools import lru_cache
 
-# Ensure a CSV file argument is provided
-if len(sys.argv) < 2:
-    print("Usage: python script.py <csv_file>")
-    sys.exit(1)
+from instrumentation import stage
 
-# Get the input file from the arguments
-file_path = sys.argv[1]
+# Default target subnet when no targets file is given
+DEFAULT_TARGET = '10.96.0.0/13'
+# Rows per chunk in the NumPy path
+CHUNK_SIZE = 100_000
+# CIDR lists are ';'-separated in dashboard exports and ','-separated in API (srcCidr/destCidr) exports
+CIDR_SEPARATORS = re.compile(r'[;,]')
+
+# Function to load target subnets (one per line) from a file
+def load_targets(file_path):
+    with open(file_path, mode='r') as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith('#')]
+
+# Function to parse a CIDR string once and cache its integer (start, end) range; None if invalid
+@lru_cache(maxsize=1 << 16)
+def parse_cidr(cidr):
+    try:
+        network = ipaddress.IPv4Network(cidr)
+    except ValueError:
+        return None
+    return int(network.network_address), int(network.broadcast_address)
+
+# Function to collapse the target subnets into sorted, disjoint integer intervals
+def build_target_intervals(targets):
+    networks = []
+    for target in targets:
+        try:
+            networks.append(ipaddress.IPv4Network(target.strip()))
+        except ValueError as e:
+            # An invalid target matches no subnets instead of aborting the run
+            print(f"Invalid target subnet: {target} - {e}")
+    networks.sort()
+    starts, ends = [], []
+    for network in networks:
+        start, end = int(network.network_address), int(network.broadcast_address)
+        if ends and start <= ends[-1] + 1:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+# Function to test an integer range against the target intervals
+def overlaps_targets(start, end, target_intervals):
+    starts, ends = target_intervals
+    position = bisect.bisect_right(starts, end) - 1
+    return position >= 0 and ends[position] >= start
 
 # Function to check if the subnet is within the specified subnet or if it contains the target subnet
-def check_subnet_in_range_corrected(source_or_dest, target_subnet):
-    subnets = source_or_dest.split(";")
+def check_subnet_in_range_corrected(source_or_dest, target_intervals):
+    subnets = CIDR_SEPARATORS.split(source_or_dest)
     for subnet in subnets:
-        try:
-            if subnet.strip().lower() == 'any':
-                return 'Baseline'
-            if ipaddress.IPv4Network(subnet.strip()).overlaps(ipaddress.IPv4Network(target_subnet)):
-                return 'Baseline'
-        except ValueError:
-            continue
+        subnet = subnet.strip()
+        if subnet.lower() == 'any':
+            return 'Baseline'
+        network_range = parse_cidr(subnet)
+        if network_range and overlaps_targets(*network_range, target_intervals):
+            return 'Baseline'
     return 'Non-Baseline'
 
-# Define the target subnet
-target_subnet = '10.96.0.0/13'
-
-# Open the input CSV file and prepare for reading
-with open(file_path, mode='r') as infile, open('meraki_baseline.csv', mode='w', newline='') as outfile:
-    reader = csv.reader(infile)
-    writer = csv.writer(outfile)
-
-    # Read the header and append the new 'NPD' column
-    header = next(reader)
-    header.append('NPD')
-    writer.writerow(header)
-
-    # Process each row, checking Source and Destination against the target subnet
-    for row in reader:
-        source = row[1]  # Assuming 'Source' is in the second column
-        destination = row[2]  # Assuming 'Destination' is in the third column
-        
-        # Check for Baseline condition in Source or Destination
-        npd_value = check_subnet_in_range_corrected(source, target_subnet)
-        if npd_value == 'Non-Baseline':
-            npd_value = check_subnet_in_range_corrected(destination, target_subnet)
-        
-        # Append the NPD result and write the row to the output file
-        row.append(npd_value)
-        writer.writerow(row)
-
-print("Output saved to meraki_baseline.csv")
+# Function to resolve a column given as a 0-based index or a header name
+def resolve_column(header, column):
+    if str(column).isdigit():
+        return int(column)
+    return header.index(column)
+
+# Function to classify the rows of a CSV file one by one with the csv module; returns the number of rows classified
+def classify_rows(file_path, output_path, target_intervals, source_column=1, destination_column=2):
+    with open(file_path, mode='r') as infile, open(output_path, mode='w', newline='') as outfile:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+
+        # Read the header and append the new 'NPD' column
+        header = next(reader)
+        source_index = resolve_column(header, source_column)
+        destination_index = resolve_column(header, destination_column)
+        header.append('NPD')
+        writer.writerow(header)
+
+        # Process each row, checking Source and Destination against the target subnets
+        rows_classified = 0
+        for row in reader:
+            source = row[source_index]  # 'Source' is the second column by default
+            destination = row[destination_index]  # 'Destination' is the third column by default
+
+            # Check for Baseline condition in Source or Destination
+            npd_value = check_subnet_in_range_corrected(source, target_intervals)
+            if npd_value == 'Non-Baseline':
+                npd_value = check_subnet_in_range_corrected(destination, target_intervals)
+
+            # Append the NPD result and write the row to the output file
+            row.append(npd_value)
+            writer.writerow(row)
+            rows_classified += 1
+    return rows_classified
+
+# Function to parse CIDR strings into integer start/end arrays in bulk (start > end where invalid).
+# Dotted quads with a 1-2 digit prefix are parsed with NumPy; other spellings (netmasks, garbage)
+# go through parse_cidr.
+def parse_cidr_array(cidrs):
+    import numpy as np
+    from subnet_index import parse_ipv4_array
+
+    addresses, prefixes = [], []
+    for cidr in cidrs:
+        address, slash, prefix = cidr.partition('/')
+        addresses.append(address)
+        prefixes.append(prefix if slash else '32')
+    values, valid = parse_ipv4_array(addresses) if cidrs else (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool))
+    short = np.array([len(prefix) in (1, 2) and prefix.isascii() and prefix.isdigit() for prefix in prefixes], dtype=bool)
+    lengths = np.array([int(prefix) if ok else 0 for prefix, ok in zip(prefixes, short)], dtype=np.int64)
+    fast = valid & short & (lengths <= 32)
+
+    starts = values.astype(np.int64)
+    hostmasks = (np.int64(1) << (32 - lengths.clip(0, 32))) - 1
+    ends = starts | hostmasks
+    # Like IPv4Network, a network with host bits set is invalid
+    invalid = ~fast | ((starts & hostmasks) != 0)
+    starts[invalid], ends[invalid] = 1, 0
+    for i in np.flatnonzero(~fast):
+        starts[i], ends[i] = parse_cidr(cidrs[i]) or (1, 0)
+    return starts, ends
+
+# Function to flag, for a list of cells, whether any CIDR in each cell overlaps the targets (vectorized)
+def baseline_mask(cells, target_intervals):
+    import numpy as np
+
+    if not cells:
+        return np.zeros(0, dtype=bool)
+    # Split every cell at once; each cell contributes its separator count + 1 tokens, in order
+    counts = np.array([cell.count(';') + cell.count(',') for cell in cells], dtype=np.int64) + 1
+    codes = {}
+    token_codes = np.array([codes.setdefault(token, len(codes)) for token in CIDR_SEPARATORS.split(';'.join(cells))])
+    unique_tokens = [token.strip() for token in codes]
+
+    starts, ends = parse_cidr_array(unique_tokens)
+    hit = np.array([token.lower() == 'any' for token in unique_tokens], dtype=bool)
+    if target_intervals[0]:
+        target_starts = np.array(target_intervals[0], dtype=np.int64)
+        target_ends = np.array(target_intervals[1], dtype=np.int64)
+        position = np.searchsorted(target_starts, ends, side='right') - 1
+        hit |= (position >= 0) & (starts <= ends) & (target_ends[position.clip(0)] >= starts)
+    return np.logical_or.reduceat(hit[token_codes], np.cumsum(counts) - counts)
+
+# Function to classify a CSV file in chunks, vectorizing the Source/Destination checks with NumPy;
+# returns the number of rows classified
+def classify_chunked(file_path, output_path, target_intervals, chunksize=CHUNK_SIZE, source_column=1, destination_column=2):
+    with open(file_path, mode='r') as infile, open(output_path, mode='w', newline='') as outfile:
+        reader = csv.reader(infile)
+        writer = csv.writer(outfile)
+        header = next(reader)
+        source_index = resolve_column(header, source_column)
+        destination_index = resolve_column(header, destination_column)
+        writer.writerow(header + ['NPD'])
+
+        # Rows stay csv.reader lists, so short and long rows are written back exactly as classify_rows does
+        rows_classified = 0
+        while True:
+            rows = list(itertools.islice(reader, chunksize))
+            if not rows:
+                break
+            rows_classified += len(rows)
+            sources = [row[source_index] for row in rows]
+            destinations = [row[destination_index] for row in rows]
+            baseline = baseline_mask(sources, target_intervals) | baseline_mask(destinations, target_intervals)
+            for row, in_baseline in zip(rows, baseline.tolist()):
+                row.append('Baseline' if in_baseline else 'Non-Baseline')
+            writer.writerows(rows)
+    return rows_classified
+
+def main():
+    parser = argparse.ArgumentParser(description="Flag Meraki rules whose Source or Destination overlaps the baseline target subnets.")
+    parser.add_argument('csv_file', help="Path to the Meraki rules CSV file.")
+    parser.add_argument('--targets', help=f"File with one target subnet per line (default: {DEFAULT_TARGET}).")
+    parser.add_argument('--chunked', '--pandas', dest='chunked', action='store_true', help="Classify in chunks with NumPy, parsing each chunk's CIDRs in bulk.")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help=f"Rows per chunk with --chunked (default: {CHUNK_SIZE}).")
+    parser.add_argument('--source-column', default='1', help="Source column as a 0-based index or header name (default: 1; e.g. srcCidr for json_to_csv.py output).")
+    parser.add_argument('--destination-column', default='2', help="Destination column as a 0-based index or header name (default: 2; e.g. destCidr).")
+    args = parser.parse_args()
+
+    # Define the target subnets
+    with stage('load_targets') as phase:
+        targets = load_targets(args.targets) if args.targets else [DEFAULT_TARGET]
+        target_intervals = build_target_intervals(targets)
+        phase.rows = len(targets)
+
+    # Rules are read, matched and written in one streamed pass
+    output_path = 'meraki_baseline.csv'
+    with stage('classify_rules') as phase:
+        if args.chunked:
+            phase.rows = classify_chunked(args.csv_file, output_path, target_intervals, args.chunksize,
+                                          args.source_column, args.destination_column)
+        else:
+            phase.rows = classify_rows(args.csv_file, output_path, target_intervals, args.source_column, args.destination_column)
+
+    print(f"Output saved to {output_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import bisect
+import json
+from collections import defaultdict, namedtuple
+
+# Named ports the APIC accepts in place of numbers in dFromPort/dToPort
+NAMED_PORTS = {
+    'ftpData': 20,
+    'ssh': 22,
+    'smtp': 25,
+    'dns': 53,
+    'http': 80,
+    'pop3': 110,
+    'https': 443,
+    'rtsp': 554,
+}
+MAX_PORT = 65535
+# Ether types that carry IP traffic; entries for other ether types (arp, fcoe, ...) never match a port
+IP_ETHER_TYPES = {'unspecified', 'ip', 'ipv4', 'ipv6'}
+INDEX_VERSION = 1
+
+# One vzEntry: protocol None means any protocol
+PortRange = namedtuple('PortRange', ['protocol', 'start', 'end'])
+ANY_PORT_RANGE = PortRange(None, 0, MAX_PORT)
+
+
+def parse_port(value):
+    """ Return the port number of a numeric or APIC named port, None for 'unspecified' (any port). """
+    if value in (None, '', 'unspecified'):
+        return None
+    if value in NAMED_PORTS:
+        return NAMED_PORTS[value]
+    port = int(value)
+    if not 0 <= port <= MAX_PORT:
+        raise ValueError(f"port out of range: {value}")
+    return port
+
+
+def entry_port_range(attributes):
+    """
+    Build the PortRange of a vzEntry's attributes, or None for non-IP ether types.
+
+    An unspecified protocol matches every protocol, and an unspecified dFromPort or
+    dToPort matches every port (the filter name stands for "any" in the dToPort Values column).
+    """
+    ether_type = attributes.get('etherT', 'unspecified')
+    if ether_type not in IP_ETHER_TYPES:
+        return None
+    protocol = attributes.get('prot', 'unspecified')
+    protocol = None if protocol == 'unspecified' else protocol.lower()
+    start = parse_port(attributes.get('dFromPort'))
+    end = parse_port(attributes.get('dToPort'))
+    if start is None or end is None:
+        start, end = 0, MAX_PORT
+    return PortRange(protocol, min(start, end), max(start, end))
+
+
+def filter_port_ranges(vz_filter):
+    """
+    Return the PortRanges of a vzFilter object's vzEntry children, skipping unparseable entries.
+
+    A filter without any IP entry (no entries, or only non-IP ether types) permits any
+    port, as contracts_filters.py reports it in the dToPort Values column.
+    """
+    filter_name = vz_filter.get('attributes', {}).get('name', '')
+    entries = [entry.get('vzEntry', {}).get('attributes', {}) for entry in vz_filter.get('children', [])]
+    return entry_port_ranges(filter_name, entries)
+
+
+def entry_port_ranges(filter_name, entries):
+    """ Return the PortRanges of a filter from the attributes of its children ({} for a child that is not a vzEntry). """
+    ranges = []
+    for attributes in entries:
+        try:
+            port_range = entry_port_range(attributes)
+        except ValueError as e:
+            print(f"Error processing filter entry: {filter_name}/{attributes.get('name', '')} - {e}")
+            continue
+        if port_range:
+            ranges.append(port_range)
+    return ranges or [ANY_PORT_RANGE]
+
+
+class PortIndex:
+    """
+    Index of the (protocol, destination port range) pairs each contract allows.
+
+    Per protocol, every contract range is cut at its boundaries into disjoint
+    segments labelled with the contracts covering them (a flattened interval tree),
+    so "which contracts allow tcp/443" is one bisect and a range query only visits
+    the segments it overlaps. Ranges with an unspecified protocol are kept under
+    None and consulted for every protocol.
+    """
+
+    def __init__(self):
+        self._contracts = {}  # contract -> [(filter name, PortRange)]
+        self._ranges = defaultdict(list)  # protocol -> [(start, end, contract)]
+        self._segments = {}  # protocol -> (segment starts, segment contract sets), built lazily
+
+    def __len__(self):
+        return len(self._contracts)
+
+    def __contains__(self, contract):
+        return contract in self._contracts
+
+    def add(self, contract, filter_name, port_range):
+        """ Record that `contract` allows `port_range` through filter `filter_name`. """
+        self._contracts.setdefault(contract, []).append((filter_name, port_range))
+        self._ranges[port_range.protocol].append((port_range.start, port_range.end, contract))
+        self._segments.pop(port_range.protocol, None)
+
+    def add_contract(self, contract):
+        """ Register a contract that has no filter entries (it allows nothing). """
+        self._contracts.setdefault(contract, [])
+
+    def contracts(self):
+        """ Return the contract -> [(filter name, PortRange)] mapping held by the index. """
+        return {contract: list(ranges) for contract, ranges in self._contracts.items()}
+
+    def _protocol_segments(self, protocol):
+        segments = self._segments.get(protocol)
+        if segments is None:
+            # Sweep the range boundaries, keeping a count of the ranges open per contract
+            events = defaultdict(list)
+            for start, end, contract in self._ranges.get(protocol, ()):
+                events[start].append((contract, 1))
+                events[end + 1].append((contract, -1))
+            open_ranges = defaultdict(int)
+            starts, labels = [], []
+            for position in sorted(events):
+                for contract, delta in events[position]:
+                    open_ranges[contract] += delta
+                    if not open_ranges[contract]:
+                        del open_ranges[contract]
+                starts.append(position)
+                labels.append(frozenset(open_ranges))
+            segments = self._segments[protocol] = (starts, labels)
+        return segments
+
+    def _range_contracts(self, protocol, start, end):
+        starts, labels = self._protocol_segments(protocol)
+        first = bisect.bisect_right(starts, start) - 1
+        last = bisect.bisect_right(starts, end) - 1
+        found = set()
+        for label in labels[max(first, 0):last + 1]:
+            found.update(label)
+        return found
+
+    def lookup(self, protocol, port):
+        """ Return the contracts allowing `protocol` (e.g. 'tcp') traffic to destination `port`. """
+        return self.lookup_range(protocol, port, port)
+
+    def lookup_range(self, protocol, start, end):
+        """ Return the contracts allowing `protocol` traffic to any port in [start, end] (bounds in either order). """
+        start, end = min(start, end), max(start, end)
+        protocol = protocol.lower() if protocol else None
+        found = self._range_contracts(None, start, end)
+        if protocol is not None:
+            found.update(self._range_contracts(protocol, start, end))
+        return found
+
+    def lookup_covering(self, protocol, start, end):
+        """ Return the contracts allowing `protocol` traffic to every port in [start, end] through one range. """
+        start, end = min(start, end), max(start, end)
+        return {contract for contract in self.lookup_range(protocol, start, end)
+                if self.allows_range(contract, protocol, start, end)}
+
+    def allows(self, contract, protocol, port):
+        """ Return True if `contract` allows `protocol` traffic to destination `port`. """
+        return self.allows_range(contract, protocol, port, port)
+
+    def allows_range(self, contract, protocol, start, end):
+        """ Return True if one range of `contract` allows `protocol` traffic to every port in [start, end]. """
+        start, end = min(start, end), max(start, end)
+        protocol = protocol.lower() if protocol else None
+        for _, port_range in self._contracts.get(contract, ()):
+            if port_range.protocol in (None, protocol) and port_range.start <= start and end <= port_range.end:
+                return True
+        return False
+
+    def to_json(self):
+        """ Return a JSON-serializable form of the index. """
+        return {
+            'version': INDEX_VERSION,
+            'contracts': {
+                contract: [{'filter': filter_name, 'protocol': port_range.protocol,
+                            'from': port_range.start, 'to': port_range.end}
+                           for filter_name, port_range in ranges]
+                for contract, ranges in self._contracts.items()
+            },
+        }
+
+    def save(self, file_path):
+        """ Write the index to a JSON file. """
+        with open(file_path, 'w', encoding='utf-8') as file:
+            json.dump(self.to_json(), file, indent=2)
+
+
+def load_port_index(file_path):
+    """ Rebuild a PortIndex from a JSON file written by PortIndex.save. """
+    with open(file_path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    if data.get('version') != INDEX_VERSION:
+        raise ValueError(f"Unsupported port index version in {file_path}: {data.get('version')}")
+    index = PortIndex()
+    for contract, ranges in data['contracts'].items():
+        index.add_contract(contract)
+        for item in ranges:
+            index.add(contract, item['filter'], PortRange(item['protocol'], item['from'], item['to']))
+    return index
+
+
+def parse_port_query(value):
+    """ Parse a '443', 'https' or '1000-2000' query into a (start, end) range. """
+    start, _, end = value.partition('-')
+    start = parse_port(start)
+    end = parse_port(end) if end else start
+    if start is None or end is None:
+        return 0, MAX_PORT
+    return min(start, end), max(start, end)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a contract port index written by contracts_filters.py.")
+    parser.add_argument('index_file', help="Path to contracts_port_index.json.")
+    parser.add_argument('protocol', help="Protocol, e.g. tcp or udp.")
+    parser.add_argument('ports', help="Destination port, APIC port name or range, e.g. 443, https or 1000-2000.")
+    args = parser.parse_args()
+
+    index = load_port_index(args.index_file)
+    start, end = parse_port_query(args.ports)
+    for contract in sorted(index.lookup_range(args.protocol, start, end)):
+        print(contract)
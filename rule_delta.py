@@ -0,0 +1,155 @@
+import csv
+import hashlib
+import marshal
+import struct
+import zlib
+
+DELTA_FIELDNAMES = ['Name', 'Change', 'Previous Subnet', 'Subnet']
+DIGEST_SIZE = 16
+STATE_MAGIC = b'FVCRULE\0'
+STATE_VERSION = 1
+# magic, state version, length and CRC-32 of the marshalled state
+STATE_HEADER = struct.Struct('<8sIQI')
+
+
+class StateError(ValueError):
+    """ Raised when a previous run's state file is missing, corrupt or was written by another script. """
+
+
+def rule_digest(cells):
+    """ Return the content hash of a rule from its cells, compared as they are written to CSV. """
+    try:
+        text = '\0'.join(cells)
+    except TypeError:
+        # Missing cells are written empty and DictReader's extra values as a list
+        text = '\0'.join('' if cell is None else str(cell) for cell in cells)
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=DIGEST_SIZE).digest()
+
+
+def subnet_set(value):
+    # Subnets are joined from sets, so their order differs between runs
+    return frozenset(subnet for subnet in (value or '').split(';') if subnet)
+
+
+class RuleDelta:
+    """
+    Compare the rules of a run with the previous run of the same script.
+
+    `previous_digests` maps each previous rule name to its content hash,
+    `previous_results` maps a content hash to the result computed for it and
+    `previous_status` maps a rule name to its previous Subnet column. Results of
+    rules whose hash matches can be carried forward instead of recomputed, and every
+    rule whose Subnet changed is reported with how the rule itself changed. The rules
+    of this run are recorded in order, to be saved as the next run's state.
+    """
+
+    def __init__(self, previous_digests=None, previous_results=None, previous_status=None):
+        self.previous_digests = previous_digests or {}
+        self.previous_results = previous_results or {}
+        self.previous_status = previous_status or {}
+        self.names = []
+        self.digests = bytearray()
+        self.results = []
+        self.carried = 0
+        self.recomputed = 0
+
+    def lookup(self, digest):
+        """ Return the previous result of a rule with this content hash, or None. """
+        return self.previous_results.get(digest)
+
+    def record(self, name, digest, result=None, carried=False):
+        """ Record a rule of this run with its content hash and written (Subnet, Address or Group), None if dropped. """
+        self.names.append(name)
+        self.digests += digest
+        self.results.append(result)
+        if result is None:
+            return
+        if carried:
+            self.carried += 1
+        else:
+            self.recomputed += 1
+
+    def current(self):
+        """ Return ({name: content hash}, {name: Subnet}) of the rules recorded in this run. """
+        digests = {}
+        status = {}
+        for index, (name, result) in enumerate(zip(self.names, self.results)):
+            digests[name] = bytes(self.digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE])
+            if result is not None:
+                status[name] = result[0]
+        return digests, status
+
+    def change(self, name, digests):
+        if name not in self.previous_digests:
+            return 'added'
+        if name not in digests:
+            return 'removed'
+        return 'modified' if digests[name] != self.previous_digests[name] else 'unchanged'
+
+    def status_changes(self, digests, status):
+        """ Return [Name, Change, Previous Subnet, Subnet] for every rule whose baseline status changed. """
+        changes = []
+        for name in list(status) + [name for name in self.previous_status if name not in status]:
+            previous, current = self.previous_status.get(name, ''), status.get(name, '')
+            if subnet_set(previous) != subnet_set(current):
+                changes.append([name, self.change(name, digests), previous, current])
+        return changes
+
+    def write_report(self, report_file):
+        """ Write the status changes to report_file and print a summary of the delta. """
+        digests, status = self.current()
+        changes = self.status_changes(digests, status)
+        with open(report_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(DELTA_FIELDNAMES)
+            writer.writerows(changes)
+
+        counts = {'added': 0, 'modified': 0, 'removed': 0}
+        for name in set(digests) | set(self.previous_digests):
+            change = self.change(name, digests)
+            if change in counts:
+                counts[change] += 1
+        print(f"Delta: {counts['added']} added, {counts['modified']} modified, {counts['removed']} removed rules; "
+              f"{self.carried} results carried forward, {self.recomputed} recomputed")
+        print(f"{len(changes)} rules changed baseline status, saved to {report_file}")
+        return changes
+
+
+def write_state(state_file, kind, fieldnames, delta, context):
+    """
+    Save the rules recorded in delta as the state the next delta run of script `kind` compares against.
+
+    The state holds the column names, each rule's name, content hash and result, and the
+    script's `context` (its resolved addresses or security zones), marshalled behind a
+    header with a CRC-32, so loading it never re-reads the previous inputs or outputs.
+    """
+    data = marshal.dumps((kind, list(fieldnames), delta.names, bytes(delta.digests), delta.results, context))
+    with open(state_file, 'wb') as f:
+        f.write(STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(data), zlib.crc32(data)))
+        f.write(data)
+
+
+def load_state(state_file, kind):
+    """ Return (fieldnames, RuleDelta, context) saved by write_state for script `kind`, or raise StateError. """
+    try:
+        with open(state_file, 'rb') as f:
+            magic, version, length, expected = STATE_HEADER.unpack(f.read(STATE_HEADER.size))
+            data = f.read()
+        if magic != STATE_MAGIC or version != STATE_VERSION or len(data) != length or zlib.crc32(data) != expected:
+            raise StateError(f"{state_file} is not a rule state of this version, or it is corrupt")
+        state_kind, fieldnames, names, digests, results, context = marshal.loads(data)
+    except (OSError, struct.error, EOFError, TypeError, ValueError) as e:
+        raise StateError(e if isinstance(e, StateError) else f"{state_file}: {e}")
+    if state_kind != kind:
+        raise StateError(f"{state_file} was written by {state_kind}, not {kind}")
+
+    previous_digests = {}
+    previous_results = {}
+    previous_status = {}
+    for index, (name, result) in enumerate(zip(names, results)):
+        digest = digests[index * DIGEST_SIZE:(index + 1) * DIGEST_SIZE]
+        previous_digests[name] = digest
+        if result is not None:
+            previous_results[digest] = result
+            previous_status[name] = result[0]
+    return fieldnames, RuleDelta(previous_digests, previous_results, previous_status), context
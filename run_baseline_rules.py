@@ -0,0 +1,126 @@
+import argparse
+import contextlib
+import csv
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import separate_baseline_rules
+
+# Input files of a datacentre, named [Data Centre]_<suffix> by convention
+INPUT_SUFFIXES = {
+    'rows': '_rows.csv',
+    'extraction': '_Extraction.csv',
+    'address_groups': '_address_groups.csv',
+    'addresses': '_export_objects_addresses.csv',
+    'baseline': '_Baseline.csv',
+}
+SUMMARY_FILE = 'baseline_rules_summary.csv'
+
+# Function to load the datacentres to process from a manifest
+def load_manifest(manifest_file, input_dir='.'):
+    """
+    Read a manifest CSV with a 'Data Centre' column (e.g. GSU, AWS, EMP, NB2, NFV).
+
+    Optional rows / extraction / address_groups / addresses / baseline columns
+    override the conventional [Data Centre]_*.csv input file names. A name listed
+    twice raises ValueError, since both runs would write the same output files.
+    """
+    datacentres = []
+    with open(manifest_file, 'r', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            name = row['Data Centre'].strip()
+            if not name or name.startswith('#'):
+                continue
+            if any(name == listed for listed, _ in datacentres):
+                raise ValueError(f"Data Centre {name} is listed more than once in {manifest_file}")
+            inputs = {}
+            for key, suffix in INPUT_SUFFIXES.items():
+                path = (row.get(key) or '').strip() or f'{name}{suffix}'
+                inputs[key] = os.path.join(input_dir, path)
+            datacentres.append((name, inputs))
+    return datacentres
+
+# Function to count the rules written for a datacentre and how many of them fall inside the baseline
+def count_rules(filtered_file):
+    rules = baseline_rules = 0
+    with open(filtered_file, 'r', newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            rules += 1
+            if row['Subnet']:
+                baseline_rules += 1
+    return rules, baseline_rules
+
+# Function to process one datacentre, logging its console output to its own file
+def run_datacentre(name, inputs, output_dir):
+    output_prefix = os.path.join(output_dir, f'{name}_')
+    log_file = f'{output_prefix}separate_baseline_rules.log'
+    start = time.perf_counter()
+    try:
+        with open(log_file, 'w') as log, contextlib.redirect_stdout(log):
+            outputs = separate_baseline_rules.main(inputs['rows'], inputs['extraction'], inputs['address_groups'],
+                                                   inputs['addresses'], inputs['baseline'], output_prefix)
+        rules, baseline_rules = count_rules(outputs[2])
+        status = 'ok'
+    except Exception as e:
+        outputs, rules, baseline_rules = (), '', ''
+        status = f'failed: {type(e).__name__}: {e}'
+    seconds = time.perf_counter() - start
+    return {'Data Centre': name, 'Status': status, 'Seconds': f'{seconds:.2f}', 'Rules': rules,
+            'Baseline Rules': baseline_rules, 'Outputs': ';'.join(outputs), 'Log': log_file}
+
+def run_all(datacentres, output_dir='.', workers=None):
+    """
+    Run separate_baseline_rules for every datacentre, each in its own process with
+    [Data Centre]_-prefixed outputs, and write a combined summary CSV.
+
+    A full audit takes as long as the slowest datacentre rather than the sum of all of them.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = workers or min(len(datacentres), os.cpu_count() or 1)
+    start = time.perf_counter()
+    results = {}
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run_datacentre, name, inputs, output_dir): name for name, inputs in datacentres}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+            print(f"{result['Data Centre']}: {result['Status']} in {result['Seconds']}s "
+                  f"({result['Rules'] or 0} rules, {result['Baseline Rules'] or 0} in baseline)")
+
+    # Summary rows follow the manifest order
+    summary_file = os.path.join(output_dir, SUMMARY_FILE)
+    with open(summary_file, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['Data Centre', 'Status', 'Seconds', 'Rules', 'Baseline Rules', 'Outputs', 'Log'])
+        writer.writeheader()
+        for name, _ in datacentres:
+            writer.writerow(results[name])
+
+    elapsed = time.perf_counter() - start
+    slowest = max(results.values(), key=lambda result: float(result['Seconds']))
+    print(f"\nProcessed {len(datacentres)} datacentres in {elapsed:.2f}s "
+          f"(slowest: {slowest['Data Centre']} {slowest['Seconds']}s). Summary saved to {summary_file}")
+    return [results[name] for name, _ in datacentres]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run separate_baseline_rules.py for every datacentre of a manifest in parallel.")
+    parser.add_argument('manifest', help="CSV with a 'Data Centre' column and optional input file overrides.")
+    parser.add_argument('--input-dir', default='.', help="Directory holding the [Data Centre]_*.csv inputs (default: current directory).")
+    parser.add_argument('--output-dir', default='.', help="Directory for the [Data Centre]_-prefixed outputs and the summary (default: current directory).")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: one per datacentre, up to the CPU count).")
+    args = parser.parse_args()
+
+    try:
+        datacentres = load_manifest(args.manifest, args.input_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    if not datacentres:
+        parser.error(f"no datacentres listed in {args.manifest}")
+
+    results = run_all(datacentres, args.output_dir, args.workers)
+    if any(result['Status'] != 'ok' for result in results):
+        sys.exit(1)
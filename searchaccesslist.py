@@ -1,13 +1,22 @@
-import sys
+import argparse
 import csv
 import ipaddress
 
+from instrumentation import stage
+from subnet_index import SubnetIndex
+
 def load_file(file_path):
     with open(file_path, 'r') as file:
         return file.readlines()
 
 def parse_object_groups(lines, subnet):
     object_groups = {}
+    # Parse the subnet once; an invalid subnet matches no addresses
+    try:
+        network = ipaddress.ip_network(subnet)
+    except ValueError as e:
+        print(f"Invalid target subnet: {subnet} - {e}")
+        network = None
     for line in lines:
         if line.strip() and not line.startswith('#'):
             parts = line.strip().split()
@@ -19,7 +28,7 @@ def parse_object_groups(lines, subnet):
                 if ip_address:
                     try:
                         ip_obj = ipaddress.ip_address(ip_address)
-                        if ip_obj in ipaddress.ip_network(subnet):
+                        if network is not None and ip_obj in network:
                             object_groups[object_group_name] = ip_address
                     except ValueError:
                         # Skip invalid IP addresses
@@ -39,6 +48,78 @@ def parse_access_lists(lines):
                 access_lists.append((object_groups, command))
     return access_lists
 
+def load_target_subnets(file_path):
+    targets = []
+    for line in load_file(file_path):
+        line = line.strip()
+        if line and not line.startswith('#') and line not in targets:
+            targets.append(line)
+    return targets
+
+def build_target_index(targets):
+    # One interval index over every target subnet (targets may overlap or nest)
+    target_index = SubnetIndex()
+    # Indexed network -> every target written for it (e.g. '10.0.0.5' and '10.0.0.5/32')
+    target_spellings = {}
+    for target in targets:
+        try:
+            network = ipaddress.ip_network(target)
+        except ValueError as e:
+            # As in single-subnet mode, an invalid target matches no addresses
+            print(f"Invalid target subnet: {target} - {e}")
+            continue
+        target_index.add(target, network)
+        target_spellings.setdefault(target_index.lookup_network(network), []).append(target)
+    return target_index, target_spellings
+
+def parse_object_groups_multi(lines, targets, target_index, target_spellings):
+    # Map each object group to the set of target subnets it has an address in
+    group_targets = {}
+    for line in lines:
+        if line.strip() and not line.startswith('#'):
+            parts = line.strip().split()
+            if len(parts) >= 2:
+                object_group_name = parts[1]
+                ip_address = parts[2] if len(parts) > 2 else None
+
+                if ip_address:
+                    try:
+                        ip_obj = ipaddress.ip_address(ip_address)
+                    except ValueError:
+                        # Skip invalid IP addresses
+                        continue
+                    matched = target_index.lookup_all_network(ipaddress.ip_network(ip_obj))
+                    for boundary in matched:
+                        group_targets.setdefault(object_group_name, set()).update(target_spellings[boundary])
+                else:
+                    # Groups without an IP are reported for every target, as in single-subnet mode
+                    group_targets.setdefault(object_group_name, set()).update(targets)
+    return group_targets
+
+def build_access_list_index(access_lists):
+    # Inverted index: object group token -> (access list position, token position)
+    access_list_index = {}
+    for position, (obj_groups, _) in enumerate(access_lists):
+        for token_position, obj_group in enumerate(obj_groups):
+            access_list_index.setdefault(obj_group, []).append((position, token_position))
+    return access_list_index
+
+def process_data_multi(group_targets, access_lists, targets):
+    access_list_index = build_access_list_index(access_lists)
+    target_groups = {}
+    for obj_group, matched_targets in group_targets.items():
+        for target in matched_targets:
+            target_groups.setdefault(target, []).append(obj_group)
+
+    results = []
+    for target in targets:
+        # Same (access list, token) order as process_data produces for a single subnet
+        hits = sorted(hit + (obj_group,) for obj_group in target_groups.get(target, [])
+                      for hit in access_list_index.get(obj_group, []))
+        for position, _, obj_group in hits:
+            results.append((target, obj_group, access_lists[position][1]))
+    return results
+
 def process_data(object_groups, access_lists):
     results = []
     for obj_groups, command in access_lists:
@@ -48,31 +129,48 @@ def process_data(object_groups, access_lists):
                 results.append((obj_group, command))
     return results
 
-def write_csv(results, file_path):
+def write_csv(results, file_path, header=('Object Group Name', 'Access List Command')):
     with open(file_path, 'w', newline='') as file:
         writer = csv.writer(file)
-        writer.writerow(['Object Group Name', 'Access List Command'])
+        writer.writerow(list(header))
         writer.writerows(results)
 
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python script.py object-groups.txt access-lists.txt")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Find access lists that reference object groups inside a target subnet.")
+    parser.add_argument('object_groups_file', help="Path to object-groups.txt.")
+    parser.add_argument('access_lists_file', help="Path to access-lists.txt.")
+    parser.add_argument('--subnet', default='172.31.40.16/28', help="Subnet to filter by (default: 172.31.40.16/28).")
+    parser.add_argument('--subnets-file', help="File with one target subnet per line; scans all of them in one pass.")
+    args = parser.parse_args()
+
+    with stage('load_inputs') as phase:
+        object_groups_lines = load_file(args.object_groups_file)
+        access_lists_lines = load_file(args.access_lists_file)
+        access_lists = parse_access_lists(access_lists_lines)
+        phase.rows = len(object_groups_lines) + len(access_lists_lines)
 
-    object_groups_file = sys.argv[1]
-    access_lists_file = sys.argv[2]
+    if args.subnets_file:
+        with stage('match_subnets') as phase:
+            targets = load_target_subnets(args.subnets_file)
+            target_index, target_spellings = build_target_index(targets)
+            group_targets = parse_object_groups_multi(object_groups_lines, targets, target_index, target_spellings)
+            results = process_data_multi(group_targets, access_lists, targets)
+            phase.rows = len(object_groups_lines) + len(access_lists)
 
-    subnet = '172.31.40.16/28'  # Define the subnet to filter by
+        with stage('write_csv', rows=len(results)):
+            write_csv(results, 'access_list_data_by_subnet.csv', ('Target Subnet', 'Object Group Name', 'Access List Command'))
+        print("CSV file 'access_list_data_by_subnet.csv' has been created successfully.")
+        return
 
-    object_groups_lines = load_file(object_groups_file)
-    access_lists_lines = load_file(access_lists_file)
+    subnet = args.subnet  # Define the subnet to filter by
 
-    object_groups = parse_object_groups(object_groups_lines, subnet)
-    access_lists = parse_access_lists(access_lists_lines)
+    with stage('match_subnet', rows=len(object_groups_lines) + len(access_lists)):
+        object_groups = parse_object_groups(object_groups_lines, subnet)
 
-    results = process_data(object_groups, access_lists)
+        results = process_data(object_groups, access_lists)
 
-    write_csv(results, 'access_list_data.csv')
+    with stage('write_csv', rows=len(results)):
+        write_csv(results, 'access_list_data.csv')
     print("CSV file 'access_list_data.csv' has been created successfully.")
 
 if __name__ == "__main__":
@@ -1,15 +1,22 @@
+import argparse
 import csv
-import ipaddress
+import os
+import sys
 
-# Function to load subnets from AWS_Baseline.csv
+from compliance_store import store_from_env
+from instrumentation import stage
+from rule_delta import RuleDelta, StateError, load_state, rule_digest, write_state
+from subnet_index import load_subnet_index
+
+# Script name recorded in the state file read by the next delta run
+STATE_KIND = 'separate_baseline_rules'
+
+# Extraction columns whose few distinct values repeat across thousands of rules
+INTERNED_COLUMNS = ('Source Zone', 'Destination Zone', 'Application', 'Service')
+
+# Function to load subnets from AWS_Baseline.csv into a longest-prefix-match index
 def load_subnets(subnets_file):
-    subnets = []
-    with open(subnets_file, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            subnet = row['Boundary'].strip()
-            subnets.append(subnet)
-    return subnets
+    return load_subnet_index(subnets_file)
 
 # Function to load IP addresses and their names from AWS_export_objects_addresses.csv
 def load_ips(addresses_file):
@@ -22,24 +29,28 @@ def load_ips(addresses_file):
             ips[name] = ip
     return ips
 
-# Function to check if an IP address belongs to any subnet
+# Function to return the most specific baseline subnet an IP address (or network) belongs to
 def check_ip_in_subnets(ip, subnets):
-    for subnet in subnets:
-        try:
-            # Check if the IP and subnet are compatible (IPv4 vs IPv6)
-            if ipaddress.ip_network(ip, strict=False).subnet_of(ipaddress.ip_network(subnet)):
-                return subnet
-        except (ValueError, TypeError):  # Handle incompatible IP types or invalid IPs
-            continue
-    return None
+    # Invalid IPs (FQDNs, ranges, ...) and IPv4/IPv6 mismatches resolve to None
+    return subnets.lookup(ip)
+
+# Function to resolve every address object to its baseline subnet once per run
+def resolve_ip_subnets(ips, subnets):
+    resolved = {}  # Each distinct address value is parsed only once
+    ip_to_subnet = {}
+    for name, ip in ips.items():
+        if ip not in resolved:
+            resolved[ip] = check_ip_in_subnets(ip, subnets)
+        ip_to_subnet[name] = resolved[ip]
+    return ip_to_subnet
 
 # Function to generate the first output file for IPs and subnets
-def generate_output(ips, subnets, output_file):
+def generate_output(ips, ip_to_subnet, output_file):
     with open(output_file, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(['Name', 'IP', 'Subnet'])
         for name, ip in ips.items():
-            subnet = check_ip_in_subnets(ip, subnets)
+            subnet = ip_to_subnet.get(name)
             writer.writerow([name, ip, subnet if subnet else ""])
 
 # Function to load address groups from AWS_address_groups.csv
@@ -53,47 +64,173 @@ def load_address_groups(address_groups_file):
             groups.append((group_name, addresses))
     return groups
 
+# Function to resolve the baseline subnets of each address group from the resolved addresses
+def resolve_group_subnets(groups, ip_to_subnet):
+    group_subnets = []
+    for group_name, addresses in groups:
+        subnets = set()
+        for address in addresses:
+            subnet = ip_to_subnet.get(address, None)
+            if subnet:
+                subnets.add(subnet)
+        group_subnets.append((group_name, addresses, tuple(subnets)))
+    return group_subnets
+
 # Function to generate the second output for groups and subnets
-def generate_group_output(groups, ips, subnets, output_file_2):
-    ip_to_subnet = {name: check_ip_in_subnets(ip, subnets) for name, ip in ips.items() if check_ip_in_subnets(ip, subnets)}
-    
+def generate_group_output(group_subnets, output_file_2):
     with open(output_file_2, 'w', newline='') as f:
         writer = csv.writer(f)
         writer.writerow(['Name', 'Addresses', 'Subnet'])
-        for group_name, addresses in groups:
-            group_subnets = set()
-            for address in addresses:
-                subnet = ip_to_subnet.get(address, None)
-                if subnet:
-                    group_subnets.add(subnet)
-            writer.writerow([group_name, ';'.join(addresses), ';'.join(group_subnets) if group_subnets else ""])
-
-# Function to load extraction rules from AWS_Extraction.csv
-def load_extraction_rules(extraction_file):
+        for group_name, addresses, subnets in group_subnets:
+            writer.writerow([group_name, ';'.join(addresses), ';'.join(subnets) if subnets else ""])
+
+class RuleHeader:
+    """ Column layout shared by every rule of an extraction file, matching the csv.DictReader keys. """
+    __slots__ = ('fieldnames', 'positions', 'columns', 'width', 'unique', 'source_column', 'destination_column',
+                 'interned')
+
+    def __init__(self, header):
+        positions = {}
+        for position, name in enumerate(header):
+            positions[name] = position  # Like DictReader, a repeated column keeps its last value
+        self.fieldnames = list(positions)
+        self.positions = list(positions.values())
+        self.columns = {name: index for index, name in enumerate(self.fieldnames)}
+        self.width = len(header)
+        self.unique = len(self.fieldnames) == self.width  # No repeated columns
+        self.source_column = self.columns['Source Address']
+        self.destination_column = self.columns['Destination Address']
+        self.interned = [self.columns[name] for name in INTERNED_COLUMNS if name in self.columns]
+
+
+class ExtractionRule:
+    """
+    One extraction rule, read like the DictReader row it replaces (rule[key], keys(), values()).
+
+    The zone, application and service cells are interned so their repeated values share one
+    string, the address lists are split once, and the header is shared by all rules.
+    """
+    __slots__ = ('header', 'cells', 'source', 'destination')
+
+    def __init__(self, header, row):
+        if header.unique and len(row) == header.width:
+            cells = list(row)
+        else:
+            cells = [row[position] if position < len(row) else None for position in header.positions]
+        for column in header.interned:
+            if cells[column] is not None:
+                cells[column] = sys.intern(cells[column])
+        self.source = tuple(map(sys.intern, cells[header.source_column].strip().split(';')))
+        self.destination = tuple(map(sys.intern, cells[header.destination_column].strip().split(';')))
+        cells[header.source_column] = cells[header.destination_column] = None
+        if len(row) > header.width:
+            cells.append(row[header.width:])  # DictReader's restkey (None) column
+        self.header = header
+        self.cells = tuple(cells)
+
+    def __getitem__(self, key):
+        column = self.header.columns[key] if key is not None else len(self.header.fieldnames)
+        if column == self.header.source_column:
+            return list(self.source)
+        if column == self.header.destination_column:
+            return list(self.destination)
+        return self.cells[column]
+
+    def keys(self):
+        return self.header.fieldnames + [None] * (len(self.cells) - len(self.header.fieldnames))
+
+    def values(self):
+        values = list(self.cells)
+        values[self.header.source_column] = list(self.source)
+        values[self.header.destination_column] = list(self.destination)
+        return values
+
+# Function to load extraction rules from AWS_Extraction.csv, appending each rule's content hash to `digests` if given
+def load_extraction_rules(extraction_file, digests=None):
     rules = []
     with open(extraction_file, 'r') as f:
-        reader = csv.DictReader(f)
+        reader = csv.reader(f)
+        header = next(reader, None)
+        if header is None:
+            return rules
+        rule_header = None
         for row in reader:
-            rule = row.copy()
-            rule['Source Address'] = row['Source Address'].strip().split(';')
-            rule['Destination Address'] = row['Destination Address'].strip().split(';')
-            rules.append(rule)
+            if not row:
+                continue  # DictReader skips blank lines
+            if rule_header is None:
+                rule_header = RuleHeader(header)
+            rules.append(ExtractionRule(rule_header, row))
+            if digests is not None:
+                digests.append(rule_digest(row))
     return rules
 
+# Function to load the addresses and groups outputs of a previous run, or None if they are not next to its results
+def load_previous_addresses(previous_results_file):
+    # The previous addresses outputs sit next to its baseline_rules_filtered.csv with the same prefix
+    directory, file_name = os.path.split(previous_results_file)
+    suffix = 'baseline_rules_filtered.csv'
+    if not file_name.endswith(suffix):
+        return None
+    prefix = os.path.join(directory, file_name[:-len(suffix)])
+    addresses_file, groups_file = f'{prefix}addresses.csv', f'{prefix}addresses_groups.csv'
+    if not (os.path.exists(addresses_file) and os.path.exists(groups_file)):
+        return None
+
+    with open(addresses_file, 'r') as f:
+        addresses = {row['Name']: row['Subnet'] or None for row in csv.DictReader(f)}
+    with open(groups_file, 'r') as f:
+        groups = {row['Name']: frozenset(filter(None, row['Subnet'].split(';'))) for row in csv.DictReader(f)}
+    return {'addresses': addresses, 'groups': groups}
+
+# Function to rebuild the delta state of a previous run from its extraction and baseline_rules_filtered.csv
+def load_previous_run(previous_extraction_file, previous_results_file):
+    digests = []
+    rules = load_extraction_rules(previous_extraction_file, digests)
+    previous_digests = {}
+    # Hash of a rule's cells as written to the results (addresses as lists) -> hash of its extraction row
+    written_digests = {}
+    for rule, digest in zip(rules, digests):
+        cells = rule.values()
+        previous_digests[cells[0]] = digest
+        written_digests[rule_digest(cells)] = digest
+
+    previous_results = {}
+    previous_status = {}
+    with open(previous_results_file, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        for row in reader:
+            if row:
+                # The last two columns are the Subnet and Address or Group computed for the rule
+                digest = written_digests.get(rule_digest(row[:-2]))
+                if digest is not None:
+                    previous_results[digest] = tuple(row[-2:])
+                previous_status[row[0]] = row[-2]
+    fieldnames = rules[0].header.fieldnames if rules else []
+    return fieldnames, RuleDelta(previous_digests, previous_results, previous_status), load_previous_addresses(previous_results_file)
+
+# Function to find the addresses and groups resolving to other baseline subnets than in the previous run
+def changed_address_names(previous, ip_to_subnet, group_to_subnet):
+    previous_addresses, previous_groups = previous['addresses'], previous['groups']
+    changed = {name for name in previous_addresses.keys() | ip_to_subnet.keys()
+               if previous_addresses.get(name) != ip_to_subnet.get(name)}
+    changed.update(name for name in previous_groups.keys() | group_to_subnet.keys()
+                   if previous_groups.get(name, frozenset()) != group_to_subnet.get(name, frozenset()))
+    return changed
+
 # Function to directly generate baseline_rules_filtered.csv without the IP column
-def generate_extraction_output_filtered(rules, groups, ips, subnets, rows_file, output_file_filtered):
-    ip_to_subnet = {name: check_ip_in_subnets(ip, subnets) for name, ip in ips.items() if check_ip_in_subnets(ip, subnets)}
-    group_to_subnet = {group_name: ';'.join({ip_to_subnet.get(addr) for addr in addresses if ip_to_subnet.get(addr)}) 
-                       for group_name, addresses in groups}
+def generate_extraction_output_filtered(rules, group_subnets, ip_to_subnet, rows_file, output_file_filtered,
+                                        delta=None, digests=None, changed_addresses=frozenset()):
+    group_to_subnet = {group_name: subnets for group_name, _, subnets in group_subnets}
 
-    rows_to_remove = []
+    rows_to_remove = set()
     with open(rows_file, 'r') as f:
         reader = csv.DictReader(f)
         for row in reader:
             if row.get('\ufeffrow', '').strip():
-                rows_to_remove.append(int(row['\ufeffrow'].strip()))
+                rows_to_remove.add(int(row['\ufeffrow'].strip()))
 
-    with open(output_file_filtered, 'w', newline='') as f:
+    with open(output_file_filtered, 'w', encoding='utf-8', newline='') as f:
         writer = csv.writer(f)
         headers = list(rules[0].keys()) + ['Subnet', 'Address or Group']
         writer.writerow(headers)
@@ -101,50 +238,137 @@ def generate_extraction_output_filtered(rules, groups, ips, subnets, rows_file,
         for idx, rule in enumerate(rules):
             if idx + 2 in rows_to_remove:
                 print ((idx+2), rule['\ufeffName'])
+                if delta:
+                    delta.record(rule.values()[0], digests[idx])
                 continue  # Skip rows that are in rows_to_remove
-            
+
+            # In delta mode, reuse the result of an unchanged rule unless one of its addresses resolves differently
+            cells = rule.values()
+            if delta:
+                carried = delta.lookup(digests[idx])
+                if carried and changed_addresses.isdisjoint(rule.source + rule.destination):
+                    writer.writerow(cells + list(carried))
+                    delta.record(cells[0], digests[idx], carried, carried=True)
+                    continue
+
             subnets_in_rule = set()
             addresses_or_groups = set()
             
             # Check for matches in Source and Destination Address
-            for addr in rule['Source Address'] + rule['Destination Address']:
-                if addr in ip_to_subnet and ip_to_subnet[addr]:
+            for addr in rule.source + rule.destination:
+                if ip_to_subnet.get(addr):
                     subnets_in_rule.add(ip_to_subnet[addr])
                     addresses_or_groups.add(addr)
-                if addr in group_to_subnet and group_to_subnet[addr]:
-                    subnets_in_rule.update(group_to_subnet[addr].split(';'))
+                if group_to_subnet.get(addr):
+                    subnets_in_rule.update(group_to_subnet[addr])
                     addresses_or_groups.add(addr)
 
             # Write rule with the new columns, without IP column
-            writer.writerow(list(rule.values()) + 
-                            [';'.join(subnets_in_rule) if subnets_in_rule else "",
-                             ';'.join(addresses_or_groups) if addresses_or_groups else ""])
+            result = [';'.join(subnets_in_rule) if subnets_in_rule else "",
+                      ';'.join(addresses_or_groups) if addresses_or_groups else ""]
+            writer.writerow(cells + result)
+            if delta:
+                delta.record(cells[0], digests[idx], tuple(result), carried=False)
         print ('')
 
 # Main function to process all files and generate outputs
-def main(AWS_rows_file, AWS_Extraction_file, AWS_address_groups_file, AWS_export_objects_addresses_file, AWS_Baseline_file):
-    subnets = load_subnets(AWS_Baseline_file)
-    ips = load_ips(AWS_export_objects_addresses_file)
-    groups = load_address_groups(AWS_address_groups_file)
-    
+def main(AWS_rows_file, AWS_Extraction_file, AWS_address_groups_file, AWS_export_objects_addresses_file, AWS_Baseline_file, output_prefix='',
+         previous_state_file=None, save_state=False, previous_extraction_file=None, previous_results_file=None):
+    with stage('load_inputs') as phase:
+        subnets = load_subnets(AWS_Baseline_file)
+        ips = load_ips(AWS_export_objects_addresses_file)
+        groups = load_address_groups(AWS_address_groups_file)
+        phase.rows = len(subnets) + len(ips) + len(groups)
+
+    # Resolve addresses and groups to baseline subnets once, shared by all three outputs
+    with stage('resolve_subnets', rows=len(ips) + len(groups)):
+        ip_to_subnet = resolve_ip_subnets(ips, subnets)
+        group_subnets = resolve_group_subnets(groups, ip_to_subnet)
+
     # Generate the first output for individual IPs and subnets
-    output_file_1 = 'addresses.csv'
-    generate_output(ips, subnets, output_file_1)
+    output_file_1 = f'{output_prefix}addresses.csv'
+    with stage('generate_output', rows=len(ips)):
+        generate_output(ips, ip_to_subnet, output_file_1)
 
     # Generate the second output for groups and subnets
-    output_file_2 = 'addresses_groups.csv'
-    generate_group_output(groups, ips, subnets, output_file_2)
+    output_file_2 = f'{output_prefix}addresses_groups.csv'
+    with stage('generate_group_output', rows=len(groups)):
+        generate_group_output(group_subnets, output_file_2)
 
     # Generate the third output directly as baseline_rules_filtered.csv without IP column
-    rules = load_extraction_rules(AWS_Extraction_file)
-    output_file_filtered = 'baseline_rules_filtered.csv'
-    generate_extraction_output_filtered(rules, groups, ips, subnets, AWS_rows_file, output_file_filtered)
+    has_previous = bool(previous_state_file or previous_extraction_file)
+    track_rules = has_previous or save_state
+    digests = [] if track_rules else None
+    with stage('load_extraction_rules') as phase:
+        rules = load_extraction_rules(AWS_Extraction_file, digests)
+        phase.rows = len(rules)
+    output_file_filtered = f'{output_prefix}baseline_rules_filtered.csv'
+    fieldnames = rules[0].header.fieldnames if rules else []
+    group_to_subnet = {group_name: frozenset(subnets) for group_name, _, subnets in group_subnets}
+
+    # In delta mode, only rules added or modified since the previous run, or using an address
+    # or group that now resolves differently, are classified again
+    delta = RuleDelta() if track_rules else None
+    changed_addresses = frozenset()
+    if has_previous:
+        with stage('load_previous_state') as phase:
+            if previous_state_file:
+                previous_fieldnames, delta, previous = load_state(previous_state_file, STATE_KIND)
+            else:
+                previous_fieldnames, delta, previous = load_previous_run(previous_extraction_file, previous_results_file)
+            if previous_fieldnames != fieldnames:
+                print("The previous extraction has different columns; recomputing every rule")
+                delta.previous_results = {}
+            elif previous is None:
+                print("Previous addresses outputs not found next to the previous results; recomputing every rule")
+                delta.previous_results = {}
+            else:
+                changed_addresses = changed_address_names(previous, ip_to_subnet, group_to_subnet)
+            phase.rows = len(delta.previous_digests)
+
+    with stage('generate_extraction_output_filtered', rows=len(rules)):
+        generate_extraction_output_filtered(rules, group_subnets, ip_to_subnet, AWS_rows_file, output_file_filtered,
+                                            delta, digests, changed_addresses)
+    if has_previous:
+        delta.write_report(f'{output_prefix}baseline_rules_delta.csv')
+
+    # Save the rule hashes, results and resolved addresses for the next delta run
+    if save_state:
+        with stage('save_state', rows=len(rules)):
+            write_state(f'{output_prefix}baseline_rules_state.bin', STATE_KIND, fieldnames, delta,
+                        {'addresses': ip_to_subnet, 'groups': group_to_subnet})
+
+    # Record the baseline subnets and filtered rules in the compliance store when FVC_STORE is set
+    store = store_from_env()
+    if store:
+        with stage('save_store', rows=len(rules)):
+            store.save_subnets(AWS_Baseline_file, subnets.networks())
+            store.import_rules_csv(output_file_filtered)
+            store.close()
 
     print(f"Generated files: {output_file_1}, {output_file_2}, {output_file_filtered}")
+    return output_file_1, output_file_2, output_file_filtered
 
 if __name__ == "__main__":
-    import sys
-    if len(sys.argv) != 6:
-        print("Usage: script.py AWS_rows.csv AWS_Extraction.csv AWS_address_groups.csv AWS_export_objects_addresses.csv AWS_Baseline.csv")
-    else:
-        main(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
+    parser = argparse.ArgumentParser(description="Resolve address objects, address groups and extraction rules to baseline subnets.")
+    parser.add_argument('rows_file', help="AWS_rows.csv: rows of the extraction to drop.")
+    parser.add_argument('extraction_file', help="AWS_Extraction.csv")
+    parser.add_argument('address_groups_file', help="AWS_address_groups.csv")
+    parser.add_argument('addresses_file', help="AWS_export_objects_addresses.csv")
+    parser.add_argument('baseline_file', help="AWS_Baseline.csv")
+    parser.add_argument('--previous-state', help="baseline_rules_state.bin written by the previous audit; enables delta verification.")
+    parser.add_argument('--previous-extraction', help="Extraction of the previous audit; enables delta verification without a state file.")
+    parser.add_argument('--previous-results', help="baseline_rules_filtered.csv of the previous audit (its addresses.csv and addresses_groups.csv must sit next to it).")
+    parser.add_argument('--save-state', action='store_true', help="Write baseline_rules_state.bin for the next delta run.")
+    args = parser.parse_args()
+
+    if bool(args.previous_extraction) != bool(args.previous_results):
+        parser.error("--previous-extraction and --previous-results must be given together")
+    if args.previous_state and args.previous_extraction:
+        parser.error("--previous-state cannot be combined with --previous-extraction and --previous-results")
+    try:
+        main(args.rows_file, args.extraction_file, args.address_groups_file, args.addresses_file, args.baseline_file,
+             previous_state_file=args.previous_state, save_state=args.save_state,
+             previous_extraction_file=args.previous_extraction, previous_results_file=args.previous_results)
+    except StateError as e:
+        parser.error(str(e))
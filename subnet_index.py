@@ -0,0 +1,230 @@
+import csv
+import ipaddress
+
+try:
+    import numpy as np
+except ImportError:  # Batch classification falls back to per-address lookups
+    np = None
+
+
+class SubnetIndex:
+    """
+    Longest-prefix-match index over the baseline boundaries.
+
+    Networks are bucketed by (IP version, prefix length) into hash tables keyed
+    by the network prefix. A lookup walks the prefix lengths present in the index
+    from the most to the least specific, so it costs at most one hash probe per
+    prefix length (O(prefix length)) regardless of how many boundaries are loaded.
+    """
+
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+        self._networks = {}
+
+    def __len__(self):
+        return len(self._networks)
+
+    def __contains__(self, boundary):
+        return boundary in self._networks
+
+    def add(self, boundary, network=None):
+        """ Add a boundary string (or an already parsed network) to the index. """
+        if network is None:
+            network = ipaddress.ip_network(boundary)
+        bits = network.max_prefixlen
+        prefix = int(network.network_address) >> (bits - network.prefixlen)
+        table = self._tables[network.version].setdefault(network.prefixlen, {})
+        # Keep the first boundary seen for a duplicated network, as the linear scans did
+        if prefix not in table:
+            table[prefix] = boundary
+            self._networks[boundary] = network
+            self._lengths[network.version] = sorted(self._tables[network.version], reverse=True)
+
+    def networks(self):
+        """ Return the boundary string -> ip_network mapping held by the index. """
+        return dict(self._networks)
+
+    def lookup_network(self, network):
+        """ Return the most specific boundary that contains the whole network, or None. """
+        bits = network.max_prefixlen
+        address = int(network.network_address)
+        tables = self._tables[network.version]
+        for length in self._lengths[network.version]:
+            if length > network.prefixlen:
+                continue
+            boundary = tables[length].get(address >> (bits - length))
+            if boundary is not None:
+                return boundary
+        return None
+
+    def lookup_all_network(self, network):
+        """ Return every boundary that contains the whole network, most specific first. """
+        bits = network.max_prefixlen
+        address = int(network.network_address)
+        tables = self._tables[network.version]
+        matches = []
+        for length in self._lengths[network.version]:
+            if length > network.prefixlen:
+                continue
+            boundary = tables[length].get(address >> (bits - length))
+            if boundary is not None:
+                matches.append(boundary)
+        return matches
+
+    def lookup_address(self, address):
+        """ Return the most specific boundary containing a parsed ip_address, or None. """
+        bits = address.max_prefixlen
+        value = int(address)
+        tables = self._tables[address.version]
+        for length in self._lengths[address.version]:
+            boundary = tables[length].get(value >> (bits - length))
+            if boundary is not None:
+                return boundary
+        return None
+
+    def intervals(self, version=4):
+        """
+        Flatten the indexed networks of one IP version into sorted, disjoint
+        (start, end, boundary) integer ranges, each labelled with its most specific boundary.
+        """
+        nets = sorted(
+            ((int(n.network_address), int(n.broadcast_address), b)
+             for b, n in self._networks.items() if n.version == version),
+            key=lambda item: (item[0], -item[1]))
+        segments = []
+        stack = []  # (end, boundary) of the networks enclosing the current position
+        cursor = 0
+        for start, end, boundary in nets:
+            while stack and stack[-1][0] < start:
+                top_end, top_boundary = stack.pop()
+                if cursor <= top_end:
+                    segments.append((cursor, top_end, top_boundary))
+                cursor = top_end + 1
+            if stack and cursor < start:
+                segments.append((cursor, start - 1, stack[-1][1]))
+            stack.append((end, boundary))
+            cursor = start
+        while stack:
+            top_end, top_boundary = stack.pop()
+            if cursor <= top_end:
+                segments.append((cursor, top_end, top_boundary))
+            cursor = top_end + 1
+        return segments
+
+    def lookup(self, value):
+        """
+        Return the most specific boundary containing an IP address or network string.
+
+        Returns None for values that are not valid addresses/networks (FQDNs, ranges, ...).
+        """
+        try:
+            network = ipaddress.ip_network(value.strip(), strict=False)
+        except (ValueError, TypeError, AttributeError):
+            return None
+        return self.lookup_network(network)
+
+
+def load_subnet_index(file_path, column='Boundary'):
+    """ Build a SubnetIndex from the 'Boundary' column of a *_Baseline.csv file. """
+    index = SubnetIndex()
+    with open(file_path, mode='r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        for row in reader:
+            boundary = row[column].strip()
+            try:
+                index.add(boundary)
+            except ValueError as e:
+                print(f"Error processing network: {boundary} - {e}")
+    return index
+
+
+def parse_ipv4_array(ips):
+    """
+    Parse a sequence of dotted-quad strings into a uint32 array in one vectorized pass.
+
+    Returns (values, valid); entries that are not strict IPv4 addresses (IPv6,
+    leading zeros, whitespace, garbage) are flagged invalid rather than raising.
+    """
+    count = len(ips)
+    # 16 UCS4 characters: any valid address fits in 15, so a 16th character marks an overlong value
+    chars = np.ascontiguousarray(np.asarray(ips, dtype='U16').view(np.uint32).reshape(count, 16).T)
+    value = np.zeros(count, dtype=np.uint64)
+    octet = np.zeros(count, dtype=np.uint32)
+    digits = np.zeros(count, dtype=np.uint8)
+    dots = np.zeros(count, dtype=np.uint8)
+    valid = chars[15] == 0
+    for column in range(15):
+        c = chars[column]
+        is_digit = (c >= 48) & (c <= 57)
+        is_dot = c == 46
+        valid &= is_digit | is_dot | (c == 0)
+        valid &= ~(is_dot & (digits == 0))
+        valid &= ~(is_digit & (digits == 1) & (octet == 0))  # leading zeros are rejected by ipaddress
+        value = np.where(is_dot, (value << np.uint64(8)) | octet, value)
+        octet = np.where(is_digit, octet * 10 + (c - 48), np.where(is_dot, 0, octet)).astype(np.uint32)
+        digits = np.where(is_digit, digits + 1, np.where(is_dot, 0, digits)).astype(np.uint8)
+        dots += is_dot
+        valid &= (octet <= 255) & (digits <= 3)
+    valid &= (dots == 3) & (digits > 0)
+    value = (value << np.uint64(8)) | octet
+    return value.astype(np.uint32), valid
+
+
+def classify_ips(ips, subnet_index):
+    """
+    Resolve a whole column of IP strings against the index in one batch.
+
+    IPv4 values are parsed into a NumPy uint32 array and matched with a single
+    searchsorted over the flattened baseline intervals; anything else (IPv6 or
+    values the vectorized parser rejects) goes through the scalar lookup. Returns
+    a list aligned with `ips` holding the most specific boundary or "".
+    """
+    ips = list(ips)
+    if np is None or not ips:
+        return [_classify_one(ip, subnet_index) for ip in ips]
+
+    values, valid = parse_ipv4_array(ips)
+    segments = subnet_index.intervals(4)
+    labels = np.array([boundary for _, _, boundary in segments] + [""], dtype=object)
+    if segments:
+        starts = np.array([start for start, _, _ in segments], dtype=np.uint32)
+        ends = np.array([end for _, end, _ in segments], dtype=np.uint32)
+        position = np.searchsorted(starts, values, side='right') - 1
+        hit = valid & (position >= 0) & (values <= ends[position.clip(0)])
+        codes = np.where(hit, position, len(segments))
+    else:
+        codes = np.full(len(ips), 0)
+    result = labels[codes]
+
+    for i in np.flatnonzero(~valid):
+        result[i] = _classify_one(ips[i], subnet_index)
+    return result.tolist()
+
+
+def first_match_by_key(keys, ips, subnet_index):
+    """
+    Classify `ips` in one batch and return {key: boundary} holding, for every key,
+    the boundary of the first of its IPs (in input order) that falls inside the baseline.
+    """
+    matched = classify_ips(ips, subnet_index)
+    if np is None or not matched:
+        first_matches = {}
+        for key, boundary in zip(keys, matched):
+            if boundary:
+                first_matches.setdefault(key, boundary)
+        return first_matches
+
+    matched = np.array(matched, dtype=object)
+    rows = np.flatnonzero(matched != "")
+    matched_keys = np.array(keys, dtype=object)[rows]
+    # return_index gives the first matching row of every key
+    _, first = np.unique(matched_keys, return_index=True)
+    return dict(zip(matched_keys[first].tolist(), matched[rows[first]].tolist()))
+
+
+def _classify_one(ip, subnet_index):
+    try:
+        return subnet_index.lookup_address(ipaddress.ip_address(ip)) or ""
+    except ValueError:
+        return ""
@@ -0,0 +1,149 @@
+import importlib
+import json
+import os
+import random
+import sys
+
+import pytest
+
+import baseline_contract
+import contracts_filters
+import extract_endpoints
+import extract_ips
+import getcontracts
+from apic_cache import CACHE_DIR_ENV, ApicCache
+from apic_stream import iter_imdata
+from apic_tables import cached_tables, read_export
+from baseline_contract import index_epg_tables, index_epgs
+
+baseline_contracts = importlib.import_module('baseline-contracts')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+import generate_data  # noqa: E402
+
+ODD_EXPORT = {'totalCount': '7', 'imdata': [
+    {'fvAEPg': {'attributes': {'name': 'web', 'prefGrMemb': 'exclude'}, 'children': [
+        {'fvCEp': {'attributes': {'ip': '10.0.0.1', 'mac': 'aa'}}},
+        {},
+        {'fvRsCons': {'attributes': {'tnVzBrCPName': 'c1'}}, 'fvRsProv': {'attributes': {}}},
+        {'fvCEp': {'attributes': {'mac': 'bb', 'ip': '10.0.0.2'}, 'children': []}}]}},
+    [1, 2],
+    {},
+    {'fvAEPg': {'attributes': {'name': 'db'}}, 'vzBrCP': {'children': [{'vzSubj': {}}]}},
+    'text',
+    {'fvAEPg': {'attributes': {'name': 'raw'}, 'extra': 1}},
+    {'fvAEPg': {'attributes': {'name': 'app'}, 'children': [{'fvCEp': {'attributes': {'ip': '10.0.0.3'}, 'extra': 1}}]}},
+    {'vzBrCP': {'attributes': {'name': 'c1', 'descr': ''}}},
+]}
+
+# Well-formed MOs in every shape the readers handle: empty elements and children, relations without
+# attributes, objects nested under other classes, repeated names and elements with several classes
+REGULAR_EXPORT = {'imdata': [
+    {},
+    {'fvAEPg': {'attributes': {'name': 'web', 'prefGrMemb': 'include'}, 'children': [
+        {},
+        {'fvCEp': {'attributes': {'ip': '10.0.0.1', 'mac': 'aa'}, 'children': []}},
+        {'fvRsProv': {'attributes': {'tnVzBrCPName': 'c2'}}, 'fvRsCons': {'attributes': {}}},
+        {'fvRsCons': {'attributes': {'tnVzBrCPName': 'c1'}}},
+        {'fvCEp': {'attributes': {'ip': '10.0.0.2', 'mac': 'bb'}}},
+        {'fvRsProv': {'attributes': {'tnVzBrCPName': 'c3'}}}]},
+     'vzBrCP': {'attributes': {'name': 'c1'}}},
+    {'fvAEPg': {'attributes': {'name': 'web'}, 'children': []}},
+    {'fvAEPg': {'attributes': {'name': 'db'}, 'children': [
+        {'fvCEp': {'attributes': {'ip': '10.0.1.1', 'mac': 'cc'},
+                   'children': [{'fvRsCons': {'attributes': {'tnVzBrCPName': 'nested'}}}]}}]}},
+    {'vzBrCP': {'attributes': {'name': 'c2', 'descr': 'two'}, 'children': [
+        {},
+        {'vzSubj': {}},
+        {'vzSubj': {'attributes': {'name': 's1'}, 'children': [
+            {'vzRsSubjFiltAtt': {'attributes': {'tnVzFilterName': 'f1'}}},
+            {'vzRsSubjFiltAtt': {}},
+            {'vzRsSubjFiltAtt': {'attributes': {'tnVzFilterName': 'f2'}}},
+            {'other': {'attributes': {}}}]}},
+        {'vzSubj': {'attributes': {'name': 's2'}, 'children': []}},
+        {'vzSubj': {'children': [{'vzRsSubjFiltAtt': {'attributes': {'tnVzFilterName': 'f3'}}}]}}]}},
+    {'vzBrCP': {'children': [{'vzSubj': {'attributes': {'name': 's3'}}}]}},
+    {'vzFilter': {'attributes': {'name': 'f1'}, 'children': [
+        {},
+        {'vzEntry': {'attributes': {'etherT': 'ip', 'prot': 'tcp', 'dFromPort': '443', 'dToPort': '443'}}},
+        {'vzEntry': {}},
+        {'vzEntry': {'attributes': {'etherT': 'ip', 'prot': 'udp', 'dFromPort': 'dns', 'dToPort': 'dns'}},
+         'other': {'attributes': {}}},
+        {'vzEntry': {'attributes': {'etherT': 'unspecified'}}}]}},
+    {'vzFilter': {'children': [{'vzEntry': {'attributes': {'prot': 'tcp', 'dToPort': '22'}}}]}},
+    {'vzFilter': {'attributes': {'name': 'f1'}}},
+    {'vzFilter': {'attributes': {'name': 'f2'}, 'children': [
+        {'vzSubj': {'children': [{'vzEntry': {'attributes': {'dToPort': '80'}}}]}}]}},
+]}
+
+# Every script's (stream reader, table reader, classes), as passed to read_export
+READERS = {
+    'baseline_contract': (index_epgs, index_epg_tables, baseline_contract.EPG_CLASSES),
+    'baseline-contracts': (baseline_contracts.iter_epg_endpoints, baseline_contracts.epg_endpoint_tables,
+                           baseline_contracts.EPG_CLASSES),
+    'extract_endpoints': (extract_endpoints.iter_epg_relations, extract_endpoints.epg_relation_tables,
+                          extract_endpoints.EPG_CLASSES),
+    'extract_ips': (extract_ips.find_ip_addresses, extract_ips.ip_address_tables, extract_ips.EPG_CLASSES),
+    'getcontracts': (getcontracts.iter_contracts, getcontracts.contract_tables, getcontracts.CONTRACT_CLASSES),
+    'contracts_filters filters': (contracts_filters.iter_filters, contracts_filters.filter_tables,
+                                  contracts_filters.FILTER_CLASSES),
+    'contracts_filters contracts': (contracts_filters.iter_contract_subjects, contracts_filters.contract_subject_tables,
+                                    contracts_filters.CONTRACT_CLASSES),
+}
+
+
+def generated_exports(directory):
+    rng = random.Random(0)
+    exports = {name: str(directory / f'{name}.json') for name in ('epgs', 'contracts', 'filters')}
+    generate_data.generate_apic_epgs(exports['epgs'], 50, 5, 20, rng)
+    generate_data.generate_apic_contracts(exports['contracts'], 20, 30, rng)
+    generate_data.generate_apic_filters(exports['filters'], 30, rng)
+    return list(exports.values())
+
+
+def write_export(directory, export):
+    path = directory / 'input.json'
+    path.write_text(json.dumps(export), encoding='utf-8')
+    return str(path)
+
+
+def outcome(read):
+    # A reader's result as a list or tuple, or the exception it raised
+    try:
+        result = read()
+        return result if isinstance(result, tuple) else list(result)
+    except Exception as e:  # noqa: BLE001
+        return type(e)
+
+
+def test_index_epg_tables_matches_index_epgs_over_the_stream(tmp_path):
+    export = str(tmp_path / 'input.json')
+    generate_data.generate_apic_epgs(export, 50, 5, 20, random.Random(0))
+    cache = ApicCache(str(tmp_path / 'cache'))
+    cached_tables(cache, export)
+    assert index_epg_tables(cached_tables(cache, export)) == index_epgs(iter_imdata(export))
+
+
+@pytest.mark.parametrize('reader', READERS)
+def test_table_readers_match_their_stream_readers(tmp_path, reader):
+    read_imdata, read_tables, classes = READERS[reader]
+    cache = ApicCache(str(tmp_path / 'cache'))
+    for path in generated_exports(tmp_path) + [write_export(tmp_path, REGULAR_EXPORT)]:
+        tables = cached_tables(cache, path)
+        assert tables.regular(classes)
+        assert outcome(lambda: read_tables(tables)) == outcome(lambda: read_imdata(iter_imdata(path))), path
+
+
+@pytest.mark.parametrize('export', [ODD_EXPORT, REGULAR_EXPORT, {'imdata': []}, {},
+                                    {'imdata': [{'fvAEPg': {'attributes': {'prefGrMemb': 'include'}}}]},
+                                    {'imdata': [{'fvAEPg': {'attributes': {'name': 'web'}, 'children': [
+                                        {'fvCEp': {'attributes': {'mac': 'aa'}}}]}}]}])
+@pytest.mark.parametrize('reader', READERS)
+def test_read_export_from_the_cache_matches_the_stream(tmp_path, monkeypatch, export, reader):
+    # Irregular exports, like a nameless EPG or an endpoint without an IP, fall back to the stream
+    read_imdata, read_tables, classes = READERS[reader]
+    path = write_export(tmp_path, export)
+    streamed = outcome(lambda: read_export(path, read_imdata, read_tables, classes))
+    monkeypatch.setenv(CACHE_DIR_ENV, str(tmp_path / 'cache'))
+    assert outcome(lambda: read_export(path, read_imdata, read_tables, classes)) == streamed  # Miss
+    assert outcome(lambda: read_export(path, read_imdata, read_tables, classes)) == streamed  # Hit
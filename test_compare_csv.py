@@ -0,0 +1,55 @@
+import random
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('openpyxl')
+import compare_csv  # noqa: E402
+
+ALPHABET = 'abcdeé0123-. '
+
+
+def random_frame(rng, rows, columns):
+    # Short cells over a small alphabet, with empty cells, so many pairs sit near the threshold
+    values = [[''.join(rng.choice(ALPHABET) for _ in range(rng.choice([0, 1, 2, 4, 8, 16])))
+               for _ in range(columns)] for _ in range(rows)]
+    return pd.DataFrame(values, columns=[f'c{i}' for i in range(columns)])
+
+
+def all_pairs(tables1, tables2, similarity_threshold):
+    matches = []
+    for position1, texts1 in enumerate(tables1[1]):
+        for position2, texts2 in enumerate(tables2[1]):
+            row_similarity = [compare_csv.similar(a, b) for a, b in zip(texts1, texts2)]
+            avg_similarity = sum(row_similarity) / len(row_similarity)
+            if avg_similarity >= similarity_threshold:
+                matches.append((position1, position2, avg_similarity))
+    return matches
+
+
+@pytest.mark.parametrize('similarity_threshold', [0.3, 0.5, 0.7, 0.9, 1.0])
+def test_blocking_keeps_every_pair_reaching_the_threshold(similarity_threshold):
+    rng = random.Random(similarity_threshold)
+    df1 = random_frame(rng, 60, 3)
+    df2 = pd.concat([random_frame(rng, 60, 3), df1.iloc[:10]], ignore_index=True)
+    tables1, tables2 = compare_csv.build_row_tables(df1), compare_csv.build_row_tables(df2)
+    found = list(compare_csv.find_similar_rows(tables1, tables2, similarity_threshold, workers=1))
+    assert found == all_pairs(tables1, tables2, similarity_threshold)
+
+
+def test_blocking_selects_rows_sharing_rare_characters():
+    df1 = pd.DataFrame([['rule-7', 'obj-xyz']], columns=['Name', 'Address'])
+    df2 = pd.DataFrame([['rule-1', 'obj-abc'], ['rule-7', 'obj-xyz'], ['rule-2', 'obj-abd']], columns=['Name', 'Address'])
+    _, _, lengths1, histograms1 = compare_csv.build_row_tables(df1)
+    index = compare_csv.BucketIndex(compare_csv.build_row_tables(df2)[3])
+    assert index.candidates(lengths1[0], histograms1[0], 0.9).tolist() == [1]
+
+
+@pytest.mark.parametrize('writer', [compare_csv.CsvReportWriter, compare_csv.NdjsonReportWriter])
+def test_report_writer_closes_its_file_on_error(tmp_path, writer):
+    with pytest.raises(RuntimeError):
+        with writer(str(tmp_path / 'report'), ['Name']) as report:
+            report.write_pair(0, 1, 1.0, ['a'], ['a'])
+            raise RuntimeError
+    assert report.file.closed
+    assert (tmp_path / 'report').read_text(encoding='utf-8')
@@ -0,0 +1,30 @@
+import csv
+
+from compare_policies import compare_policy_sets
+
+
+def write_export(path, names):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(''.join(f'{name}\n' for name in names))
+
+
+def test_exports_with_the_same_file_name_get_distinct_columns(tmp_path):
+    write_export(tmp_path / 'dc1' / 'policies.csv', ['a', 'b'])
+    write_export(tmp_path / 'dc2' / 'policies.csv', ['b', 'c'])
+    output = tmp_path / 'out.csv'
+    compare_policy_sets([str(tmp_path / 'dc1' / 'policies.csv'), str(tmp_path / 'dc2' / 'policies.csv')], [0, 0], str(output))
+    with open(output, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['Policy Name', 'Status', 'dc1/policies.csv Rows', 'dc2/policies.csv Rows']
+    assert rows[1:] == [['a', 'removed', '0', ''], ['b', 'matched', '1', '0'], ['c', 'added', '', '1']]
+
+
+def test_the_same_export_twice_gets_numbered_columns(tmp_path):
+    with open(tmp_path / 'policies.csv', 'w', newline='') as f:
+        csv.writer(f).writerows([['a', 'b'], ['b', 'c']])
+    output = tmp_path / 'out.csv'
+    compare_policy_sets([str(tmp_path / 'policies.csv')] * 2, [0, 1], str(output))
+    with open(output, newline='') as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ['Policy Name', 'Status', 'policies.csv (1) Rows', 'policies.csv (2) Rows']
+    assert rows[1:] == [['a', 'removed', '0', ''], ['b', 'matched', '1', '0'], ['c', 'added', '', '1']]
@@ -0,0 +1,62 @@
+import csv
+import random
+
+import update_baseline_rules
+from compliance_store import STORE_ENV, ComplianceStore
+
+ZONES = ['trust', 'dmz', 'ANY', 'Any', 'any', ' any ', 'untrust', 'vpn', '']
+ADDRESSES = ["['any']", "['rfc-1918']", "['[negate] rfc-1918']", "['obj-1', 'any']", "['obj-2']", 'any', '']
+
+
+def write_rules(path, rng):
+    # Short rows, blank lines, repeated and empty zones and a non-ASCII rule name
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['\ufeffName', 'Source Zone', 'Source Address', 'Destination Zone', 'Destination Address',
+                         'Subnet', 'Address or Group'])
+        for i in range(300):
+            row = [f'rule-{i}-é', ','.join(rng.sample(ZONES, rng.randrange(4))), rng.choice(ADDRESSES),
+                   ','.join(rng.sample(ZONES, rng.randrange(4))), rng.choice(ADDRESSES), '', '']
+            if i % 50 == 7:
+                row = row[:5]
+            writer.writerow(row)
+            if i % 100 == 3:
+                f.write('\r\n')
+
+
+def read_output(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_stored_rules_are_updated_like_the_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_rules('rules.csv', random.Random(0))
+    with open('zones.csv', 'w', encoding='utf-8', newline='') as f:
+        csv.writer(f).writerows([['Security Zone'], ['trust'], [' vpn'], ['ANY']])
+
+    update_baseline_rules.modify_rules('rules.csv', 'zones.csv', 'csv_output.csv')
+    store = ComplianceStore(str(tmp_path / 'store.db'))
+    store.import_rules_csv('rules.csv')
+    store.close()
+    monkeypatch.setenv(STORE_ENV, str(tmp_path / 'store.db'))
+    update_baseline_rules.modify_rules('rules.csv', 'zones.csv', 'store_output.csv')
+    assert read_output('store_output.csv') == read_output('csv_output.csv')
+
+    # The output was imported in turn, so the next stage can query its rules by name
+    store = ComplianceStore(str(tmp_path / 'store.db'))
+    assert store.is_current('store_output.csv', 'rules')
+    output_rules = [row[1:] for row in store.rules_named('rule-5-é') if row[0] == str(tmp_path / 'store_output.csv')]
+    assert output_rules == [tuple(read_output('csv_output.csv')[6][5:])]
+    store.close()
+
+
+def test_rule_zone_matches(tmp_path):
+    rules = tmp_path / 'rules.csv'
+    rules.write_text('Name,Source Zone,Destination Zone\nr0,"trust, dmz",any\nr1,,ANY\nr2,dmz,\n', encoding='utf-8')
+    store = ComplianceStore(str(tmp_path / 'store.db'))
+    store.import_rules_csv(str(rules))
+    assert store.rule_zone_matches(str(rules), {'trust'}) == {(0, 'source'), (0, 'destination'), (1, 'destination')}
+    assert store.rule_zone_matches(str(rules), {'dmz', 'Any'}) == {
+        (0, 'source'), (0, 'destination'), (1, 'destination'), (2, 'source')}
+    store.close()
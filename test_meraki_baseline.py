@@ -0,0 +1,74 @@
+import importlib.util
+import os
+import random
+
+import pytest
+
+# meraki-baseline.py is not importable by name because of the hyphen
+spec = importlib.util.spec_from_file_location(
+    'meraki_baseline', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'meraki-baseline.py'))
+meraki_baseline = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(meraki_baseline)
+
+RAGGED_CSV = (
+    'Policy,Source,Destination,Port,Comment\n'
+    'allow,10.96.1.0/24,any,443,c1\n'
+    'allow,"192.168.0.0/24,10.100.0.0/16",8.8.8.8/32\n'
+    'deny,1.1.1.1/32,2.2.2.2/32,80,c3,extra1,extra2\n'
+    'allow,Any,,,\n'
+    'allow,bad,10.0.0.0/8;10.97.0.0/16,22,"quoted, comma"\n'
+)
+
+
+def test_check_subnet_in_range_corrected():
+    intervals = meraki_baseline.build_target_intervals([meraki_baseline.DEFAULT_TARGET])
+    assert meraki_baseline.check_subnet_in_range_corrected('10.100.0.0/16', intervals) == 'Baseline'
+    assert meraki_baseline.check_subnet_in_range_corrected('10.0.0.0/8', intervals) == 'Baseline'  # contains the target
+    assert meraki_baseline.check_subnet_in_range_corrected('192.168.0.0/24;Any', intervals) == 'Baseline'
+    assert meraki_baseline.check_subnet_in_range_corrected('10.104.0.0/24', intervals) == 'Non-Baseline'
+    assert meraki_baseline.check_subnet_in_range_corrected('bad,10.95.0.1/32', intervals) == 'Non-Baseline'
+
+
+def test_merged_target_intervals():
+    starts, ends = meraki_baseline.build_target_intervals(['10.0.0.0/24', '10.0.1.0/24', '10.0.0.0/25', '10.0.3.0/24'])
+    assert len(starts) == 2
+    assert meraki_baseline.overlaps_targets(167772416, 167772416, (starts, ends))  # 10.0.1.0
+    assert not meraki_baseline.overlaps_targets(167772672, 167772672, (starts, ends))  # 10.0.2.0
+
+
+def test_invalid_target_is_skipped(capsys):
+    intervals = meraki_baseline.build_target_intervals(['10.0.0.0/24', 'not-a-subnet', '10.0.0.1/24'])
+    assert 'Invalid target subnet: not-a-subnet' in capsys.readouterr().out
+    assert intervals == meraki_baseline.build_target_intervals(['10.0.0.0/24'])
+    assert meraki_baseline.check_subnet_in_range_corrected('10.0.0.0/25', intervals) == 'Baseline'
+
+
+@pytest.mark.parametrize('chunksize', [1, 2, 1000])
+def test_chunked_matches_row_by_row_on_ragged_rows(tmp_path, chunksize):
+    pytest.importorskip('numpy')
+    input_path = tmp_path / 'rules.csv'
+    input_path.write_text(RAGGED_CSV)
+    intervals = meraki_baseline.build_target_intervals([meraki_baseline.DEFAULT_TARGET])
+
+    meraki_baseline.classify_rows(str(input_path), str(tmp_path / 'rows.csv'), intervals)
+    meraki_baseline.classify_chunked(str(input_path), str(tmp_path / 'chunked.csv'), intervals, chunksize)
+
+    expected = (tmp_path / 'rows.csv').read_bytes()
+    assert (tmp_path / 'chunked.csv').read_bytes() == expected
+    assert expected.decode().splitlines()[2:4] == [
+        'allow,"192.168.0.0/24,10.100.0.0/16",8.8.8.8/32,Baseline',
+        'deny,1.1.1.1/32,2.2.2.2/32,80,c3,extra1,extra2,Non-Baseline',
+    ]
+
+
+def test_baseline_mask_matches_the_row_check():
+    pytest.importorskip('numpy')
+    rng = random.Random(0)
+    tokens = ['Any', ' any ', '', 'bad', '10.96.0.0/13', '10.96.0.0/08', '10.0.0.0/255.0.0.0', '10.96.0.1/24',
+              '10.96.0.0/33', '10.96.0.0/', '010.96.0.1', '10.104.0.0/16', '0.0.0.0/0', '2001:db8::/32', '10.103.255.255']
+    tokens += [f'10.{rng.randrange(90, 110)}.{rng.randrange(256)}.0/{rng.choice([8, 12, 16, 24, 32])}' for _ in range(200)]
+    cells = [rng.choice([';', ', ', ',']).join(rng.sample(tokens, rng.randint(1, 4))) for _ in range(500)]
+    for targets in ([meraki_baseline.DEFAULT_TARGET], ['10.100.5.0/24', '10.101.0.0/16'], []):
+        intervals = meraki_baseline.build_target_intervals(targets)
+        expected = [meraki_baseline.check_subnet_in_range_corrected(cell, intervals) == 'Baseline' for cell in cells]
+        assert meraki_baseline.baseline_mask(cells, intervals).tolist() == expected
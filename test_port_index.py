@@ -0,0 +1,69 @@
+import pytest
+
+from port_index import (ANY_PORT_RANGE, MAX_PORT, PortIndex, PortRange, entry_port_range, filter_port_ranges,
+                        load_port_index, parse_port_query)
+
+
+def entry(**attributes):
+    return {'vzEntry': {'attributes': attributes}}
+
+
+@pytest.fixture
+def index():
+    index = PortIndex()
+    index.add('web', 'https', PortRange('tcp', 443, 443))
+    index.add('web', 'alt', PortRange('tcp', 8000, 8100))
+    index.add('dns', 'dns', PortRange('udp', 53, 53))
+    index.add('all', 'default', ANY_PORT_RANGE)
+    index.add_contract('empty')
+    return index
+
+
+def test_point_and_range_lookups(index):
+    assert index.lookup('tcp', 443) == {'web', 'all'}
+    assert index.lookup('TCP', 444) == {'all'}
+    assert index.lookup('udp', 53) == {'dns', 'all'}
+    assert index.lookup_range('tcp', 400, 8000) == {'web', 'all'}
+    assert index.lookup_range('tcp', 444, 7999) == {'all'}
+
+
+def test_reversed_ranges_are_normalised(index):
+    assert index.lookup_range('tcp', 8000, 400) == index.lookup_range('tcp', 400, 8000)
+    assert index.allows_range('web', 'tcp', 8100, 8000)
+    assert parse_port_query('2000-1000') == (1000, 2000)
+
+
+def test_covering_lookup_needs_one_range_over_all_ports(index):
+    assert index.lookup_covering('tcp', 8010, 8020) == {'web', 'all'}
+    assert index.lookup_covering('tcp', 443, 8000) == {'all'}
+    assert index.allows('web', 'tcp', 443)
+    assert not index.allows('web', 'udp', 443)
+    assert not index.allows('empty', 'tcp', 443)
+
+
+def test_lookups_match_a_linear_scan(index):
+    contracts = index.contracts()
+    for protocol in ('tcp', 'udp', 'icmp'):
+        for start, end in [(0, 0), (53, 53), (442, 444), (8050, 9000), (0, MAX_PORT)]:
+            expected = {contract for contract, ranges in contracts.items()
+                        if any(r.protocol in (None, protocol) and r.start <= end and start <= r.end for _, r in ranges)}
+            assert index.lookup_range(protocol, start, end) == expected
+
+
+def test_unspecified_ports_and_filters_without_ip_entries_allow_any_port():
+    assert entry_port_range({'prot': 'tcp', 'dFromPort': 'unspecified', 'dToPort': 'unspecified'}) == PortRange('tcp', 0, MAX_PORT)
+    assert entry_port_range({'prot': 'tcp', 'dFromPort': '80', 'dToPort': 'unspecified'}) == PortRange('tcp', 0, MAX_PORT)
+    assert entry_port_range({'prot': 'tcp', 'dFromPort': 'https', 'dToPort': 'https'}) == PortRange('tcp', 443, 443)
+    assert entry_port_range({'etherT': 'arp'}) is None
+    assert filter_port_ranges({'attributes': {'name': 'empty'}, 'children': []}) == [ANY_PORT_RANGE]
+    assert filter_port_ranges({'attributes': {'name': 'arp'}, 'children': [entry(etherT='arp')]}) == [ANY_PORT_RANGE]
+    assert filter_port_ranges({'attributes': {'name': 'web'}, 'children': [
+        entry(etherT='ip', prot='tcp', dFromPort='443', dToPort='443'), entry(etherT='arp')]}) == [PortRange('tcp', 443, 443)]
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    path = tmp_path / 'index.json'
+    index.save(str(path))
+    loaded = load_port_index(str(path))
+    assert loaded.contracts() == index.contracts()
+    assert loaded.lookup('tcp', 8050) == {'web', 'all'}
@@ -0,0 +1,164 @@
+import csv
+import ipaddress
+import os
+import random
+import re
+import shutil
+import sys
+
+import pytest
+
+import separate_baseline_rules
+from rule_delta import STATE_HEADER, RuleDelta, StateError, load_state, rule_digest, write_state
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+import generate_data  # noqa: E402
+
+
+def test_rule_digest_hashes_cells_as_they_are_written():
+    assert rule_digest(['r1', 'a;b', 'allow']) == rule_digest(('r1', 'a;b', 'allow'))
+    assert rule_digest(['r1', 'a;b', 'allow']) != rule_digest(['r1', 'b;a', 'allow'])
+    assert rule_digest(['r1', 'a', '']) != rule_digest(['r1', '', 'a'])
+    # Missing cells are written empty and DictReader's extra values as a list
+    assert rule_digest(['r1', None, ['x', 'y']]) == rule_digest(['r1', '', "['x', 'y']"])
+
+
+def recorded_delta():
+    delta = RuleDelta()
+    delta.record('r1', rule_digest(['r1', 'a']), ('10.0.0.0/8', 'obj-1'))
+    delta.record('r2', rule_digest(['r2', 'b']))  # Dropped rule
+    delta.record('r3', rule_digest(['r3', 'c']), ('', ''), carried=True)
+    return delta
+
+
+def test_state_round_trip(tmp_path):
+    state_file = str(tmp_path / 'state.bin')
+    context = {'addresses': {'obj-1': '10.0.0.0/8', 'obj-2': None}, 'groups': {'grp-1': frozenset({'10.0.0.0/8'})}}
+    write_state(state_file, 'kind', ['Name', 'Address'], recorded_delta(), context)
+
+    fieldnames, delta, loaded_context = load_state(state_file, 'kind')
+    assert fieldnames == ['Name', 'Address']
+    assert loaded_context == context
+    assert delta.previous_digests == {name: rule_digest(cells) for name, cells in
+                                      [('r1', ['r1', 'a']), ('r2', ['r2', 'b']), ('r3', ['r3', 'c'])]}
+    assert delta.lookup(rule_digest(['r1', 'a'])) == ('10.0.0.0/8', 'obj-1')
+    assert delta.lookup(rule_digest(['r2', 'b'])) is None
+    assert delta.previous_status == {'r1': '10.0.0.0/8', 'r3': ''}
+
+
+@pytest.mark.parametrize('damage', ['flip', 'truncate', 'magic', 'empty'])
+def test_damaged_state_is_rejected(tmp_path, damage):
+    state_file = tmp_path / 'state.bin'
+    write_state(str(state_file), 'kind', ['Name'], recorded_delta(), {})
+    data = bytearray(state_file.read_bytes())
+    if damage == 'flip':
+        data[-5] ^= 0xFF  # Caught by the CRC-32
+    elif damage == 'truncate':
+        del data[-3:]
+    elif damage == 'magic':
+        data[:8] = b'NOTSTATE'
+    else:
+        data = data[:STATE_HEADER.size - 1]
+    state_file.write_bytes(bytes(data))
+    with pytest.raises(StateError):
+        load_state(str(state_file), 'kind')
+
+
+def test_state_of_another_script_or_a_missing_file_is_rejected(tmp_path):
+    state_file = str(tmp_path / 'state.bin')
+    write_state(state_file, 'update_baseline_rules', ['Name'], recorded_delta(), {})
+    with pytest.raises(StateError, match='update_baseline_rules'):
+        load_state(state_file, 'separate_baseline_rules')
+    with pytest.raises(StateError):
+        load_state(str(tmp_path / 'missing.bin'), 'separate_baseline_rules')
+
+
+def test_changed_address_names():
+    previous = {'addresses': {'obj-1': '10.0.0.0/8', 'obj-2': None, 'obj-3': '10.1.0.0/16'},
+                'groups': {'grp-1': frozenset({'10.0.0.0/8'}), 'grp-2': frozenset()}}
+    ip_to_subnet = {'obj-1': '10.0.0.0/8', 'obj-2': '10.2.0.0/16', 'obj-4': None}
+    group_to_subnet = {'grp-1': frozenset({'10.0.0.0/8', '10.2.0.0/16'}), 'grp-3': frozenset()}
+    # obj-2 resolves differently, obj-3 was removed and grp-1 gained a subnet; a new address or group
+    # resolving to nothing, like obj-4 and grp-3, matches no rule differently
+    assert separate_baseline_rules.changed_address_names(previous, ip_to_subnet, group_to_subnet) == {
+        'obj-2', 'obj-3', 'grp-1'}
+
+
+def read_csv_rows(path):
+    with open(path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def rewrite_csv(path, change):
+    # The exports' BOM-prefixed headers are kept as they are
+    with open(path, newline='', encoding='utf-8') as f:
+        header = f.readline()
+        rows = list(csv.reader(f))
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        f.write(header)
+        csv.writer(f).writerows(change(rows))
+
+
+def normalized_results(path):
+    # Subnets and addresses are joined from sets, whose order is not part of the result
+    return [row[:-2] + [frozenset(row[-2].split(';')), frozenset(row[-1].split(';'))] for row in read_csv_rows(path)[1:]]
+
+
+def run(directory, prefix, **delta_options):
+    path = lambda name: os.path.join(directory, name)
+    separate_baseline_rules.main(path('rows.csv'), path('Extraction.csv'), path('groups.csv'), path('addresses.csv'),
+                                 path('Baseline.csv'), prefix, **delta_options)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_delta_run_matches_a_full_recompute(tmp_path, capsys, seed):
+    rng = random.Random(seed)
+    path = lambda name: str(tmp_path / name)
+    generate_data.generate_baseline(path('Baseline.csv'), 30, rng)
+    generate_data.generate_pa_addresses(path('addresses.csv'), 150, rng)
+    generate_data.generate_pa_address_groups(path('groups.csv'), 30, 150, rng)
+    generate_data.generate_pa_extraction(path('Extraction.csv'), 300, 150, 30, rng)
+    generate_data.generate_pa_rows(path('rows.csv'), 300, rng)
+    run(tmp_path, path('previous_'), save_state=True)
+
+    # Modify, add and remove rules, move addresses to other subnets and change group members
+    def change_rules(rows):
+        rows = [row for row in rows if rng.random() > 0.05]
+        for row in rng.sample(rows, 20):
+            row[2] = f'obj-{rng.randrange(150)};grp-{rng.randrange(30)}'
+        return rows + [[f'new-{i}', 'trust', f'obj-{rng.randrange(150)}', 'dmz', 'any', 'ssl', 'tcp-443', 'allow']
+                       for i in range(10)]
+
+    # Addresses move into a baseline boundary or out of the baseline, so their rules' results change
+    with open(path('Baseline.csv'), newline='', encoding='utf-8') as f:
+        boundaries = [row['Boundary'] for row in csv.DictReader(f)]
+
+    def change_addresses(rows):
+        for row in rng.sample(rows, 30):
+            row[2] = rng.choice([str(ipaddress.ip_network(rng.choice(boundaries))[1]), '192.0.2.1'])
+        return rows
+
+    def change_groups(rows):
+        for row in rng.sample(rows, 5):
+            row[3] = f'obj-{rng.randrange(150)}'
+        return rows
+
+    shutil.copy(path('Extraction.csv'), path('previous_Extraction.csv'))
+    rewrite_csv(path('Extraction.csv'), change_rules)
+    rewrite_csv(path('addresses.csv'), change_addresses)
+    rewrite_csv(path('groups.csv'), change_groups)
+
+    run(tmp_path, path('full_'))
+    capsys.readouterr()
+    run(tmp_path, path('state_'), previous_state_file=path('previous_baseline_rules_state.bin'))
+    carried = int(re.search(r'(\d+) results carried forward', capsys.readouterr().out).group(1))
+    run(tmp_path, path('csv_'), previous_extraction_file=path('previous_Extraction.csv'),
+        previous_results_file=path('previous_baseline_rules_filtered.csv'))
+
+    full = normalized_results(path('full_baseline_rules_filtered.csv'))
+    assert carried > 0
+    assert normalized_results(path('state_baseline_rules_filtered.csv')) == full
+    assert normalized_results(path('csv_baseline_rules_filtered.csv')) == full
+    assert read_csv_rows(path('state_baseline_rules_filtered.csv'))[0] == read_csv_rows(path('full_baseline_rules_filtered.csv'))[0]
+    assert (sorted(map(tuple, read_csv_rows(path('state_baseline_rules_delta.csv'))))
+            == sorted(map(tuple, read_csv_rows(path('csv_baseline_rules_delta.csv')))))
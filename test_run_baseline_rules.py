@@ -0,0 +1,12 @@
+import pytest
+
+from run_baseline_rules import load_manifest
+
+
+def test_load_manifest_rejects_a_repeated_data_centre(tmp_path):
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('Data Centre,baseline\nGSU,\nAWS,aws_base.csv\n#EMP,\nGSU,other.csv\n', encoding='utf-8')
+    with pytest.raises(ValueError, match='GSU'):
+        load_manifest(str(manifest))
+    manifest.write_text('Data Centre,baseline\nGSU,\nAWS,aws_base.csv\n', encoding='utf-8')
+    assert [name for name, _ in load_manifest(str(manifest), 'in')] == ['GSU', 'AWS']
@@ -0,0 +1,115 @@
+import ipaddress
+import random
+from functools import lru_cache
+
+import pytest
+
+import subnet_index
+from subnet_index import SubnetIndex, classify_ips
+
+INVALID_VALUES = ['', 'any', 'host.example.com', '10.0.0.1-10.0.0.9', '256.0.0.1', '010.0.0.1', '1.2.3',
+                  '1.2.3.4.5', '10.0.0.1 ', '10.0.0.1/33', 'fe80::1::2', '1.2.3.4/24/8', '１.2.3.4']
+
+
+def random_boundaries(rng):
+    # Nested and overlapping IPv4 prefixes concentrated in 10.0.0.0/8, plus /0, /32 and IPv6 entries
+    boundaries = ['0.0.0.0/0', '10.0.0.0/8', '2001:db8::/32', '2001:db8:1::/48', '2001:db8:1::1/128']
+    for _ in range(60):
+        length = rng.choice([8, 12, 16, 20, 24, 28, 30, 31, 32])
+        address = (10 << 24) | rng.getrandbits(24) if rng.random() < 0.8 else rng.getrandbits(32)
+        boundaries.append(str(ipaddress.ip_network((address, length), strict=False)))
+    boundaries.append(boundaries[-1])  # A repeated boundary keeps its first spelling
+    rng.shuffle(boundaries)
+    return boundaries
+
+
+def random_ips(rng, boundaries):
+    # Addresses on, just inside and just outside every boundary's edges, plus random and invalid values
+    ips = []
+    for boundary in boundaries:
+        network = ipaddress.ip_network(boundary)
+        first, last = int(network.network_address), int(network.broadcast_address)
+        for value in (first - 1, first, first + 1, last - 1, last, last + 1):
+            if 0 <= value < 2 ** network.max_prefixlen:
+                ips.append(str(ipaddress.ip_address(value) if network.version == 4 else ipaddress.IPv6Address(value)))
+    ips += [str(ipaddress.IPv4Address((10 << 24) | rng.getrandbits(24))) for _ in range(200)]
+    ips += [str(ipaddress.IPv4Address(rng.getrandbits(32))) for _ in range(50)]
+    ips += INVALID_VALUES
+    rng.shuffle(ips)
+    return ips
+
+
+parse_network = lru_cache(maxsize=None)(ipaddress.ip_network)
+
+
+def brute_force(boundaries, value):
+    # Most specific containing network; the first spelling of a repeated network wins
+    try:
+        network = ipaddress.ip_network(value.strip(), strict=False)
+    except ValueError:
+        return None
+    best = None
+    for boundary in boundaries:
+        candidate = parse_network(boundary)
+        if candidate.version == network.version and network.subnet_of(candidate):
+            if best is None or candidate.prefixlen > parse_network(best).prefixlen:
+                best = boundary
+    return best
+
+
+def brute_force_address(boundaries, ip):
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        return ""
+    return brute_force(boundaries, ip) or ""
+
+
+def build_index(boundaries):
+    index = SubnetIndex()
+    for boundary in boundaries:
+        index.add(boundary)
+    return index
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_lookup_matches_a_brute_force_scan(seed):
+    rng = random.Random(seed)
+    boundaries = random_boundaries(rng)
+    index = build_index(boundaries)
+    ips = random_ips(rng, boundaries)
+    networks = [f'{ip}/{rng.choice([16, 24, 30])}' for ip in ips[:100] if '.' in ip and ip.strip() == ip]
+    for value in ips + networks + boundaries:
+        assert index.lookup(value) == brute_force(boundaries, value), value
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('use_numpy', [True, False])
+def test_classify_ips_matches_a_brute_force_scan(seed, use_numpy, monkeypatch):
+    if use_numpy:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(subnet_index, 'np', None)
+    rng = random.Random(seed)
+    boundaries = random_boundaries(rng)
+    ips = random_ips(rng, boundaries) + ['2001:db8:1::1', '2001:db8:2::1', '::1']
+    assert classify_ips(ips, build_index(boundaries)) == [brute_force_address(boundaries, ip) for ip in ips]
+
+
+def test_classify_ips_without_boundaries():
+    assert classify_ips(['10.0.0.1', 'bad'], SubnetIndex()) == ['', '']
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_intervals_are_disjoint_and_labelled_with_the_most_specific_boundary(seed):
+    rng = random.Random(seed)
+    boundaries = random_boundaries(rng)
+    segments = build_index(boundaries).intervals(4)
+    # 0.0.0.0/0 is indexed, so the segments tile the whole IPv4 space
+    assert segments[0][0] == 0 and segments[-1][1] == 2 ** 32 - 1
+    for (_, end, _), (start, _, _) in zip(segments, segments[1:]):
+        assert end + 1 == start
+    for start, end, boundary in segments:
+        assert start <= end
+        for value in {start, end, (start + end) // 2}:
+            assert brute_force(boundaries, str(ipaddress.IPv4Address(value))) == boundary
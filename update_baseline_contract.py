@@ -1,19 +1,14 @@
+import argparse
 import csv
 import ipaddress
-import sys
+
+from compliance_store import store_from_env
+from instrumentation import stage
+from subnet_index import classify_ips, load_subnet_index
 
 def load_subnets(file_path):
-    """Load subnets from the GSU_Baseline.csv file."""
-    subnets = {}
-    with open(file_path, mode='r', encoding='utf-8') as file:
-        reader = csv.DictReader(file)
-        for row in reader:
-            try:
-                subnet = ipaddress.ip_network(row['Boundary'])
-                subnets[row['Boundary']] = subnet
-            except ValueError as e:
-                print(f"Error processing subnet: {row['Boundary']} - {e}")
-    return subnets
+    """Load subnets from the GSU_Baseline.csv file into a SubnetIndex."""
+    return load_subnet_index(file_path)
 
 def load_ep_data(file_path):
     """Load endpoint data from the EP_Data_2024_08_15-14_35.csv file."""
@@ -26,43 +21,73 @@ def load_ep_data(file_path):
             ep_data[epg_name] = ip_address
     return ep_data
 
+def classify_ep_data(ep_data, subnets):
+    """Resolve the subnet of every EPG's IP in one vectorized batch."""
+    epg_names = list(ep_data)
+    return dict(zip(epg_names, classify_ips([ep_data[name] for name in epg_names], subnets)))
+
 def find_matching_subnet(ip, subnets):
-    """Find and return the subnet that contains the IP address."""
+    """Find and return the most specific subnet in the SubnetIndex that contains the IP address."""
     try:
         ip_addr = ipaddress.ip_address(ip)
-        for subnet_str, subnet in subnets.items():
-            if ip_addr in subnet:
-                return subnet_str
     except ValueError:
         return ""  # Return an empty string if the IP address is invalid
-    return ""
+    return subnets.lookup_address(ip_addr) or ""
 
-def update_ip_and_subnet(ep_data, subnets, row):
-    """Update the 'IP' and 'Subnet' fields based on the endpoint name and subnets."""
+def match_ep_data(ep_data, baseline_file, store):
+    """Resolve the subnet of every EPG's IP with one indexed join against the baseline subnets in the compliance store."""
+    if not store.is_current(baseline_file, 'subnets'):
+        store.save_subnets(baseline_file, load_subnets(baseline_file).networks())
+    matches = store.match_subnets(baseline_file, ep_data.values())
+    return {name: matches.get(ip, "") for name, ip in ep_data.items()}
+
+def update_ip_and_subnet(ep_data, subnets, row, ep_subnets=None):
+    """Update the 'IP' and 'Subnet' fields based on the endpoint name and subnets.
+
+    When ep_subnets (from classify_ep_data) is given, the subnet is taken from it
+    instead of being resolved per row.
+    """
     endpoint_name = row['Endpoint Name']
     ip = ep_data.get(endpoint_name, "")
-    subnet = find_matching_subnet(ip, subnets) if ip else ""
+    if ep_subnets is not None:
+        subnet = ep_subnets.get(endpoint_name, "")
+    else:
+        subnet = find_matching_subnet(ip, subnets) if ip else ""
     row['IP'] = ip
     row['Subnet'] = subnet
     return row
 
-def main(ep_data_file, baseline_file, contracts_file, output_file):
-    subnets = load_subnets(baseline_file)
-    ep_data = load_ep_data(ep_data_file)  # Load the EP_Data
+def main(ep_data_file, baseline_file, contracts_file, output_file, batch=False):
+    with stage('load_ep_data') as phase:
+        ep_data = load_ep_data(ep_data_file)  # Load the EP_Data
+        phase.rows = len(ep_data)
+
+    # With FVC_STORE set, the subnets are resolved by the compliance store
+    store = store_from_env()
+    subnets = None
+    with stage('match_subnets', rows=len(ep_data)):
+        if store:
+            ep_subnets = match_ep_data(ep_data, baseline_file, store)
+            store.close()
+        else:
+            subnets = load_subnets(baseline_file)
+            ep_subnets = classify_ep_data(ep_data, subnets) if batch else None
 
     # Load the existing baseline contracts CSV file
-    with open(contracts_file, 'r', encoding='utf-8') as file:
+    with stage('load_contracts') as phase, open(contracts_file, 'r', encoding='utf-8') as file:
         reader = csv.DictReader(file)
         rows = list(reader)
+        phase.rows = len(rows)
 
     # Update the IP and Subnet columns in each row
-    updated_rows = []
-    for row in rows:
-        updated_row = update_ip_and_subnet(ep_data, subnets, row)
-        updated_rows.append(updated_row)
+    with stage('update_rows', rows=len(rows)):
+        updated_rows = []
+        for row in rows:
+            updated_row = update_ip_and_subnet(ep_data, subnets, row, ep_subnets)
+            updated_rows.append(updated_row)
 
     # Write the updated rows back to a new CSV file
-    with open(output_file, 'w', encoding='utf-8', newline='') as file:
+    with stage('write_output', rows=len(updated_rows)), open(output_file, 'w', encoding='utf-8', newline='') as file:
         writer = csv.DictWriter(file, fieldnames=reader.fieldnames)
         writer.writeheader()
         writer.writerows(updated_rows)
@@ -70,13 +95,12 @@ def main(ep_data_file, baseline_file, contracts_file, output_file):
     print(f"File '{output_file}' has been generated.")
 
 if __name__ == '__main__':
-    if len(sys.argv) != 5:
-        print("Usage: python script.py <EP_Data_2024_08_15-14_35.csv> <GSU_Baseline.csv> <GSU_baseline_contracts.csv> <output.csv>")
-        sys.exit(1)
-
-    ep_data_file = sys.argv[1]
-    baseline_file = sys.argv[2]
-    contracts_file = sys.argv[3]
-    output_file = sys.argv[4]
+    parser = argparse.ArgumentParser(description="Refresh the IP and Subnet columns of a baseline contracts CSV from EP_Data.")
+    parser.add_argument('ep_data_file', help="Path to EP_Data_2024_08_15-14_35.csv.")
+    parser.add_argument('baseline_file', help="Path to GSU_Baseline.csv.")
+    parser.add_argument('contracts_file', help="Path to GSU_baseline_contracts.csv.")
+    parser.add_argument('output_file', help="Path to the output CSV file.")
+    parser.add_argument('--batch', action='store_true', help="Classify all EPG IPs in one vectorized pass (uses NumPy when available).")
+    args = parser.parse_args()
 
-    main(ep_data_file, baseline_file, contracts_file, output_file)
+    main(args.ep_data_file, args.baseline_file, args.contracts_file, args.output_file, args.batch)
@@ -1,5 +1,12 @@
+import argparse
 import csv
-import sys
+
+from compliance_store import store_from_env
+from instrumentation import stage
+from rule_delta import RuleDelta, StateError, load_state, rule_digest, write_state
+
+# Script name recorded in the state file read by the next delta run
+STATE_KIND = 'update_baseline_rules'
 
 # Function to load Security Zones from GSU_Baseline_Subnet_Zone.csv
 def load_security_zones(zones_file):
@@ -20,17 +27,57 @@ def parse_addresses(address_string):
     address_string = address_string.strip().strip('[]')
     return [item.strip().replace("'", "") for item in address_string.split(',')]
 
-# Function to modify the rules based on zones and addresses
-def modify_rules(rules_file, zones_file, output_file):
+# Function to rebuild the delta state of a previous run from its input rules and output
+def load_previous_run(previous_rules_file, previous_output_file, previous_zones_file=None):
+    previous_digests = {}
+    previous_results = {}
+    previous_status = {}
+    with open(previous_rules_file, 'r', encoding='utf-8') as rules_f, open(previous_output_file, 'r', encoding='utf-8') as output_f:
+        rules_reader = csv.DictReader(rules_f)
+        output_reader = csv.DictReader(output_f)
+        # Every input rule is written to the output in the same order
+        for rule, result in zip(rules_reader, output_reader):
+            # Hash the rule as modify_rules does, before its addresses are rewritten
+            name, digest = rule[rules_reader.fieldnames[0]], rule_digest(rule.values())
+            previous_digests[name] = digest
+            previous_results[digest] = (result.get('Subnet') or '', result.get('Address or Group') or '')
+            previous_status[name] = previous_results[digest][0]
+        fieldnames = rules_reader.fieldnames or []
+
+    # Without the previous zones file, the security zones are assumed unchanged
+    previous = {'zones': frozenset(load_security_zones(previous_zones_file)) if previous_zones_file else None}
+    return fieldnames, RuleDelta(previous_digests, previous_results, previous_status), previous
+
+# Function to modify the rules based on zones and addresses; returns the number of rules written
+def modify_rules(rules_file, zones_file, output_file, delta=None, previous_fieldnames=None, previous_zones=None, state_file=None):
     security_zones = load_security_zones(zones_file)
-
-    with open(rules_file, 'r') as infile, open(output_file, 'w', newline='') as outfile:
-        reader = csv.DictReader(infile)
-        fieldnames = reader.fieldnames
+    # Zones added to or removed from the security zones since the previous run
+    changed_zones = security_zones ^ previous_zones if previous_zones is not None else frozenset()
+
+    # Read the rules from the compliance store when FVC_STORE holds an up-to-date import of rules_file,
+    # and find the rules with a security zone or 'any' zone with one indexed join on the stored zones
+    store = store_from_env()
+    stored = store.read_rules(rules_file) if store else None
+    zone_matches = store.rule_zone_matches(rules_file, security_zones) if stored else None
+
+    with open(rules_file, 'r', encoding='utf-8') as infile, open(output_file, 'w', encoding='utf-8', newline='') as outfile:
+        if stored:
+            fieldnames, reader = stored
+        else:
+            reader = csv.DictReader(infile)
+            fieldnames = reader.fieldnames
         writer = csv.DictWriter(outfile, fieldnames=fieldnames)
         writer.writeheader()
+        rules_written = 0
+        if previous_fieldnames is not None and previous_fieldnames != list(fieldnames):
+            print("The previous rules have different columns; recomputing every rule")
+            delta.previous_results = {}
+
+        for position, row in enumerate(reader):
+            # Hash the rule as it was read, before its addresses are rewritten
+            if delta:
+                name, digest = row[fieldnames[0]], rule_digest(row.values())
 
-        for row in reader:
             # Parse the Source Zone and Destination Zone (comma-separated values)
             source_zones = parse_comma_separated_values(row['Source Zone'])
             destination_zones = parse_comma_separated_values(row['Destination Zone'])
@@ -43,46 +90,107 @@ def modify_rules(rules_file, zones_file, output_file):
             row['Source Address'] = ';'.join(source_addresses)
             row['Destination Address'] = ';'.join(destination_addresses)
 
+            # In delta mode, reuse the result of an unchanged rule unless one of its zones was added or removed
+            if delta:
+                carried = delta.lookup(digest)
+                if carried and changed_zones.isdisjoint(source_zones + destination_zones):
+                    row['Subnet'], row['Address or Group'] = carried
+                    writer.writerow(row)
+                    rules_written += 1
+                    delta.record(name, digest, carried, carried=True)
+                    continue
+
             # Initialize the columns Subnet and Address or Group
             row['Subnet'] = row.get('Subnet', '')
             row['Address or Group'] = row.get('Address or Group', '')
 
+            # A rule is checked for each direction with a security zone or 'any' zone
+            if zone_matches is not None:
+                source_match = (position, 'source') in zone_matches
+                destination_match = (position, 'destination') in zone_matches
+            else:
+                source_match = any(zone in security_zones or zone.lower() == 'any' for zone in source_zones)
+                destination_match = any(zone in security_zones or zone.lower() == 'any' for zone in destination_zones)
+
             # Check Source Zone matches
-            for zone in source_zones:
-                if zone.strip() in security_zones or zone.strip().lower() == 'any':  # Check for security zone match or 'any'
-                    if any(('any' == addr.replace("'", "").lower() or 'rfc-1918' in addr.lower()) and not '[negate]' in addr.lower() for addr in source_addresses):
-                        row['Subnet'] = 'Any Baseline'
-                        row['Address or Group'] = 'Any Baseline'
-                    elif any('[negate] rfc-1918' in addr.lower() for addr in source_addresses):
-                        row['Subnet'] = 'Negate'
-                        row['Address or Group'] = 'Negate'
+            if source_match:
+                if any(('any' == addr.replace("'", "").lower() or 'rfc-1918' in addr.lower()) and not '[negate]' in addr.lower() for addr in source_addresses):
+                    row['Subnet'] = 'Any Baseline'
+                    row['Address or Group'] = 'Any Baseline'
+                elif any('[negate] rfc-1918' in addr.lower() for addr in source_addresses):
+                    row['Subnet'] = 'Negate'
+                    row['Address or Group'] = 'Negate'
 
             # Check Destination Zone matches
-            for zone in destination_zones:
-                if zone.strip() in security_zones or zone.strip().lower() == 'any':  # Check for security zone match or 'any'
-                    if any(('any' == addr.replace("'", "").lower() or 'rfc-1918' in addr.lower()) and not '[negate]' in addr.lower() for addr in destination_addresses):
-                        row['Subnet'] = 'Any Baseline'
-                        row['Address or Group'] = 'Any Baseline'
-                    elif any('[negate] rfc-1918' in addr.lower() for addr in destination_addresses):
-                        row['Subnet'] = 'Negate'
-                        row['Address or Group'] = 'Negate'
+            if destination_match:
+                if any(('any' == addr.replace("'", "").lower() or 'rfc-1918' in addr.lower()) and not '[negate]' in addr.lower() for addr in destination_addresses):
+                    row['Subnet'] = 'Any Baseline'
+                    row['Address or Group'] = 'Any Baseline'
+                elif any('[negate] rfc-1918' in addr.lower() for addr in destination_addresses):
+                    row['Subnet'] = 'Negate'
+                    row['Address or Group'] = 'Negate'
 
             # Write updated row to output file
             writer.writerow(row)
+            rules_written += 1
+            if delta:
+                delta.record(name, digest, (row['Subnet'], row['Address or Group']), carried=False)
+
+    # Save the rule hashes, results and security zones for the next delta run
+    if state_file:
+        write_state(state_file, STATE_KIND, fieldnames, delta, {'zones': frozenset(security_zones)})
+
+    # Export the output to the compliance store when FVC_STORE is set
+    if store:
+        store.import_rules_csv(output_file)
+        store.close()
+    return rules_written
 
 # Main function to handle arguments and call the modify_rules function
 def main():
-    if len(sys.argv) != 3:
-        print("Usage: python script.py <GSU_baseline_rules_filtered.csv> <GSU_Baseline_Subnet_Zone.csv>")
-        sys.exit(1)
-
-    rules_file = sys.argv[1]
-    zones_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="Mark baseline rules matching 'any' or RFC 1918 addresses in baseline security zones.")
+    parser.add_argument('rules_file', help="GSU_baseline_rules_filtered.csv")
+    parser.add_argument('zones_file', help="GSU_Baseline_Subnet_Zone.csv")
+    parser.add_argument('--previous-state', help="updated_baseline_rules_state.bin written by the previous audit; enables delta verification.")
+    parser.add_argument('--previous-rules', help="baseline_rules_filtered.csv of the previous audit; enables delta verification without a state file.")
+    parser.add_argument('--previous-output', help="updated_baseline_rules_filtered.csv of the previous audit.")
+    parser.add_argument('--previous-zones', help="Security zones file of the previous audit (default: assume zones_file is unchanged).")
+    parser.add_argument('--save-state', action='store_true', help="Write updated_baseline_rules_state.bin for the next delta run.")
+    args = parser.parse_args()
+    if bool(args.previous_rules) != bool(args.previous_output):
+        parser.error("--previous-rules and --previous-output must be given together")
+    if args.previous_state and (args.previous_rules or args.previous_zones):
+        parser.error("--previous-state cannot be combined with --previous-rules, --previous-output or --previous-zones")
+
+    rules_file = args.rules_file
+    zones_file = args.zones_file
     output_file = 'updated_baseline_rules_filtered.csv'  # Updated output file name
-
-    modify_rules(rules_file, zones_file, output_file)
+    state_file = 'updated_baseline_rules_state.bin' if args.save_state else None
+
+    # In delta mode, only rules added or modified since the previous run, or using a zone
+    # that was added or removed, are checked again
+    delta = RuleDelta() if state_file else None
+    previous_fieldnames = None
+    previous_zones = None
+    if args.previous_state:
+        with stage('load_previous_state') as phase:
+            try:
+                previous_fieldnames, delta, previous = load_state(args.previous_state, STATE_KIND)
+            except StateError as e:
+                parser.error(str(e))
+            previous_zones = previous['zones']
+            phase.rows = len(delta.previous_digests)
+    elif args.previous_rules:
+        with stage('load_previous_run') as phase:
+            previous_fieldnames, delta, previous = load_previous_run(args.previous_rules, args.previous_output, args.previous_zones)
+            previous_zones = previous['zones']
+            phase.rows = len(delta.previous_digests)
+
+    with stage('modify_rules') as phase:
+        phase.rows = modify_rules(rules_file, zones_file, output_file, delta, previous_fieldnames, previous_zones, state_file)
     print(f"Updated rules saved to {output_file}")
+    if args.previous_state or args.previous_rules:
+        delta.write_report('updated_baseline_rules_delta.csv')
 
 if __name__ == "__main__":
     main()
-